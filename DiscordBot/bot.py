@@ -1,95 +1,367 @@
 # bot.py
 import discord
 from discord.ext import commands
+import asyncio
+import functools
 import os
 import json
 import logging
 import re
+import time
 import requests
-from report import Report, State
+from report import Report, State, PriorityLevel
 import pdb
 from modReport import ModReport, ModState
 from keywords import Keywords
+from keywordStore import KeywordStore
+from flagCountStore import FlagCountStore
+from sessionStore import SessionStore, IDLE
+from sessionPersistence import SessionPersistence
+from outboundDispatcher import OutboundDispatcher, Priority
+from modQueue import ModQueue
+from reactionRouter import ReactionRouter
+from messageResolver import MessageResolver
+from channelRegistry import ChannelRegistry, MONITORED, MOD, REVIEW
+from shardState import ShardState, shard_id_for
 from threePersonReport import ThreePersonReport
-from googleapiclient import discovery
-from openAiFunctions import OpenAIFunctions
+from scoringQueue import ScoringQueue
+from classifier import Classifier
+from classifierPool import ClassifierPool
+from metrics import MetricsServer
+import metrics
+from tracing import TRACER, JsonlExporter, trace_id_for
+from logPipeline import LogPipeline
+import config
 import firebase_admin
 from firebase_admin import firestore
 from firebase_admin import credentials
 
-# Set up logging to the console
 logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
 
 # There should be a file called 'tokens.json' inside the same folder as this file
 token_path = 'tokens.json'
-if not os.path.isfile(token_path):
-    raise Exception(f"{token_path} not found!")
-with open(token_path) as f:
-    # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
-    tokens = json.load(f)
-    discord_token = tokens['discord']
-    openai_api_key = tokens['openai']
 
 
-class ModBot(discord.Client):
-    def __init__(self): 
+def setup_logging(filename='discord.log'):
+    # Set up logging to a rotated file (and the console), written off the event loop
+    pipeline = LogPipeline(
+        filename, config.LOG_LEVELS, config.LOG_MAX_BYTES, config.LOG_BACKUPS,
+        interval=config.LOG_ROTATE_SECONDS, queue_size=config.LOG_QUEUE_SIZE, console_level=config.LOG_CONSOLE_LEVEL,
+    )
+    pipeline.start()
+    metrics.REGISTRY.add_collector('logging', pipeline.stats)
+    return pipeline
+
+def load_tokens(path=token_path):
+    if not os.path.isfile(path):
+        raise Exception(f"{path} not found!")
+    with open(path) as f:
+        # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
+        return json.load(f)
+
+PENDING_SUBCATEGORY = "Classifying..."
+SUBCATEGORY_FIELD = "Subcategory:" # Name of the subcategory field in the auto-flag embed
+QUEUE_KEYWORD = "queue" # Lists the most urgent open reports in the mod channel
+
+
+class ModBot(discord.AutoShardedClient):
+    def __init__(self, tokens, shard_count=None, shard_ids=None, db=None, classifier=None, metrics_port=None, trace_file=None):
+        '''
+        Runs shard_ids out of shard_count gateway shards in this process (every shard if shard_ids is
+        None). When other processes run the remaining shards, report sessions are shared with them
+        through the session database.
+
+        The Firestore client and the classifier are created from config unless they are passed in;
+        a classifier passed in always runs in this process. With a metrics_port, stage timings and
+        component stats are served for Prometheus at http://config.METRICS_HOST:metrics_port/metrics.
+        With a trace_file, spans following each flagged message from ingest to moderator action are
+        appended to it (see tracing.py and traceReport.py).
+        '''
         intents = discord.Intents.default()
         intents.message_content = True
         intents.reactions = True
-        super().__init__(command_prefix='.', intents=intents)
+        super().__init__(command_prefix='.', intents=intents, shard_count=shard_count, shard_ids=shard_ids)
         self.group_num = None
-        self.mod_channels = {} # Map from guild to the mod channel id for that guild
-        self.reports = {} # Map from user IDs to the state of their report
-        self.mod_reports = {} # Map from moderator IDs to the state of their mod report
-        self.three_mod_reports = {} # Map from moderator IDs to the state of their 3 person mod report
-        self.user_flag_counts = {} # Map from user IDs to the number of times they've been flagged
-        self.three_person_review_team = None # The channel where the three person review team is located
-        self.open_ai_functions = OpenAIFunctions(openai_api_key)
-        self.keyword_reports = {} # Map from user IDs to the state of their keyword report
+        self.shard_states = {} # Map from shard ID to the state of that shard's guilds
+        self.channels = ChannelRegistry() # Monitored, mod and review team channels of each guild, by channel ID
+        self.message_resolver = MessageResolver(self, max_entries=config.MESSAGE_CACHE_MAX_ENTRIES, ttl=config.MESSAGE_CACHE_TTL)
+        self.reaction_router = ReactionRouter(self, max_routes=config.REACTION_ROUTES_MAX)
+        self.outbound = OutboundDispatcher(config.OUTBOUND_MAX_IN_FLIGHT, config.OUTBOUND_RATE_LIMITS)
+        # Other processes may write the session database too whenever the shards are picked
+        # explicitly; with shard_count None the total isn't known until Discord recommends one
+        shared_sessions = shard_ids is not None
+        self.session_persistence = SessionPersistence(
+            config.SESSION_DB_PATH, flush_interval=config.SESSION_FLUSH_INTERVAL, shared=shared_sessions
+        )
+        self.reports = self.session_store("report", lambda user_id, state: Report.restore(self, user_id, state)) # Map from user IDs to the state of their report
+        self.mod_reports = self.session_store(
+            "moderation", lambda user_id, state: ModReport.restore(self, user_id, state, self.review_channel_for(state), self.flag_counts)
+        ) # Map from moderator IDs to the state of their mod report
+        self.three_mod_reports = self.session_store(
+            "review team", lambda user_id, state: ThreePersonReport.restore(self, user_id, state, self.review_channel_for(state))
+        ) # Map from moderator IDs to the state of their 3 person mod report
+        self.background_tasks = set() # Keeps fire-and-forget tasks alive until they finish
+        self.handoff_task = None # Picks up work other processes hand off to this one's shards
+        self.keyword_reports = self.session_store("keyword editing") # Map from user IDs to the state of their keyword report
+        # The detection cascade runs in classifier worker processes fed message envelopes, so scoring
+        # and API calls can't hold up the gateway. With no workers it runs in this process instead.
+        self.classifier = classifier
+        self.classifier_pool = None
+        if classifier is None and config.CLASSIFIER_WORKERS > 0:
+            self.classifier_pool = ClassifierPool(
+                tokens,
+                self.handle_verdict,
+                self.apply_subcategory,
+                workers=config.CLASSIFIER_WORKERS,
+                max_pending=config.CLASSIFIER_MAX_PENDING,
+                check_interval=config.CLASSIFIER_CHECK_INTERVAL,
+            )
+        elif classifier is None:
+            self.classifier = Classifier(tokens)
         
         # setup firestore
-        cred = credentials.Certificate('cs152-a1114-firebase-adminsdk-4hhtt-692136946d.json')
-        app = firebase_admin.initialize_app(cred)
-        self.db = firestore.client()
-
-    def increment_flag_count(self, user_id):
-        # Reference to the user document
-        user_ref = self.db.collection('users').document(str(user_id))
-        user_doc = user_ref.get()
-        
-        # Check if the document exists
-        if user_doc.exists:
-            user_ref.update({'flag_counts': firestore.Increment(1)})
+        if db is None:
+            cred = credentials.Certificate('cs152-a1114-firebase-adminsdk-4hhtt-692136946d.json')
+            app = firebase_admin.initialize_app(cred)
+            db = firestore.client()
+        self.db = db
+        self.keyword_store = KeywordStore(self.db, poll_interval=config.KEYWORD_POLL_INTERVAL, on_change=self.set_keywords)
+        self.flag_counts = FlagCountStore(
+            self.db,
+            ttl=config.FLAG_COUNT_CACHE_TTL,
+            flush_interval=config.FLAG_COUNT_FLUSH_INTERVAL,
+            max_pending=config.FLAG_COUNT_MAX_PENDING,
+            max_entries=config.FLAG_COUNT_CACHE_MAX_ENTRIES,
+        )
+        self.trace_file = trace_file
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(metrics.REGISTRY, config.METRICS_HOST, metrics_port)
+        self.register_metrics()
+
+    def register_metrics(self):
+        # Each component's stats() is read into gauges when the metrics endpoint is scraped
+        registry = metrics.REGISTRY
+        registry.add_collector('outbound', self.outbound.stats)
+        registry.add_collector('reaction_router', self.reaction_router.stats)
+        registry.add_collector('message_resolver', self.message_resolver.stats)
+        registry.add_collector('channels', self.channels.stats)
+        registry.add_collector('flag_counts', self.flag_counts.stats)
+        registry.add_collector('tracing', TRACER.stats)
+        for sessions in self.session_stores():
+            registry.add_collector(f"sessions_{sessions.name.replace(' ', '_')}", sessions.stats)
+        if self.classifier_pool is not None:
+            registry.add_collector('classifier_pool', self.classifier_pool.stats)
         else:
-            user_ref.set({'flag_counts': 1})
+            registry.add_collector('classifier', self.classifier.stats)
 
+    def shard_state(self, guild_id):
+        '''
+        The state of the shard a guild's events arrive on, created the first time it is needed.
+        Only used for guilds this process runs (see runs_guild()), so each flagged message has one
+        mod queue entry; reports and resolutions about other guilds are handed off instead.
+        '''
+        shard_id = shard_id_for(guild_id, self.shard_count)
+        state = self.shard_states.get(shard_id)
+        if state is None:
+            scoring_queue = None
+            if self.classifier is not None:
+                scoring_queue = ScoringQueue(
+                    self.classifier.classify,
+                    self.handle_verdict,
+                    max_batch_size=config.SCORING_BATCH_SIZE,
+                    max_wait=config.SCORING_BATCH_WINDOW,
+                    max_queue_size=config.SCORING_QUEUE_SIZE,
+                    max_batches=config.SCORING_MAX_BATCHES,
+                )
+            state = ShardState(
+                shard_id,
+                scoring_queue,
+                ModQueue(
+                    self.outbound,
+                    resolved_ttl=config.MOD_QUEUE_RESOLVED_TTL,
+                    open_ttl=config.MOD_QUEUE_OPEN_TTL,
+                    sweep_interval=config.MOD_QUEUE_SWEEP_INTERVAL,
+                ), # Open mod-channel reports keyed by flagged message ID
+            )
+            state.start()
+            self.shard_states[shard_id] = state
+            metrics.REGISTRY.add_collector(f'shard_{shard_id}', state.stats)
+        return state
+
+    def session_store(self, name, restore=None):
+        # Sessions with a restore function are persisted so they survive a restart
+        return SessionStore(
+            name,
+            idle_timeout=config.SESSION_IDLE_TIMEOUT,
+            max_entries=config.SESSION_MAX_ENTRIES,
+            sweep_interval=config.SESSION_SWEEP_INTERVAL,
+            on_evict=functools.partial(self.notify_session_expired, name),
+            persistence=self.session_persistence if restore else None,
+            restore=restore,
+        )
 
-    async def on_ready(self):
-        print(f'{self.user.name} has connected to Discord! It is these guilds:')
-        for guild in self.guilds:
-            print(f' - {guild.name}')
-        print('Press Ctrl-C to quit.')
+    def session_stores(self):
+        return [self.reports, self.mod_reports, self.three_mod_reports, self.keyword_reports]
+
+    async def notify_session_expired(self, name, user_id, session, reason):
+        user = self.get_user(user_id) or await self.fetch_user(user_id)
+        if reason == IDLE:
+            await self.outbound.send(user, f"Your {name} session was closed because it was inactive for too long. You can start again at any time.", priority=Priority.LOW)
+        else:
+            await self.outbound.send(user, f"Your {name} session was closed because too many sessions are open right now. Please try again shortly.", priority=Priority.LOW)
+
+    def increment_flag_count(self, user_id):
+        # Buffered and written to Firestore in batches by the flag count store
+        self.flag_counts.increment(user_id)
 
+    async def setup_hook(self):
         # Parse the group number out of the bot's name
         match = re.search('[gG]roup (\d+) [bB]ot', self.user.name)
         if match:
             self.group_num = match.group(1)
         else:
             raise Exception("Group number not found in bot's name. Name format should be \"Group # Bot\".")
+        self.channels.set_group(self.group_num)
+        await self.start_services()
 
-        # Find the mod channel in each guild that this bot should report to
+    async def start_services(self):
+        '''
+        Starts every background component. Kept apart from setup_hook so the bot can run without a
+        Discord connection, e.g. in replayBenchmark.py.
+        '''
+        if self.classifier_pool is not None:
+            self.classifier_pool.start()
+        else:
+            await self.classifier.start()
+        # Pushes the keyword list to the classifier before the first message arrives
+        await self.keyword_store.start()
+        self.flag_counts.start()
+        for sessions in self.session_stores():
+            sessions.start()
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        if self.session_persistence.shared:
+            self.handoff_task = asyncio.create_task(self.run_handoffs())
+        if self.trace_file is not None:
+            TRACER.start(JsonlExporter(self.trace_file), max_marks=config.TRACE_MAX_MARKS)
+
+    async def close(self):
+        await self.stop_services()
+        await super().close()
+
+    async def stop_services(self):
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        for sessions in self.session_stores():
+            await sessions.stop()
+        for state in list(self.shard_states.values()):
+            await state.stop()
+        await self.keyword_store.stop()
+        # Write out any buffered flag counts before shutting down
+        await self.flag_counts.stop()
+        if self.handoff_task is not None:
+            self.handoff_task.cancel()
+            try:
+                await self.handoff_task
+            except asyncio.CancelledError:
+                pass
+            self.handoff_task = None
+        if self.classifier_pool is not None:
+            await self.classifier_pool.stop()
+        else:
+            await self.classifier.close()
+        self.session_persistence.close()
+        await self.outbound.stop()
+        # Waits for the trace writer to get the last spans onto disk
+        await asyncio.to_thread(TRACER.stop)
+
+    async def on_ready(self):
+        print(f'{self.user.name} has connected to Discord! It is these guilds:')
         for guild in self.guilds:
-            for channel in guild.text_channels:
-                if channel.name == f'group-{self.group_num}-mod':
-                    self.mod_channels[guild.id] = channel
-                
-                if channel.name == f'group-{self.group_num}-3-person-review-team':
-                    self.three_person_review_team = channel
-        
+            print(f' - {guild.name}')
+        print('Press Ctrl-C to quit.')
+
+    # The channel registry is kept up to date one guild or channel at a time as Discord reports them
+    async def on_guild_available(self, guild):
+        self.channels.add_guild(guild)
+
+    async def on_guild_join(self, guild):
+        self.channels.add_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        self.channels.remove_guild(guild)
+
+    async def on_guild_channel_create(self, channel):
+        self.channels.add_channel(channel)
+
+    async def on_guild_channel_update(self, before, after):
+        self.channels.update_channel(before, after)
+
+    async def on_guild_channel_delete(self, channel):
+        self.channels.remove_channel(channel)
+
+    def runs_guild(self, guild_id):
+        # Whether this process runs the shard the guild's events arrive on
+        return self.shard_ids is None or shard_id_for(guild_id, self.shard_count) in self.shard_ids
+
+    async def forward_report(self, report):
+        '''
+        Posts a finished user report to its guild's mod channel. Reports come in over DM, which only
+        the process running shard 0 receives, so a report about a guild on another process's shard
+        is handed off to that process. Its mod queue then merges the report with the auto-flags
+        and other reports of the message, and lists and resolves them together.
+        '''
+        guild_id = report.message.guild.id
+        if not self.runs_guild(guild_id):
+            TRACER.event(report.trace_id, 'handed_off', shard_id=shard_id_for(guild_id, self.shard_count))
+            await self.hand_off(guild_id, 'report', {'reporter_id': report.reporter.id, 'report': report.to_state()})
+            return
+        mod_channel = self.channels.mod_channel(guild_id)
+        if mod_channel is None:
+            logger.warning(f"No mod channel in guild {report.message.guild.id} for the report of message {report.message.id}")
+            return
+        await report.send_report_to_mod_channel(mod_channel)
+
+    async def hand_off(self, guild_id, kind, payload):
+        # Left in the shared session database for the process running the guild's shard
+        shard_id = shard_id_for(guild_id, self.shard_count)
+        await asyncio.to_thread(self.session_persistence.hand_off, shard_id, kind, payload)
+
+    async def run_handoffs(self):
+        while True:
+            await asyncio.sleep(config.HANDOFF_POLL_INTERVAL)
+            try:
+                handoffs = await asyncio.to_thread(self.session_persistence.take_handoffs, self.shard_ids)
+            except Exception:
+                logger.exception("Failed to read work handed off by other processes")
+                continue
+            for kind, payload in handoffs:
+                try:
+                    await self.take_handoff(kind, payload)
+                except Exception:
+                    logger.exception(f"Failed to handle a handed off {kind}")
+
+    async def take_handoff(self, kind, payload):
+        if kind == 'report':
+            try:
+                report = await Report.restore(self, payload['reporter_id'], payload['report'])
+            except discord.errors.NotFound:
+                # The message or the reporter is gone, so there's nothing left to review
+                return
+            await self.forward_report(report)
+        elif kind == 'resolve':
+            self.shard_state(payload['guild_id']).mod_queue.resolve(payload['message_id'], payload['outcome'])
+
+    def review_channel_for(self, state):
+        # Sessions are restored with the review team channel of the guild they were started in
+        guild_id = self.channels.guild_of(state.get('mod_channel'))
+        channel = self.channels.review_channel(guild_id)
+        if channel is None and state.get('review_channel') is not None:
+            # The guild is on a shard run by another process, so send to the channel by ID
+            channel = self.get_partial_messageable(state['review_channel'])
+        return channel
+
 
     async def on_message(self, message):
         '''
@@ -104,83 +376,120 @@ class ModBot(discord.Client):
         if message.guild:
             await self.handle_channel_message(message)
         else:
-            await self.handle_dm(message)
+            with metrics.timed('dm_handling'):
+                await self.handle_dm(message)
+
+    async def on_raw_message_delete(self, payload):
+        # A flagged message that was deleted no longer needs review
+        self.shard_state(payload.guild_id).mod_queue.resolve(payload.message_id, "Message was deleted")
+        self.reaction_router.forget_message(payload.message_id)
+        self.message_resolver.invalidate(payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            self.shard_state(payload.guild_id).mod_queue.resolve(message_id, "Message was deleted")
+            self.reaction_router.forget_message(message_id)
+            self.message_resolver.invalidate(message_id)
+
+    async def on_raw_message_edit(self, payload):
+        # The cached copy has the old content, so fetch it again next time it's needed
+        self.message_resolver.invalidate(payload.message_id)
 
     async def on_raw_reaction_add(self, payload):
         '''
         This function is called whenever a message has a reaction added to it.
         '''
-        # Get channel that reaction is in
-        channel = self.get_channel(payload.channel_id)
-        if channel is None:
-            channel = await self.fetch_channel(payload.channel_id)
-        
-        # Get message that was reacted to
-        try:
-            message = await channel.fetch_message(payload.message_id)
-        except discord.NotFound:
-            # If the message is not found, possibly deleted
-            return
-        except discord.Forbidden:
-            # The bot does not have permissions to access message
-            return
-        
-        # Only listen for reactions to messages made by the bot
-        if message.author.id != self.user.id:
-            return
-        
         if payload.user_id == self.user.id:
             # ignore reactions premade by the bot
             # print('reaction by bot, ignoring!')
             return
 
-        
-        # If reaction is made to a private DM for a user that's currently in reporting flow
-        if not payload.guild_id and (payload.user_id in self.reports or payload.user_id in self.keyword_reports):
-            if payload.user_id in self.keyword_reports:
-                await self.keyword_reports[payload.user_id].handle_reaction(payload, message)
-                if self.keyword_reports[payload.user_id].keywords_done():
-                    self.keyword_reports.pop(payload.user_id)
-            else:
-                # Let user report class handle the reaction
-                await self.reports[payload.user_id].handle_reaction(payload, message)
-
-                # If the report is complete, forward to mod channel and remove it from our map
-                if self.reports[payload.user_id].report_complete():
-                    # update the count of times the user has been flagged
-                    flagged_user_id = self.reports[payload.user_id].message.author.id
-
-                    # increment the flag count in firestore
-                    self.increment_flag_count(flagged_user_id)
-
-                    # increment the flag count in memory for debugging
-                    if flagged_user_id in self.user_flag_counts:
-                        self.user_flag_counts[flagged_user_id] += 1
-                    else:
-                        self.user_flag_counts[flagged_user_id] = 1
-
-                    mod_channel = self.mod_channels[self.reports[payload.user_id].message.guild.id]
-                    await self.reports[payload.user_id].send_report_to_mod_channel(mod_channel)
-                    self.reports.pop(payload.user_id)
-
-                # If the report is cancelled, just remove it from the map
-                elif self.reports[payload.user_id].report_cancelled():
-                    self.reports.pop(payload.user_id)
-        # elif message.channel.name == f'group-{self.group_num}-mod':
-        elif not payload.guild_id and payload.user_id in self.mod_reports:
-            await self.mod_reports[payload.user_id].handle_reaction(payload, message)
+        with metrics.timed('reaction_handling'):
+            await self.handle_reaction(payload)
+
+    async def handle_reaction(self, payload):
+        # Reactions on a prompt that a session is waiting on are routed without fetching anything
+        route = self.reaction_router.route(payload)
+        if route is None:
+            # Every reporting flow runs in DMs, so reactions in servers can be dropped straight away
+            if payload.guild_id:
+                return
+
+            # Bring back any session this user had open before the bot restarted
+            for sessions in (self.reports, self.mod_reports, self.three_mod_reports):
+                await sessions.restore_session(payload.user_id)
+                self.reaction_router.register(sessions, payload.user_id)
+            route = self.reaction_router.route(payload)
+
+        if route is not None:
+            sessions, user_id = route
+            # Another shard process may have moved the session on since the prompt was indexed
+            await sessions.restore_session(user_id)
+            if user_id not in sessions:
+                return
+            message = self.reaction_router.partial_message(payload.channel_id, payload.message_id)
+        else:
+            # If reaction is made to a private DM for a user that's currently in a flow
+            sessions = self.reaction_sessions(payload.user_id)
+            if sessions is None:
+                return
+            user_id = payload.user_id
+
+            # Not the prompt the session is waiting on, so only listen if the bot wrote the message
+            message = await self.reaction_router.fetch_message(payload.channel_id, payload.message_id)
+            if message is None or message.author.id != self.user.id:
+                return
+
+        session = sessions[user_id]
+        # Steps of sessions about a flagged message are spans of its trace; others aren't recorded
+        with TRACER.span(getattr(session, 'trace_id', None), 'session_step', flow=sessions.name, user_id=user_id, state=session.state.name, emoji=str(payload.emoji)) as span:
+            await session.handle_reaction(payload, message)
+            span.set('next_state', session.state.name)
+
+        if sessions is self.keyword_reports:
+            if self.keyword_reports[user_id].keywords_done():
+                self.keyword_reports.pop(user_id)
+
+        elif sessions is self.reports:
+            # If the report is complete, forward to mod channel and remove it from our map
+            if self.reports[user_id].report_complete():
+                # update the count of times the user has been flagged
+                flagged_user_id = self.reports[user_id].message.author.id
+
+                # increment the flag count in firestore
+                self.increment_flag_count(flagged_user_id)
+
+                await self.forward_report(self.reports[user_id])
+                self.reports.pop(user_id)
+
+            # If the report is cancelled, just remove it from the map
+            elif self.reports[user_id].report_cancelled():
+                self.reports.pop(user_id)
 
+        elif sessions is self.mod_reports:
             # if the report is complete or cancelled or was forwarded to the 3 person team, remove it from our map
-            if self.mod_reports[payload.user_id].report_complete() or self.mod_reports[payload.user_id].report_in_review_team():
-                self.mod_reports.pop(payload.user_id)
-        
-        elif not payload.guild_id and payload.user_id in self.three_mod_reports:
-            await self.three_mod_reports[payload.user_id].handle_reaction(payload, message)
+            if self.mod_reports[user_id].report_in_review_team():
+                self.resolve_queue_item(self.mod_reports.pop(user_id), f"Forwarded to the review team by <@{user_id}>")
+            elif self.mod_reports[user_id].report_complete():
+                self.resolve_queue_item(self.mod_reports.pop(user_id), f"Resolved by <@{user_id}>")
 
-            if self.three_mod_reports[payload.user_id].report_complete():
-                self.three_mod_reports.pop(payload.user_id)
-        
-        return
+        elif sessions is self.three_mod_reports:
+            if self.three_mod_reports[user_id].report_complete():
+                self.resolve_queue_item(self.three_mod_reports.pop(user_id), f"Resolved by the review team (<@{user_id}>)")
+
+        self.track_session(sessions, user_id)
+
+    def reaction_sessions(self, user_id):
+        # Which flow a reaction belongs to when it isn't on an indexed prompt, in order of precedence
+        for sessions in (self.keyword_reports, self.reports, self.mod_reports, self.three_mod_reports):
+            if user_id in sessions:
+                return sessions
+        return None
+
+    def track_session(self, sessions, user_id):
+        # After every transition: save the session and index the prompt it is now waiting on
+        sessions.persist(user_id)
+        self.reaction_router.register(sessions, user_id)
 
 
     async def handle_dm(self, message):
@@ -189,16 +498,18 @@ class ModBot(discord.Client):
             reply =  "Use the `report` command to begin the reporting process.\n"
             reply += "Use the `cancel` command to cancel the report process.\n"
             reply += "Use the `keywords` command to edit keywords or regular expressions that will trigger a report.\n"
-            await message.channel.send(reply)
+            await self.outbound.send(message.channel, reply, priority=Priority.LOW)
             return
 
         author_id = message.author.id
         responses = []
+        await self.reports.restore_session(author_id)
 
         if author_id in self.keyword_reports:
             await self.keyword_reports[author_id].handle_message(message)
             if self.keyword_reports[author_id].keywords_done():
                 self.keyword_reports.pop(author_id)
+            self.track_session(self.keyword_reports, author_id)
 
         # Only respond to messages if they're part of a reporting flow
         if author_id not in self.reports and not (message.content.startswith(Report.START_KEYWORD) or message.content.startswith(Keywords.START_KEYWORD)):
@@ -211,6 +522,7 @@ class ModBot(discord.Client):
             await self.keyword_reports[author_id].handle_message(message)
             if self.keyword_reports[author_id].keywords_done():
                 self.keyword_reports.pop(author_id)
+            self.track_session(self.keyword_reports, author_id)
         else:
             # If we don't currently have an active report for this user, add one
             if author_id not in self.reports:
@@ -221,43 +533,33 @@ class ModBot(discord.Client):
 
             # If the report is complete or cancelled, remove it from our map
             if self.reports[author_id].report_complete():
-                mod_channel = self.mod_channels[self.reports[author_id].message.guild.id]
-                await self.reports[author_id].send_report_to_mod_channel(mod_channel)
+                await self.forward_report(self.reports[author_id])
                 self.reports.pop(author_id)
             # If the report is cancelled, just remove it from the map
             elif self.reports[author_id].report_cancelled():
                 self.reports.pop(author_id)
+            self.track_session(self.reports, author_id)
         
         return
 
     async def handle_channel_message(self, message):
+        role = self.channels.role(message.channel.id)
         # If in group-16 channel, evaluate the message and forward to mod channel if above threshold
-        if message.channel.name == f'group-{self.group_num}':
-            # first check if there are any keywords that should raise a flag. If so, flag it to mod channel. If not, check for identity attack with perspective API
-            keywords_ref = self.db.collection('config').document('keywords')
-            keywords_doc = keywords_ref.get()
-            keywords_list = []
-            if keywords_doc.exists:
-                keywords_list = keywords_doc.to_dict().get('keywords_list', [])
-
-            for keyword in keywords_list:
-                if keyword.lower() in message.content.lower():
-                    await self.send_report_to_mod_channel(message, "Manual Keyword", 1, self.mod_channels[message.guild.id])
-                    return
-
-            scores = self.eval_text(message.content)
-            identity_attack_score = scores['IDENTITY_ATTACK']
-            if identity_attack_score > 0.5:
-                subcategory = self.open_ai_functions.detect_subcategory(message.content)
-                mod_channel = self.mod_channels[message.guild.id]
-                await self.send_report_to_mod_channel(message, subcategory, identity_attack_score, mod_channel)
-        elif message.channel.name == f'group-{self.group_num}-mod':
+        if role == MONITORED:
+            # Hand the message to the classifier, which runs the detection cascade (keywords, local
+            # model, Perspective, LLM) in micro-batches
+            TRACER.mark(trace_id_for(message.id))
+            await self.classify(message)
+        elif role == MOD and message.content == QUEUE_KEYWORD:
+            await self.send_pending_queue(message.channel)
+        elif role == MOD:
             # This is a message from a moderator in the mod channel
             # Let the ModReport class handle this message
             # If we don't currently have an active report for this user, add one
             author_id = message.author.id
+            await self.mod_reports.restore_session(author_id)
             if author_id not in self.mod_reports:
-                self.mod_reports[author_id] = ModReport(self, self.three_person_review_team, self.user_flag_counts, self.db)
+                self.mod_reports[author_id] = ModReport(self, self.channels.review_channel(message.guild.id), self.flag_counts)
 
             # Let the report class handle this message
             await self.mod_reports[author_id].handle_message(message)
@@ -265,55 +567,109 @@ class ModBot(discord.Client):
             # If the report is complete or cancelled, remove it from our map
             if self.mod_reports[author_id].report_complete():
                 self.mod_reports.pop(author_id)
+            self.track_session(self.mod_reports, author_id)
 
 
             # mod_report = ModReport(self)
             # await mod_report.handle_message(message)
             # self.mod_reports[message.author.id] = mod_report
         # mod message in 3 person team channel
-        elif message.channel.name == f'group-{self.group_num}-3-person-review-team':
+        elif role == REVIEW:
             author_id = message.author.id
+            await self.three_mod_reports.restore_session(author_id)
             if author_id not in self.three_mod_reports:
-                self.three_mod_reports[author_id] = ThreePersonReport(self, self.three_person_review_team)
+                self.three_mod_reports[author_id] = ThreePersonReport(self, self.channels.review_channel(message.guild.id))
 
             await self.three_mod_reports[author_id].handle_message(message)
 
             if self.three_mod_reports[author_id].report_complete():
                 self.three_mod_reports.pop(author_id)
+            self.track_session(self.three_mod_reports, author_id)
 
-    
-    def eval_text(self, message):
-        ''''
-        TODO: Once you know how you want to evaluate messages in your channel, 
-        insert your code here! This will primarily be used in Milestone 3. 
-        '''
-        api_key = tokens['perspective']  # Make sure your 'tokens.json' file includes the Perspective API key
-        client = discovery.build(
-            "commentanalyzer",
-            "v1alpha1",
-            developerKey=api_key,
-            discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-            static_discovery=False,
-        )
 
-        analyze_request = {
-            'comment': {'text': message},
-            'requestedAttributes': {
-                'TOXICITY': {},
-                'SEVERE_TOXICITY': {},
-                'IDENTITY_ATTACK': {}
-            }
-        }
+    def resolve_queue_item(self, mod_report, outcome):
+        # A moderator finished reviewing a flagged message, so mark its mod-channel report as handled
+        if mod_report.flagged_message is None or mod_report.cancelled:
+            return
+        guild_id = getattr(mod_report.flagged_message.guild, "id", None)
+        if guild_id is not None and not self.runs_guild(guild_id):
+            # Reviews continue over DM on the process running shard 0; the report is queued on the guild's process
+            payload = {'guild_id': guild_id, 'message_id': mod_report.flagged_message.id, 'outcome': outcome}
+            self.run_in_background(self.hand_off(guild_id, 'resolve', payload))
+            return
+        self.shard_state(guild_id).mod_queue.resolve(mod_report.flagged_message.id, outcome)
 
-        response = client.comments().analyze(body=analyze_request).execute()
+    async def send_pending_queue(self, channel):
+        items = self.shard_state(channel.guild.id).mod_queue.pending(config.MOD_QUEUE_LIST_SIZE)
+        if not items:
+            await self.outbound.send(channel, "There are no open reports.", priority=Priority.LOW)
+            return
+        lines = ["Open reports, most urgent first:"]
+        for i, item in enumerate(items, 1):
+            link = item.message.jump_url if item.message else item.flagged_message.jump_url
+            lines.append(f"{i}. [{item.priority.value}] {item.reports} report(s) - {link}")
+        await self.outbound.send(channel, "\n".join(lines), priority=Priority.LOW)
+
+    def set_keywords(self, keywords_list):
+        # Called by the keyword store whenever the list changes in Firestore
+        if self.classifier_pool is not None:
+            self.classifier_pool.set_keywords(keywords_list)
+        else:
+            self.classifier.set_keywords(keywords_list)
 
-        scores = {
-            'TOXICITY': response['attributeScores']['TOXICITY']['summaryScore']['value'],
-            'SEVERE_TOXICITY': response['attributeScores']['SEVERE_TOXICITY']['summaryScore']['value'],
-            'IDENTITY_ATTACK': response['attributeScores']['IDENTITY_ATTACK']['summaryScore']['value']
-        }
-        return scores
+    async def classify(self, message):
+        if self.classifier_pool is not None:
+            # Only an envelope of IDs, author and content crosses to the worker processes
+            await self.classifier_pool.put(message)
+        else:
+            await self.shard_state(message.guild.id).scoring_queue.put(message)
+
+    def run_in_background(self, coro):
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def fill_subcategory(self, message):
+        '''
+        Classifies the flagged message and edits the subcategory into the mod-channel embed that was
+        already posted for it.
+        '''
+        subcategory = await self.classifier.detect_subcategory(message.content)
+        await self.apply_subcategory(message, subcategory)
+
+    async def apply_subcategory(self, message, subcategory):
+        # The mod channel post went out before its category was known, so the trace gets it now
+        TRACER.event(trace_id_for(message.id), 'categorized', category=subcategory)
+        self.shard_state(message.guild.id).mod_queue.set_field(message.id, SUBCATEGORY_FIELD, subcategory)
 
+    async def handle_verdict(self, message, result):
+        '''
+        Called by the scoring queue or the classifier pool once the detection cascade has decided on a
+        monitored-channel message.
+        '''
+        started = TRACER.take_mark(trace_id_for(message.id))
+        if not result.flagged:
+            return
+        # Flagged messages start their trace with the time from arriving to being flagged
+        TRACER.record(
+            trace_id_for(message.id), 'classify', started or time.time(), time.time(),
+            guild_id=message.guild.id, author_id=message.author.id, score=result.score, score_name=result.score_name, label=result.label,
+        )
+        # A moderator will probably review this user soon, so have their flag count ready
+        self.flag_counts.warm(message.author.id)
+        mod_channel = self.channels.mod_channel(message.guild.id)
+        if mod_channel is None:
+            logger.warning(f"No mod channel in guild {message.guild.id} for flagged message {message.id}")
+            return
+        if result.label is not None:
+            await self.send_report_to_mod_channel(message, result.label, result.score, mod_channel, result.score_name)
+            return
+        # Post the report right away and fill in the subcategory once the classifier answers
+        await self.send_report_to_mod_channel(message, PENDING_SUBCATEGORY, result.score, mod_channel, result.score_name)
+        if self.classifier is not None:
+            # Classifier workers send the subcategory on their own
+            self.run_in_background(self.fill_subcategory(message))
     
     def code_format(self, text):
         ''''
@@ -323,7 +679,7 @@ class ModBot(discord.Client):
         '''
         return "Evaluated: '" + text+ "'"
     
-    async def send_report_to_mod_channel(self, message, subcategory, score, mod_channel):
+    async def send_report_to_mod_channel(self, message, subcategory, score, mod_channel, score_name="Identity Attack Score"):
         priority = "Low"
         if score > 0.7:
             priority = "Medium"
@@ -344,11 +700,24 @@ class ModBot(discord.Client):
         )
         embed.add_field(name="Message Content", value=f"```{message.author.name}: {message.content}```", inline=False)
         embed.add_field(name="Priority", value=priority, inline=True)
-        embed.add_field(name="Identity Attack Score", value=score, inline=True)
-        embed.add_field(name="Subcategory:", value=subcategory, inline=False)
+        embed.add_field(name=score_name, value=score, inline=True)
+        embed.add_field(name=SUBCATEGORY_FIELD, value=subcategory, inline=False)
+
+        # Merged into the existing embed if users have already reported this message
+        with metrics.timed('mod_channel_send'), TRACER.span(trace_id_for(message.id), 'mod_channel_post', source='auto', category=subcategory, priority=priority):
+            return await self.shard_state(message.guild.id).mod_queue.post(message, mod_channel, embed, PriorityLevel(priority), label="Automatically flagged")
+
 
-        await mod_channel.send(embed=embed)
+def run(shard_ids=config.SHARD_IDS, shard_count=config.SHARD_COUNT, log_file='discord.log', metrics_port=config.METRICS_PORT, trace_file=config.TRACE_FILE):
+    log_pipeline = setup_logging(log_file)
+    try:
+        tokens = load_tokens()
+        client = ModBot(tokens, shard_count=shard_count, shard_ids=shard_ids, metrics_port=metrics_port, trace_file=trace_file)
+        # log_handler=None stops discord.py from adding its own console handler and resetting the levels
+        client.run(tokens['discord'], log_handler=None)
+    finally:
+        log_pipeline.stop()
 
 
-client = ModBot()
-client.run(discord_token)
\ No newline at end of file
+if __name__ == '__main__':
+    run()
\ No newline at end of file
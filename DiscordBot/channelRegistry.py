@@ -0,0 +1,92 @@
+# channelRegistry.py
+MONITORED = 'monitored'
+MOD = 'mod'
+REVIEW = 'review'
+
+
+class ChannelRegistry:
+    '''
+    Map from channel ID to the role it plays for this bot (the monitored channel, the mod channel
+    or the three-person review team channel) and from each guild to its channels of each role.
+
+    It is kept up to date from guild and channel events, one guild or channel at a time, so routing
+    a message is a single dict lookup and startup doesn't scan every channel of every guild at once.
+    '''
+
+    def __init__(self):
+        self.names = {} # Map from channel name to role, set once the group number is known
+        self.roles = {} # Map from channel ID to (guild ID, role)
+        self.guilds = {} # Map from guild ID to {role: channel}
+
+    def stats(self):
+        return {'guilds': len(self.guilds), 'channels': len(self.roles)}
+
+    def set_group(self, group_num):
+        self.names = {
+            f'group-{group_num}': MONITORED,
+            f'group-{group_num}-mod': MOD,
+            f'group-{group_num}-3-person-review-team': REVIEW,
+        }
+
+    # Lookups ------------------------------------------------------------------
+
+    def role(self, channel_id):
+        entry = self.roles.get(channel_id)
+        return entry[1] if entry else None
+
+    def channel(self, guild_id, role):
+        return self.guilds.get(guild_id, {}).get(role)
+
+    def mod_channel(self, guild_id):
+        return self.channel(guild_id, MOD)
+
+    def review_channel(self, guild_id):
+        return self.channel(guild_id, REVIEW)
+
+    def guild_of(self, channel_id):
+        entry = self.roles.get(channel_id)
+        return entry[0] if entry else None
+
+    # Events -------------------------------------------------------------------
+
+    def add_guild(self, guild):
+        # Called as each guild becomes available, so only that guild's channels are looked at
+        for channel in guild.text_channels:
+            self.add_channel(channel)
+
+    def remove_guild(self, guild):
+        channels = list(self.guilds.pop(guild.id, {}).values()) + list(guild.text_channels)
+        for channel in channels:
+            self.roles.pop(channel.id, None)
+
+    def add_channel(self, channel):
+        role = self.names.get(getattr(channel, 'name', None))
+        if role is None or getattr(channel, 'guild', None) is None:
+            return
+        # Every channel with a matching name routes messages, but the first one in each guild is the
+        # one reports are sent to so it doesn't flip between duplicates
+        self.roles[channel.id] = (channel.guild.id, role)
+        guild_channels = self.guilds.setdefault(channel.guild.id, {})
+        previous = guild_channels.get(role)
+        if previous is None or previous.id == channel.id:
+            guild_channels[role] = channel
+
+    def remove_channel(self, channel):
+        entry = self.roles.pop(channel.id, None)
+        if entry is None:
+            return
+        guild_id, role = entry
+        guild_channels = self.guilds.get(guild_id, {})
+        if guild_channels.get(role) is not None and guild_channels[role].id == channel.id:
+            del guild_channels[role]
+            # Another channel with the same name can take over the role
+            for other in getattr(channel.guild, 'text_channels', []):
+                if other.id != channel.id and self.roles.get(other.id) == (guild_id, role):
+                    guild_channels[role] = other
+                    break
+
+    def update_channel(self, before, after):
+        # Renames can move a channel into or out of a role
+        if before.name != after.name:
+            self.remove_channel(before)
+        self.add_channel(after)
@@ -0,0 +1,147 @@
+# classifier.py
+import asyncio
+import os
+import metrics
+from keywordMatcher import KeywordMatcher
+from perspectiveClient import PerspectiveClient
+from scoreCache import ScoreCache
+from localClassifier import LocalClassifier
+from detectionCascade import DetectionCascade, Stage
+from openAiFunctions import OpenAIFunctions, FALLBACK_SUBCATEGORY
+import config
+
+HATE_SUBCATEGORIES = ['racism', 'sexism', 'homophobia', 'transphobia', 'xenophobia']
+
+
+class Classifier:
+    '''
+    The detection cascade (keywords, local model, Perspective, LLM) and the API clients and caches
+    it uses. It only needs a message's content, so it runs the same way inside the bot process or
+    in a classifier worker process fed message envelopes. The keyword list is pushed in with
+    set_keywords() by whoever keeps it in sync with Firestore.
+
+    The Perspective and OpenAI clients and the score cache are built from config and tokens unless
+    they are passed in, e.g. stand-ins for replayBenchmark.py.
+    '''
+
+    def __init__(self, tokens, perspective=None, open_ai_functions=None, score_cache=None):
+        self.keyword_matcher = KeywordMatcher([])
+        if open_ai_functions is None:
+            open_ai_functions = OpenAIFunctions(
+                tokens['openai'],
+                max_in_flight=config.OPENAI_MAX_IN_FLIGHT,
+                timeout=config.OPENAI_TIMEOUT,
+                max_retries=config.OPENAI_MAX_RETRIES,
+            )
+        self.open_ai_functions = open_ai_functions
+        if perspective is None:
+            perspective = PerspectiveClient(
+                tokens['perspective'], # Make sure your 'tokens.json' file includes the Perspective API key
+                config.PERSPECTIVE_DISCOVERY_URL,
+                max_in_flight=config.PERSPECTIVE_MAX_IN_FLIGHT,
+                timeout=config.PERSPECTIVE_TIMEOUT,
+            )
+        self.perspective = perspective
+        if score_cache is None:
+            score_cache = ScoreCache(
+                config.SCORE_CACHE_PATH,
+                max_entries=config.SCORE_CACHE_MAX_ENTRIES,
+                ttl=config.SCORE_CACHE_TTL,
+                disk_ttl=config.SCORE_CACHE_DISK_TTL,
+            )
+        self.score_cache = score_cache
+        # Optional local pre-filter; train one with trainLocalClassifier.py
+        self.local_classifier = None
+        if os.path.isfile(config.LOCAL_CLASSIFIER_PATH):
+            self.local_classifier = LocalClassifier.load(config.LOCAL_CLASSIFIER_PATH)
+        self.cascade = self.build_cascade()
+
+    def stats(self):
+        return self.cascade.stats()
+
+    async def start(self):
+        # Fetch the Perspective discovery document once and open the pooled HTTP session
+        await self.perspective.start()
+
+    async def close(self):
+        await self.perspective.close()
+        self.score_cache.close()
+
+    def set_keywords(self, keywords_list):
+        # Only recompile the matcher when the keyword list actually changed
+        if tuple(keywords_list) != self.keyword_matcher.keywords:
+            self.keyword_matcher = KeywordMatcher(keywords_list)
+
+    async def classify(self, message):
+        with metrics.timed('classify'):
+            return await self.cascade.run(message)
+
+    def build_cascade(self):
+        '''
+        Builds the detection cascade from config.DETECTION_CASCADE. Each stage name maps to one of
+        the scorers below.
+        '''
+        scorers = {
+            'keywords': self.keyword_stage,
+            'local_model': self.local_model_stage,
+            'perspective_toxicity': lambda message, context: self.perspective_stage(message, context, 'TOXICITY'),
+            'perspective_severe_toxicity': lambda message, context: self.perspective_stage(message, context, 'SEVERE_TOXICITY'),
+            'perspective_identity_attack': lambda message, context: self.perspective_stage(message, context, 'IDENTITY_ATTACK'),
+            'llm_subcategory': self.subcategory_stage,
+        }
+        stages = []
+        for stage_config in config.DETECTION_CASCADE:
+            settings = dict(stage_config)
+            name = settings.pop('stage')
+            if name == 'local_model':
+                if self.local_classifier is None:
+                    continue
+                # By default clear whatever the trained model considers benign
+                settings.setdefault('reject', self.local_classifier.benign_threshold)
+            stages.append(Stage(name, scorers[name], **settings))
+        return DetectionCascade(stages)
+
+    async def keyword_stage(self, message, context):
+        # The keyword list is pushed in whenever it changes, so this does no I/O
+        with metrics.timed('keyword_match'):
+            matched_keywords = self.keyword_matcher.matches(message.content)
+        if matched_keywords:
+            return 1.0, f"Manual Keyword ({', '.join(matched_keywords)})"
+        return 0.0
+
+    async def local_model_stage(self, message, context):
+        return float(self.local_classifier.predict_proba([message.content])[0])
+
+    async def perspective_stage(self, message, context, attribute):
+        # All Perspective stages share one (cached) API call per message
+        if 'perspective' not in context:
+            context['perspective'] = asyncio.ensure_future(
+                self.score_cache.get_or_compute('perspective', message.content, lambda: self.eval_text(message.content))
+            )
+        # Shielded so one stage running out of latency budget doesn't cancel the call for the others
+        scores = await asyncio.shield(context['perspective'])
+        return scores[attribute]
+
+    async def subcategory_stage(self, message, context):
+        subcategory = await self.detect_subcategory(message.content)
+        if subcategory == FALLBACK_SUBCATEGORY:
+            return None
+        if any(category in subcategory.lower() for category in HATE_SUBCATEGORIES):
+            return 1.0, subcategory
+        return 0.0, subcategory
+
+    async def detect_subcategory(self, text):
+        # Don't cache the fallback label so the next copy of this text gets another chance
+        return await self.score_cache.get_or_compute(
+            'subcategory',
+            text,
+            lambda: self.open_ai_functions.detect_subcategory_async(text),
+            should_cache=lambda subcategory: subcategory != FALLBACK_SUBCATEGORY,
+        )
+
+    async def eval_text(self, message):
+        '''
+        Returns a map from each Perspective attribute to its score for the message text.
+        '''
+        with metrics.timed('eval_text'):
+            return await self.perspective.analyze(message)
@@ -0,0 +1,321 @@
+# classifierPool.py
+import asyncio
+import logging
+import multiprocessing
+import threading
+import metrics
+from scoringQueue import ScoringQueue
+from classifier import Classifier
+import config
+
+logger = logging.getLogger(__name__)
+
+# Messages between the bot and its workers
+CLASSIFY = 'classify'
+KEYWORDS = 'keywords'
+VERDICT = 'verdict'
+SUBCATEGORY = 'subcategory'
+METRICS = 'metrics'
+
+
+class MessageEnvelope:
+    '''
+    What a classifier worker gets instead of a discord.Message: the IDs needed to find the message
+    again, its author and the text to classify. Small and picklable.
+    '''
+
+    def __init__(self, id, channel_id, guild_id, author_id, author_name, content):
+        self.id = id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.author_id = author_id
+        self.author_name = author_name
+        self.content = content
+
+    @classmethod
+    def from_message(cls, message):
+        guild_id = message.guild.id if message.guild else None
+        return cls(message.id, message.channel.id, guild_id, message.author.id, message.author.name, message.content)
+
+
+class Verdict:
+    '''
+    A worker's decision on one message, with the fields of a CascadeResult the bot acts on.
+    '''
+
+    def __init__(self, flagged, score=None, label=None, stage_name=None, score_name=None):
+        self.flagged = flagged
+        self.score = score
+        self.label = label
+        self.stage_name = stage_name
+        self.score_name = score_name
+
+    @classmethod
+    def from_result(cls, result):
+        stage_name = result.stage.name if result.stage else None
+        return cls(result.flagged, result.score, result.label, stage_name, result.score_name)
+
+
+class ClassifierPool:
+    '''
+    Runs the detection cascade in worker processes so scoring spikes and slow Perspective or OpenAI
+    calls never hold up the gateway process's heartbeats and reaction handling.
+
+    put() wraps a message in a MessageEnvelope and hands it to the worker with the fewest messages
+    outstanding. Workers send verdicts back on one results queue; on_verdict(message, verdict) is
+    awaited for each, and for flagged messages the cascade didn't label the worker follows up with
+    the LLM subcategory, passed to on_subcategory(message, subcategory) once the verdict has been
+    handled. At most max_pending messages are outstanding before put() waits. A worker that dies is
+    restarted and the messages it hadn't answered are sent to it again, up to max_retries times so
+    a message that crashes the classifier can't take workers down forever. Workers also send their
+    stage timings every config.METRICS_WORKER_INTERVAL seconds, which are added to this process's
+    metrics.
+    '''
+
+    def __init__(self, tokens, on_verdict, on_subcategory, workers=2, max_pending=10000, check_interval=1.0, max_retries=2):
+        self.tokens = tokens
+        self.on_verdict = on_verdict
+        self.on_subcategory = on_subcategory
+        self.worker_count = workers
+        self.max_pending = max_pending
+        self.check_interval = check_interval
+        self.max_retries = max_retries
+        self.context = multiprocessing.get_context('spawn')
+        self.results = self.context.Queue() # Verdicts and subcategories from every worker
+        self.processes = [None] * workers
+        self.inboxes = [None] * workers
+        self.load = [0] * workers # Messages each worker hasn't answered yet
+        self.awaiting_verdict = {} # Map from message ID to [message, envelope, worker index, retries]
+        self.awaiting_subcategory = {} # Map from message ID to (message, verdict task, worker index)
+        self.keywords_list = []
+        self.slots = None
+        self.loop = None
+        self.reader = None
+        self.supervisor = None
+        self.tasks = set() # Keeps verdict handlers alive until they finish
+
+        # Metrics
+        self.enqueued = 0
+        self.verdicts = 0
+        self.flagged = 0
+        self.failed = 0
+        self.subcategories = 0
+        self.restarts = 0
+
+    def stats(self):
+        return {
+            'workers_alive': sum(1 for process in self.processes if process is not None and process.is_alive()),
+            'pending': len(self.awaiting_verdict),
+            'awaiting_subcategory': len(self.awaiting_subcategory),
+            'worker_load': list(self.load),
+            'enqueued': self.enqueued,
+            'verdicts': self.verdicts,
+            'flagged': self.flagged,
+            'failed': self.failed,
+            'subcategories': self.subcategories,
+            'restarts': self.restarts,
+        }
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(self.max_pending)
+        for index in range(self.worker_count):
+            self.spawn(index)
+        self.reader = threading.Thread(target=self.read_results, name='classifier-results', daemon=True)
+        self.reader.start()
+        self.supervisor = asyncio.create_task(self.supervise())
+
+    async def stop(self):
+        if self.supervisor is not None:
+            self.supervisor.cancel()
+            self.supervisor = None
+        for inbox in self.inboxes:
+            if inbox is not None:
+                inbox.put(None)
+        await asyncio.to_thread(self.join_workers)
+        if self.reader is not None:
+            self.results.put(None)
+            await asyncio.to_thread(self.reader.join)
+            self.reader = None
+
+    def join_workers(self, timeout=10.0):
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def spawn(self, index):
+        inbox = self.context.Queue()
+        process = self.context.Process(
+            target=run_worker, args=(index, self.tokens, inbox, self.results), name=f'classifier-{index}', daemon=True
+        )
+        process.start()
+        inbox.put((KEYWORDS, self.keywords_list))
+        self.processes[index] = process
+        self.inboxes[index] = inbox
+
+    # Bot side -----------------------------------------------------------------
+
+    async def put(self, message):
+        # Waits when too many messages are outstanding so a raid applies backpressure instead of growing memory
+        await self.slots.acquire()
+        envelope = MessageEnvelope.from_message(message)
+        index = min(range(self.worker_count), key=self.load.__getitem__)
+        self.awaiting_verdict[message.id] = [message, envelope, index, 0]
+        self.load[index] += 1
+        self.inboxes[index].put((CLASSIFY, envelope))
+        self.enqueued += 1
+
+    def set_keywords(self, keywords_list):
+        self.keywords_list = list(keywords_list)
+        for inbox in self.inboxes:
+            if inbox is not None:
+                inbox.put((KEYWORDS, self.keywords_list))
+
+    def read_results(self):
+        # Blocking reads happen on this thread; handling happens on the event loop
+        while True:
+            item = self.results.get()
+            if item is None:
+                return
+            self.loop.call_soon_threadsafe(self.on_result, *item)
+
+    def on_result(self, kind, message_id, value):
+        if kind == METRICS:
+            # message_id is the worker's index here
+            metrics.REGISTRY.merge(f'classifier-{message_id}', value)
+        elif kind == VERDICT:
+            entry = self.awaiting_verdict.pop(message_id, None)
+            if entry is None:
+                # A message that was sent again after its worker died, and both copies were answered
+                return
+            message, _, index, _ = entry
+            self.load[index] -= 1
+            self.slots.release()
+            if value is None:
+                self.failed += 1
+                return
+            self.verdicts += 1
+            if value.flagged:
+                self.flagged += 1
+            task = self.run_handler(self.on_verdict, message, value)
+            if value.flagged and value.label is None:
+                self.awaiting_subcategory[message_id] = (message, task, index)
+        elif kind == SUBCATEGORY:
+            entry = self.awaiting_subcategory.pop(message_id, None)
+            if entry is None:
+                return
+            message, verdict_task, _ = entry
+            self.subcategories += 1
+            self.run_handler(self.apply_subcategory, message, verdict_task, value)
+
+    async def apply_subcategory(self, message, verdict_task, subcategory):
+        # The report has to be posted before its subcategory can be filled in
+        await asyncio.wait([verdict_task])
+        await self.on_subcategory(message, subcategory)
+
+    def run_handler(self, handler, *args):
+        task = asyncio.create_task(self.call(handler, *args))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def call(self, handler, *args):
+        try:
+            await handler(*args)
+        except Exception:
+            logger.exception(f"Failed to handle classifier result for message {getattr(args[0], 'id', None)}")
+
+    async def supervise(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for index, process in enumerate(self.processes):
+                try:
+                    if not process.is_alive():
+                        self.restart(index)
+                except Exception:
+                    # e.g. the new process failed to start; the dead one is still in place, so the next pass tries again
+                    logger.exception(f"Failed to restart classifier worker {index}")
+
+    def restart(self, index):
+        logger.warning(f"Classifier worker {index} exited with code {self.processes[index].exitcode}, restarting it")
+        self.restarts += 1
+        self.spawn(index)
+        for message_id, entry in list(self.awaiting_verdict.items()):
+            message, envelope, worker, retries = entry
+            if worker != index:
+                continue
+            self.load[index] -= 1
+            if retries >= self.max_retries:
+                logger.warning(f"Giving up on message {message_id} after {retries + 1} classifier workers died with it")
+                del self.awaiting_verdict[message_id]
+                self.slots.release()
+                self.failed += 1
+                continue
+            # Spread the retries out so the message that crashed the worker takes fewer others down with it again
+            target = min(range(self.worker_count), key=self.load.__getitem__)
+            entry[2] = target
+            entry[3] = retries + 1
+            self.load[target] += 1
+            self.inboxes[target].put((CLASSIFY, envelope))
+        for message_id, (message, task, worker) in list(self.awaiting_subcategory.items()):
+            if worker == index:
+                # The report was already posted; it keeps its pending subcategory
+                logger.warning(f"Lost the subcategory of message {message_id} with classifier worker {index}")
+                del self.awaiting_subcategory[message_id]
+
+
+# Worker side --------------------------------------------------------------------
+
+def run_worker(index, tokens, inbox, results):
+    asyncio.run(serve(index, tokens, inbox, results))
+
+async def serve(index, tokens, inbox, results):
+    classifier = Classifier(tokens)
+    await classifier.start()
+
+    async def report_metrics():
+        while True:
+            await asyncio.sleep(config.METRICS_WORKER_INTERVAL)
+            results.put((METRICS, index, metrics.REGISTRY.snapshot()))
+
+    async def classify(envelope):
+        try:
+            return Verdict.from_result(await classifier.classify(envelope))
+        except Exception as e:
+            logger.warning(f"Could not classify message {envelope.id}: {e}")
+            return None
+
+    async def on_result(envelope, verdict):
+        # Every envelope gets an answer so the bot can release its slot
+        results.put((VERDICT, envelope.id, verdict))
+        if verdict is not None and verdict.flagged and verdict.label is None:
+            # The bot posts the report right away and fills this in when it arrives
+            results.put((SUBCATEGORY, envelope.id, await classifier.detect_subcategory(envelope.content)))
+
+    scoring_queue = ScoringQueue(
+        classify,
+        on_result,
+        max_batch_size=config.SCORING_BATCH_SIZE,
+        max_wait=config.SCORING_BATCH_WINDOW,
+        max_queue_size=config.SCORING_QUEUE_SIZE,
+        max_batches=config.SCORING_MAX_BATCHES,
+    )
+    scoring_queue.start()
+    reporter = asyncio.create_task(report_metrics())
+    try:
+        while True:
+            item = await asyncio.to_thread(inbox.get)
+            if item is None:
+                break
+            kind, payload = item
+            if kind == KEYWORDS:
+                classifier.set_keywords(payload)
+            elif kind == CLASSIFY:
+                await scoring_queue.put(payload)
+    finally:
+        reporter.cancel()
+        await scoring_queue.stop()
+        await classifier.close()
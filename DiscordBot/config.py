@@ -0,0 +1,120 @@
+# config.py
+# Tunable settings for the bot. Secrets (API keys) stay in tokens.json; everything
+# here is safe to commit and can be edited without touching the bot code.
+
+# Perspective API --------------------------------------------------------------
+PERSPECTIVE_DISCOVERY_URL = "https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1"
+PERSPECTIVE_MAX_IN_FLIGHT = 10 # Max number of concurrent Perspective requests
+PERSPECTIVE_TIMEOUT = 5.0 # Seconds before a single Perspective request is abandoned
+
+# Scoring queue ----------------------------------------------------------------
+SCORING_BATCH_SIZE = 32 # Max messages scored together in one micro-batch
+SCORING_BATCH_WINDOW = 0.05 # Seconds to wait for a micro-batch to fill before dispatching it
+SCORING_QUEUE_SIZE = 10000 # Max messages waiting to be scored before handle_channel_message waits
+SCORING_MAX_BATCHES = 8 # Micro-batches scored at once; later messages wait in the queue
+
+# Score cache ------------------------------------------------------------------
+SCORE_CACHE_PATH = 'score_cache.sqlite3' # SQLite file holding cached Perspective scores and subcategories
+SCORE_CACHE_MAX_ENTRIES = 10000 # Max entries kept in the in-memory LRU
+SCORE_CACHE_TTL = 3600 # Seconds an entry stays in memory
+SCORE_CACHE_DISK_TTL = 7 * 24 * 3600 # Seconds an entry stays valid on disk
+
+# Keywords ---------------------------------------------------------------------
+KEYWORD_POLL_INTERVAL = 30.0 # Seconds between keyword polls when the Firestore listener is unavailable
+
+# OpenAI -----------------------------------------------------------------------
+OPENAI_MAX_IN_FLIGHT = 4 # Max number of concurrent subcategory requests
+OPENAI_TIMEOUT = 10.0 # Seconds before a subcategory request (including retries) falls back
+OPENAI_MAX_RETRIES = 3 # Retries on rate limits and server errors
+
+# Local pre-classifier ---------------------------------------------------------
+LOCAL_CLASSIFIER_PATH = 'local_classifier.npz' # Model written by trainLocalClassifier.py; skipped if missing
+
+# Detection cascade ------------------------------------------------------------
+# Stages run in order until one is confident: a score >= accept flags the message and a score <= reject
+# clears it. Anything in between passes the message on to the next stage. cost is a relative price per
+# run, latency_budget is in seconds, and audit_rate is the share of cleared messages passed on anyway to
+# measure how many flags the stage misses. accept_exclusive flags only above accept, skip_on_failure
+# leaves a message unflagged when the stage times out or errors instead of passing it on, and
+# report_stage reports an earlier stage's score on a flag. Stage names map to scorers in
+# Classifier.build_cascade (classifier.py).
+#
+# The defaults flag exactly what the bot always has: a keyword match or an identity attack score above
+# 0.5. A message whose Perspective call fails is skipped, as before, rather than sent to the LLM.
+DETECTION_CASCADE = [
+    {'stage': 'keywords', 'cost': 0.0, 'latency_budget': 0.05, 'accept': 1.0, 'score_name': "Manual Keyword"},
+    # reject defaults to the benign threshold stored in the trained model; skipped if there is no model
+    {'stage': 'local_model', 'cost': 0.0, 'latency_budget': 0.05, 'audit_rate': 0.02, 'score_name': "Local Model Score"},
+    {'stage': 'perspective_identity_attack', 'cost': 1.0, 'latency_budget': PERSPECTIVE_TIMEOUT, 'accept': 0.5, 'accept_exclusive': True, 'reject': 0.5, 'skip_on_failure': True, 'score_name': "Identity Attack Score"},
+    # Stages that flag more than the bot used to. To use them, lower the identity attack reject above
+    # (e.g. to 0.3) so borderline messages get this far, and insert them after it:
+    # {'stage': 'perspective_severe_toxicity', 'cost': 0.0, 'latency_budget': PERSPECTIVE_TIMEOUT, 'accept': 0.9, 'skip_on_failure': True, 'score_name': "Severe Toxicity Score"},
+    # {'stage': 'perspective_toxicity', 'cost': 0.0, 'latency_budget': PERSPECTIVE_TIMEOUT, 'reject': 0.5, 'skip_on_failure': True, 'score_name': "Toxicity Score"},
+    # {'stage': 'llm_subcategory', 'cost': 5.0, 'latency_budget': OPENAI_TIMEOUT, 'accept': 1.0, 'reject': 0.0, 'report_stage': 'perspective_identity_attack', 'score_name': "LLM Subcategory Match"},
+]
+
+# Classifier workers -----------------------------------------------------------
+CLASSIFIER_WORKERS = 2 # Processes running the detection cascade; 0 runs it inside the bot process
+CLASSIFIER_MAX_PENDING = 10000 # Messages sent to the workers and not yet classified before handle_channel_message waits
+CLASSIFIER_CHECK_INTERVAL = 1.0 # Seconds between checks for classifier workers that died
+
+# Flag counts ------------------------------------------------------------------
+FLAG_COUNT_FLUSH_INTERVAL = 2.0 # Seconds between batched flag count writes
+FLAG_COUNT_MAX_PENDING = 200 # Flush early once this many users have buffered increments
+FLAG_COUNT_CACHE_TTL = 300.0 # Seconds a flag count read from Firestore stays cached
+FLAG_COUNT_CACHE_MAX_ENTRIES = 10000 # Users whose flag count is cached; the least recently used are dropped first
+
+# Report sessions --------------------------------------------------------------
+SESSION_IDLE_TIMEOUT = 30 * 60 # Seconds of inactivity before a report flow is closed
+SESSION_MAX_ENTRIES = 10000 # Max open flows per kind before the least recently used is closed
+SESSION_SWEEP_INTERVAL = 60.0 # Seconds between sweeps for idle flows
+SESSION_DB_PATH = 'sessions.sqlite3' # SQLite file where open report flows are saved across restarts
+SESSION_FLUSH_INTERVAL = 0.05 # Seconds the session writer waits to group transitions into one transaction
+
+# Outbound Discord calls -------------------------------------------------------
+OUTBOUND_MAX_IN_FLIGHT = 8 # Discord requests in flight at once across every route
+# Per-channel pacing for each kind of call, as (calls, per seconds), kept just under Discord's limits
+OUTBOUND_RATE_LIMITS = {
+    'message': (5, 5.0),
+    'reaction': (1, 0.25),
+    'edit': (5, 5.0),
+    'delete': (5, 1.0),
+}
+
+# Mod queue --------------------------------------------------------------------
+MOD_QUEUE_RESOLVED_TTL = 3600.0 # Seconds a resolved report stays indexed so late duplicates still merge into it
+MOD_QUEUE_OPEN_TTL = 7 * 24 * 3600.0 # Seconds before an open report is dropped from the index
+MOD_QUEUE_SWEEP_INTERVAL = 60.0 # Seconds between sweeps for expired reports
+MOD_QUEUE_LIST_SIZE = 10 # Reports listed by the `queue` command
+
+# Reaction routing -------------------------------------------------------------
+REACTION_ROUTES_MAX = 50000 # Prompt message IDs indexed for routing reactions to their session
+
+# Message links ----------------------------------------------------------------
+MESSAGE_CACHE_MAX_ENTRIES = 1024 # Fetched Discord messages shared by every review flow
+MESSAGE_CACHE_TTL = 300.0 # Seconds a fetched message is reused (edits and deletes invalidate it sooner)
+
+# Sharding ---------------------------------------------------------------------
+SHARD_COUNT = 1 # Gateway shards across every bot process; None asks Discord for its recommended count
+SHARD_IDS = None # Shards `python bot.py` connects in this process; None connects all of them
+SHARD_PROCESSES = 2 # Processes shardLauncher.py splits SHARD_COUNT shards across
+HANDOFF_POLL_INTERVAL = 1.0 # Seconds between checks for reports other processes handed off to this one's shards
+
+# Metrics ----------------------------------------------------------------------
+METRICS_HOST = '127.0.0.1' # Interface the Prometheus endpoint listens on
+METRICS_PORT = 9152 # Port of http://METRICS_HOST:METRICS_PORT/metrics; each shardLauncher.py process adds its index. None turns it off
+METRICS_WORKER_INTERVAL = 5.0 # Seconds between classifier workers sending their stage timings to the bot process
+
+# Tracing ----------------------------------------------------------------------
+TRACE_FILE = 'traces.jsonl' # JSON Lines file spans of flagged messages are appended to; each shardLauncher.py process writes traces-<index>.jsonl. None turns it off
+TRACE_MAX_MARKS = 10000 # How many monitored messages to remember the arrival time of until their classification is done
+
+# Logging ----------------------------------------------------------------------
+# Records are queued on the event loop and written by a background thread. The log file is rotated
+# once it reaches LOG_MAX_BYTES or is LOG_ROTATE_SECONDS old, keeping LOG_BACKUPS old files.
+LOG_LEVELS = {'': 'INFO', 'discord': 'DEBUG'} # Level of each logger by name; '' is every other logger
+LOG_CONSOLE_LEVEL = 'INFO' # Records at this level or above are printed too. None keeps the console quiet
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_ROTATE_SECONDS = 24 * 60 * 60 # None rotates by size only
+LOG_BACKUPS = 5
+LOG_QUEUE_SIZE = 50000 # Records waiting for the writer; more than this are dropped (and counted) rather than waited on
@@ -0,0 +1,167 @@
+# detectionCascade.py
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+class Stage:
+    '''
+    One step of the detection cascade. scorer(message, context) is awaited and returns a score in
+    [0, 1], or a (score, label) pair. A score at or above accept (strictly above, with
+    accept_exclusive) flags the message and a score at or below reject clears it; either way the
+    cascade stops there. Anything in between is inconclusive and the next stage runs. So is a
+    timeout or an error, unless skip_on_failure is set, in which case the message is left unflagged
+    rather than passed on to later (often pricier) stages.
+
+    cost is a relative price per run (e.g. 1 per paid API call) and latency_budget is the most time
+    in seconds the stage may take before it is treated as inconclusive. When a stage clears a
+    message, audit_rate of those messages are passed on anyway so we can measure how often the
+    later stages would have flagged them.
+
+    A stage that only confirms what an earlier one suspected (e.g. the LLM naming a subcategory)
+    can set report_stage to that stage's name, so a flag reports the earlier stage's score, which
+    sets the report's priority, instead of its own yes/no.
+    '''
+
+    def __init__(self, name, scorer, cost=0.0, latency_budget=None, accept=None, reject=None, audit_rate=0.0, score_name=None,
+                 accept_exclusive=False, skip_on_failure=False, report_stage=None):
+        self.name = name
+        self.scorer = scorer
+        self.cost = cost
+        self.latency_budget = latency_budget
+        self.accept = accept
+        self.reject = reject
+        self.audit_rate = audit_rate
+        self.score_name = score_name or name
+        self.accept_exclusive = accept_exclusive
+        self.skip_on_failure = skip_on_failure
+        self.report_stage = report_stage
+
+        # Metrics
+        self.runs = 0
+        self.accepts = 0
+        self.rejects = 0
+        self.inconclusive = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.skips = 0 # Messages left unflagged because the stage failed
+        self.audits = 0
+        self.audit_misses = 0 # Audited messages a later stage flagged
+        self.time_spent = 0.0
+        self.cost_spent = 0.0
+
+    def accepts_score(self, score):
+        if score is None or self.accept is None:
+            return False
+        return score > self.accept if self.accept_exclusive else score >= self.accept
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'accepts': self.accepts,
+            'rejects': self.rejects,
+            'inconclusive': self.inconclusive,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'skips': self.skips,
+            'accept_rate': self.accepts / self.runs if self.runs else 0.0,
+            'reject_rate': self.rejects / self.runs if self.runs else 0.0,
+            'audits': self.audits,
+            'audit_misses': self.audit_misses,
+            'time_spent': self.time_spent,
+            'mean_latency': self.time_spent / self.runs if self.runs else 0.0,
+            'cost_spent': self.cost_spent,
+        }
+
+
+class CascadeResult:
+    def __init__(self, flagged, stage=None, score=None, label=None, context=None, scored_by=None):
+        self.flagged = flagged
+        self.stage = stage # Stage that made the decision, or None if every stage was inconclusive
+        self.score = score
+        self.label = label
+        self.context = context or {}
+        self.scored_by = scored_by or stage # Stage the score comes from (see Stage.report_stage)
+
+    @property
+    def score_name(self):
+        return self.scored_by.score_name if self.scored_by else None
+
+
+class DetectionCascade:
+    '''
+    Runs stages in order, cheapest first, until one of them is confident. Stages share a context
+    dict per message so e.g. several Perspective attributes can reuse a single API response.
+    '''
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.messages = 0
+        self.flagged = 0
+
+    def stats(self):
+        return {
+            'messages': self.messages,
+            'flagged': self.flagged,
+            'stages': {stage.name: stage.stats() for stage in self.stages},
+        }
+
+    async def run_stage(self, stage, message, context):
+        stage.runs += 1
+        stage.cost_spent += stage.cost
+        start = time.perf_counter()
+        try:
+            if stage.latency_budget is None:
+                result = await stage.scorer(message, context)
+            else:
+                result = await asyncio.wait_for(stage.scorer(message, context), stage.latency_budget)
+        except asyncio.TimeoutError:
+            stage.timeouts += 1
+            return None, None, True
+        except Exception as e:
+            stage.errors += 1
+            logger.warning(f"Cascade stage {stage.name} failed: {e}")
+            return None, None, True
+        finally:
+            stage.time_spent += time.perf_counter() - start
+
+        if isinstance(result, tuple):
+            return result + (False,)
+        return result, None, False
+
+    async def run(self, message):
+        self.messages += 1
+        context = {}
+        auditing = [] # Stages whose reject decision is being double-checked by later stages
+        scores = {} # Map from stage name to (stage, score) of the stages run so far
+        for stage in self.stages:
+            score, label, failed = await self.run_stage(stage, message, context)
+
+            if failed and stage.skip_on_failure:
+                stage.skips += 1
+                return CascadeResult(False, stage, None, None, context)
+            scores[stage.name] = (stage, score)
+
+            if stage.accepts_score(score):
+                stage.accepts += 1
+                for audited in auditing:
+                    audited.audit_misses += 1
+                self.flagged += 1
+                scored_by, reported = scores.get(stage.report_stage, (stage, score))
+                if reported is None:
+                    scored_by, reported = stage, score
+                return CascadeResult(True, stage, reported, label, context, scored_by)
+
+            if score is not None and stage.reject is not None and score <= stage.reject:
+                stage.rejects += 1
+                if random.random() < stage.audit_rate:
+                    stage.audits += 1
+                    auditing.append(stage)
+                    continue
+                return CascadeResult(False, stage, score, label, context)
+
+            stage.inconclusive += 1
+
+        return CascadeResult(False, None, None, None, context)
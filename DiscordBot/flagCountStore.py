@@ -0,0 +1,110 @@
+# flagCountStore.py
+import asyncio
+import time
+from collections import OrderedDict
+import metrics
+from flagCounter import FlagCounterService
+
+class FlagCountStore:
+    '''
+    Single source of truth for how many times each user has been flagged. Reads go through a TTL
+    cache in front of users/{id} in Firestore, and the result always includes increments that are
+    still buffered in the flag counter service or being committed by it. When a user's increment is
+    written to Firestore their entry is invalidated and re-read (warmed) in the background, so
+    moderator actions rarely wait on Firestore. At most max_entries users are cached, least recently
+    used first out.
+    '''
+
+    def __init__(self, db, ttl=300.0, flush_interval=2.0, max_pending=200, max_entries=10000):
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.counter = FlagCounterService(db, flush_interval=flush_interval, max_pending=max_pending, on_flush=self.on_flush)
+        self.cache = OrderedDict() # Map from user IDs to (expires_at, flag count stored in Firestore), least recently used first
+        self.pending_reads = {} # Map from user IDs to the in-flight Firestore read
+        self.background_reads = set()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0
+
+    def stats(self):
+        return {
+            'cached_users': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'firestore_reads': self.reads,
+            **self.counter.stats(),
+        }
+
+    def start(self):
+        self.counter.start()
+
+    async def stop(self):
+        # Write out any buffered flag counts before shutting down
+        await self.counter.stop()
+
+    def increment(self, user_id, amount=1):
+        # The cached entry stays valid until the increment is written: get() adds buffered counts on
+        # top of it, and on_flush invalidates it once Firestore has the new value
+        self.counter.increment(user_id, amount)
+
+    def invalidate(self, user_id):
+        self.cache.pop(user_id, None)
+        # Reads that started before now may miss the latest write, so don't let them fill the cache
+        self.pending_reads.pop(user_id, None)
+
+    def on_flush(self, user_ids):
+        # The stored counts just changed, so re-read them while nobody is waiting
+        for user_id in user_ids:
+            self.invalidate(user_id)
+            self.warm(user_id)
+
+    def warm(self, user_id):
+        '''
+        Loads a user's flag count in the background, e.g. when a report about them is pending review.
+        '''
+        entry = self.cache.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return
+        task = asyncio.create_task(self.load(user_id))
+        self.background_reads.add(task)
+        task.add_done_callback(self.background_reads.discard)
+
+    async def get(self, user_id):
+        entry = self.cache.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            self.cache.move_to_end(user_id)
+            stored = entry[1]
+        else:
+            self.misses += 1
+            stored = await self.load(user_id)
+        return stored + self.counter.pending_count(user_id)
+
+    async def load(self, user_id):
+        # Concurrent loads for the same user share one Firestore read
+        future = self.pending_reads.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._read(user_id))
+            self.pending_reads[user_id] = future
+
+            def forget(done):
+                if self.pending_reads.get(user_id) is done:
+                    del self.pending_reads[user_id]
+            future.add_done_callback(forget)
+        return await asyncio.shield(future)
+
+    async def _read(self, user_id):
+        with metrics.timed('firestore_read'):
+            user_doc = await asyncio.to_thread(self.db.collection('users').document(str(user_id)).get)
+        self.reads += 1
+        stored = user_doc.to_dict().get('flag_counts', 0) if user_doc.exists else 0
+        # invalidate() drops the pending read, so only cache if nothing was written while we waited
+        if self.pending_reads.get(user_id) is asyncio.current_task():
+            self.cache[user_id] = (time.monotonic() + self.ttl, stored)
+            self.cache.move_to_end(user_id)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return stored
@@ -0,0 +1,113 @@
+# flagCounter.py
+import asyncio
+import logging
+import metrics
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+# Firestore allows at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+class FlagCounterService:
+    '''
+    Buffers flag count increments in memory and writes them to users/{id} in Firestore batches.
+    Increments for the same user are added together before they are written, and each write is a
+    merge-set with Increment so no read is needed and concurrent reports can't lose counts.
+    Buffered counts are flushed every flush_interval seconds, as soon as max_pending users are
+    waiting, and on stop().
+    '''
+
+    def __init__(self, db, flush_interval=2.0, max_pending=200, on_flush=None):
+        self.db = db
+        self.on_flush = on_flush # Called with the user IDs of every batch that was committed
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = {} # Map from user IDs to increments not yet written to Firestore
+        self.committing = {} # Map from user IDs to increments taken out of pending by a flush that hasn't committed yet
+        self.flush_lock = asyncio.Lock()
+        self.flusher = None
+        self.background_flushes = set()
+
+        # Metrics
+        self.increments = 0
+        self.documents_written = 0
+        self.commits = 0
+        self.failed_commits = 0
+
+    def stats(self):
+        return {
+            'pending_users': len(self.pending),
+            'increments': self.increments,
+            'documents_written': self.documents_written,
+            'commits': self.commits,
+            'failed_commits': self.failed_commits,
+        }
+
+    def start(self):
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            try:
+                await self.flusher
+            except asyncio.CancelledError:
+                pass
+            self.flusher = None
+        # A failed final flush must not stop the rest of shutdown; its counts are lost with the process
+        await self.try_flush()
+
+    def increment(self, user_id, amount=1):
+        self.pending[user_id] = self.pending.get(user_id, 0) + amount
+        self.increments += 1
+        if len(self.pending) >= self.max_pending and not self.flush_lock.locked():
+            task = asyncio.create_task(self.try_flush())
+            self.background_flushes.add(task)
+            task.add_done_callback(self.background_flushes.discard)
+
+    def pending_count(self, user_id):
+        # Counts being committed aren't in Firestore yet either
+        return self.pending.get(user_id, 0) + self.committing.get(user_id, 0)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.try_flush()
+
+    async def try_flush(self):
+        # Failed chunks are back in pending, so the next flush retries them
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception(f"Failed to flush flag counts; {len(self.pending)} users' counts are still pending")
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            self.committing, self.pending = self.pending, {}
+            items = list(self.committing.items())
+            for start in range(0, len(items), MAX_BATCH_WRITES):
+                chunk = items[start:start + MAX_BATCH_WRITES]
+                batch = self.db.batch()
+                for user_id, amount in chunk:
+                    user_ref = self.db.collection('users').document(str(user_id))
+                    batch.set(user_ref, {'flag_counts': firestore.Increment(amount)}, merge=True)
+                try:
+                    with metrics.timed('firestore_write'):
+                        await asyncio.to_thread(batch.commit)
+                except Exception:
+                    self.failed_commits += 1
+                    # Put this chunk and everything after it back so the next flush retries them
+                    for user_id, amount in items[start:]:
+                        self.pending[user_id] = self.pending.get(user_id, 0) + amount
+                    self.committing = {}
+                    raise
+                for user_id, _ in chunk:
+                    del self.committing[user_id]
+                self.commits += 1
+                self.documents_written += len(chunk)
+                if self.on_flush is not None:
+                    self.on_flush([user_id for user_id, _ in chunk])
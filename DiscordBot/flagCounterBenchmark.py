@@ -0,0 +1,135 @@
+# flagCounterBenchmark.py
+# Compares Firestore traffic for a burst of completed reports: the old get() + update()/set() per
+# report versus FlagCounterService's coalesced, batched merge-sets. Firestore is replaced by an
+# in-memory fake with a configurable round-trip time, so no credentials are needed.
+#
+#   python flagCounterBenchmark.py --reports 5000 --users 50 --latency 0.03
+import argparse
+import asyncio
+import random
+import time
+from flagCounter import FlagCounterService
+
+
+class FakeDocument:
+    def __init__(self, store, key, latency):
+        self.store = store
+        self.key = key
+        self.latency = latency
+
+    def get(self):
+        time.sleep(self.latency)
+        self.store.reads += 1
+        snapshot = FakeSnapshot(self.key in self.store.docs)
+        return snapshot
+
+    def update(self, data):
+        time.sleep(self.latency)
+        self.store.round_trips += 1
+        self.store.writes += 1
+
+    def set(self, data, merge=False):
+        time.sleep(self.latency)
+        self.store.round_trips += 1
+        self.store.writes += 1
+        self.store.docs.add(self.key)
+
+
+class FakeSnapshot:
+    def __init__(self, exists):
+        self.exists = exists
+
+
+class FakeBatch:
+    def __init__(self, store, latency):
+        self.store = store
+        self.latency = latency
+        self.count = 0
+
+    def set(self, ref, data, merge=False):
+        self.count += 1
+        self.store.docs.add(ref.key)
+
+    def commit(self):
+        time.sleep(self.latency)
+        self.store.round_trips += 1
+        self.store.writes += self.count
+
+
+class FakeCollection:
+    def __init__(self, store, latency):
+        self.store = store
+        self.latency = latency
+
+    def document(self, key):
+        return FakeDocument(self.store, key, self.latency)
+
+
+class FakeFirestore:
+    def __init__(self, latency):
+        self.latency = latency
+        self.docs = set()
+        self.reads = 0
+        self.writes = 0
+        self.round_trips = 0
+
+    def collection(self, name):
+        return FakeCollection(self, self.latency)
+
+    def batch(self):
+        return FakeBatch(self, self.latency)
+
+
+def old_increment(db, user_id):
+    user_ref = db.collection('users').document(str(user_id))
+    user_doc = user_ref.get()
+    if user_doc.exists:
+        user_ref.update({'flag_counts': 1})
+    else:
+        user_ref.set({'flag_counts': 1})
+
+
+async def run(args):
+    user_ids = [random.randrange(args.users) for _ in range(args.reports)]
+
+    # Old path: blocking calls made directly on the event loop, one report at a time
+    old_db = FakeFirestore(args.latency)
+    start = time.perf_counter()
+    for user_id in user_ids:
+        old_increment(old_db, user_id)
+    old_elapsed = time.perf_counter() - start
+
+    # New path: increments are buffered and flushed in batches
+    new_db = FakeFirestore(args.latency)
+    service = FlagCounterService(new_db, flush_interval=args.flush_interval, max_pending=args.max_pending)
+    service.start()
+    start = time.perf_counter()
+    for i, user_id in enumerate(user_ids):
+        service.increment(user_id)
+        if args.burst_gap and i % args.burst_size == 0:
+            await asyncio.sleep(args.burst_gap)
+    loop_elapsed = time.perf_counter() - start
+    await service.stop()
+    new_elapsed = time.perf_counter() - start
+
+    print(f"reports: {args.reports} across {args.users} users, {args.latency * 1000:.0f}ms per Firestore round-trip")
+    print(f"{'':22}{'old':>12}{'batched':>12}")
+    print(f"{'reads':22}{old_db.reads:>12}{new_db.reads:>12}")
+    print(f"{'documents written':22}{old_db.writes:>12}{new_db.writes:>12}")
+    print(f"{'round-trips':22}{old_db.reads + old_db.round_trips:>12}{new_db.round_trips:>12}")
+    print(f"{'event loop blocked':22}{old_elapsed:>11.2f}s{loop_elapsed:>11.2f}s")
+    print(f"{'total time':22}{old_elapsed:>11.2f}s{new_elapsed:>11.2f}s")
+    reduction = 1 - new_db.round_trips / max(old_db.reads + old_db.round_trips, 1)
+    print(f"round-trip reduction: {reduction:.1%}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark batched flag count writes against per-report writes.")
+    parser.add_argument('--reports', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=50, help="Distinct flagged users in the burst")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds per fake Firestore round-trip")
+    parser.add_argument('--flush-interval', type=float, default=2.0)
+    parser.add_argument('--max-pending', type=int, default=200)
+    parser.add_argument('--burst-size', type=int, default=100, help="Reports completed per burst")
+    parser.add_argument('--burst-gap', type=float, default=0.01, help="Seconds between bursts")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,66 @@
+# keywordMatcher.py
+from collections import deque
+
+class KeywordMatcher:
+    '''
+    Aho-Corasick automaton over the manual keyword list. Matching is case-insensitive and takes a
+    single pass over the message no matter how many keywords there are. Build a new matcher
+    whenever the keyword list changes; a built matcher is never modified.
+    '''
+
+    def __init__(self, keywords):
+        self.keywords = tuple(keywords)
+        self.goto = [{}] # goto[state][char] -> next state
+        self.fail = [0] # fail[state] -> longest proper suffix state
+        self.output = [[]] # output[state] -> (keyword, pattern length) pairs that end at this state
+
+        for keyword in self.keywords:
+            pattern = keyword.lower()
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            if all(existing != keyword for existing, _ in self.output[state]):
+                self.output[state].append((keyword, len(pattern)))
+
+        # Breadth-first pass to fill in failure links and merge outputs along them
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def find_all(self, text):
+        '''
+        Returns every (start index, keyword) occurrence in text, including overlapping ones.
+        '''
+        hits = []
+        state = 0
+        for i, char in enumerate(text.lower()):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for keyword, length in self.output[state]:
+                hits.append((i - length + 1, keyword))
+        return hits
+
+    def matches(self, text):
+        '''
+        Returns the distinct keywords found in text, in the order they first appear.
+        '''
+        return list(dict.fromkeys(keyword for _, keyword in self.find_all(text)))
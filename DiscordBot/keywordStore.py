@@ -0,0 +1,83 @@
+# keywordStore.py
+import asyncio
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class KeywordStore:
+    '''
+    In-memory copy of the manual keyword list stored at config/keywords in Firestore.
+    A realtime snapshot listener keeps it in sync; if the listener can't be attached, the
+    document is polled instead and only re-applied when its update_time changes.
+    on_change(keywords_list) is called whenever the list changes to hand it to the classifier (or
+    its workers), which compiles the one matcher messages are checked against, so checking a
+    message never touches the network.
+    '''
+
+    def __init__(self, db, poll_interval=30.0, on_change=None):
+        self.doc_ref = db.collection('config').document('keywords')
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self.keywords_list = []
+        self.version = None # update_time of the document the current list came from
+        self.loop = None
+        self.watch = None
+        self.poller = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        # Load once up front so the first messages are checked against the real list
+        await self.refresh()
+        try:
+            self.watch = self.doc_ref.on_snapshot(self.on_snapshot)
+        except Exception as e:
+            logger.warning(f"Keyword snapshot listener unavailable, polling every {self.poll_interval}s instead: {e}")
+            self.poller = asyncio.create_task(self.poll())
+
+    async def stop(self):
+        if self.watch is not None:
+            self.watch.unsubscribe()
+            self.watch = None
+        if self.poller is not None:
+            self.poller.cancel()
+            self.poller = None
+
+    def update(self, keywords_list, version=None):
+        '''
+        Applies a new keyword list. Lists older than the one already applied are ignored so a
+        late snapshot can't undo a more recent edit.
+        '''
+        if version is not None and self.version is not None and version < self.version:
+            return
+        if version is not None:
+            self.version = version
+        keywords_list = list(keywords_list)
+        # Only hand the list on (and have the classifier recompile) when it actually changed
+        if keywords_list != self.keywords_list:
+            self.keywords_list = keywords_list
+            if self.on_change is not None:
+                self.on_change(self.keywords_list)
+
+    def apply_snapshot(self, doc):
+        keywords_list = doc.to_dict().get('keywords_list', []) if doc.exists else []
+        self.update(keywords_list, getattr(doc, 'update_time', None))
+
+    def on_snapshot(self, doc_snapshots, changes, read_time):
+        # Firestore calls this from its own thread, so hop back onto the event loop
+        for doc in doc_snapshots:
+            self.loop.call_soon_threadsafe(self.apply_snapshot, doc)
+
+    async def refresh(self):
+        with metrics.timed('keyword_fetch'):
+            doc = await asyncio.to_thread(self.doc_ref.get)
+        if not doc.exists or getattr(doc, 'update_time', None) != self.version:
+            self.apply_snapshot(doc)
+
+    async def poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Failed to poll keywords: {e}")
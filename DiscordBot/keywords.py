@@ -1,6 +1,9 @@
 from enum import Enum, auto
+import asyncio
 import discord
 import re
+import metrics
+from outboundDispatcher import Priority
 
 class KeywordState(Enum):
     START_KEYWORDS = auto()
@@ -25,6 +28,7 @@ class Keywords:
         self.final_state = None
         self.db = db
         self.reactions = ['1️⃣', '2️⃣', '3️⃣', '4️⃣']
+        self.abuse_category_message_id = None
     
     async def handle_message(self, message):
         '''
@@ -35,7 +39,7 @@ class Keywords:
 
         if message.content == self.CANCEL_KEYWORD:
             self.state = KeywordState.CANCELLED_KEYWORDS
-            await message.channel.send("Keyword edit cancelled.")
+            await self.send(message.channel, "Keyword edit cancelled.")
             return
         
         if self.state == KeywordState.START_KEYWORDS:
@@ -48,60 +52,65 @@ class Keywords:
             reply += "4️⃣ - Done/Cancel"
             
             self.state = KeywordState.AWAITING_KEYWORDS
-            sent_message = await message.channel.send(reply)
+            sent_message = await self.send(message.channel, reply)
             self.abuse_category_message_id = sent_message.id
 
             # preadd the reactions so it's easy for the user to click
             
-            for reaction in self.reactions:
-                await sent_message.add_reaction(reaction)
+            self.client.outbound.add_reactions(sent_message, self.reactions, Priority.LOW)
 
             return
         
         if self.state == KeywordState.ADD_KEYWORD:
             keywords_ref = self.db.collection('config').document('keywords')
-            keywords_doc = keywords_ref.get()
+            with metrics.timed('keyword_fetch'):
+                keywords_doc = await asyncio.to_thread(keywords_ref.get)
             if keywords_doc.exists:
                 keywords_list = keywords_doc.to_dict().get('keywords_list', [])
             else:
                 keywords_list = []
             
             if message.content in keywords_list:
-                sent_message = await message.channel.send("Keyword already exists.")
+                sent_message = await self.send(message.channel, "Keyword already exists.")
                 self.state = KeywordState.START_KEYWORDS
                 await self.handle_message(sent_message)
                 return
             
             keywords_list.append(message.content)
-            keywords_ref.set({
-                'keywords_list': keywords_list
-            })
+            with metrics.timed('firestore_write'):
+                write_result = await asyncio.to_thread(keywords_ref.set, {
+                    'keywords_list': keywords_list
+                })
+            self.client.keyword_store.update(keywords_list, write_result.update_time)
 
-            sent_message = await message.channel.send("Keyword added successfully.")
+            sent_message = await self.send(message.channel, "Keyword added successfully.")
             self.state = KeywordState.START_KEYWORDS
             await self.handle_message(sent_message)
             return
         
         if self.state == KeywordState.REMOVE_KEYWORD:
             keywords_ref = self.db.collection('config').document('keywords')
-            keywords_doc = keywords_ref.get()
+            with metrics.timed('keyword_fetch'):
+                keywords_doc = await asyncio.to_thread(keywords_ref.get)
             if keywords_doc.exists:
                 keywords_list = keywords_doc.to_dict().get('keywords_list', [])
             else:
                 keywords_list = []
             
             if message.content not in keywords_list:
-                sent_message = await message.channel.send("Keyword does not exist.")
+                sent_message = await self.send(message.channel, "Keyword does not exist.")
                 self.state = KeywordState.START_KEYWORDS
                 await self.handle_message(sent_message)
                 return
             
             keywords_list.remove(message.content)
-            keywords_ref.set({
-                'keywords_list': keywords_list
-            })
+            with metrics.timed('firestore_write'):
+                write_result = await asyncio.to_thread(keywords_ref.set, {
+                    'keywords_list': keywords_list
+                })
+            self.client.keyword_store.update(keywords_list, write_result.update_time)
 
-            sent_message = await message.channel.send("Keyword removed successfully.")
+            sent_message = await self.send(message.channel, "Keyword removed successfully.")
             self.state = KeywordState.START_KEYWORDS
             await self.handle_message(sent_message)
             return
@@ -111,18 +120,19 @@ class Keywords:
     async def handle_reaction(self, payload, message):
         if self.state == KeywordState.AWAITING_KEYWORDS:
             if payload.message_id != self.abuse_category_message_id:
-                await message.channel.send("Please react to the message that contains emoji options to choose from.")
+                await self.send(message.channel, "Please react to the message that contains emoji options to choose from.")
                 return
             
             if str(payload.emoji) == '1️⃣':
                 keywords_ref = self.db.collection('config').document('keywords')
-                keywords_doc = keywords_ref.get()
+                with metrics.timed('keyword_fetch'):
+                    keywords_doc = await asyncio.to_thread(keywords_ref.get)
                 sentMessage = None
                 if keywords_doc.exists:
                     keywords_list = keywords_doc.to_dict().get('keywords_list', [])
-                    sent_message = await message.channel.send("Here are the current keywords: ```\n" + "\n".join(keywords_list) + "\n```")
+                    sent_message = await self.send(message.channel, "Here are the current keywords: ```\n" + "\n".join(keywords_list) + "\n```")
                 else:
-                    sent_message = await message.channel.send("There are no keywords currently.")
+                    sent_message = await self.send(message.channel, "There are no keywords currently.")
 
                 self.state = KeywordState.START_KEYWORDS
                 await self.handle_message(sent_message)
@@ -130,24 +140,31 @@ class Keywords:
                 return
             elif str(payload.emoji) == '2️⃣':
                 # adding keyword
-                await message.channel.send("Please write the keyword you'd like to add.")
+                await self.send(message.channel, "Please write the keyword you'd like to add.")
                 self.state = KeywordState.ADD_KEYWORD
                 return
             elif str(payload.emoji) == '3️⃣':
-                await message.channel.send("Please write the keyword you'd like to remove.")
+                await self.send(message.channel, "Please write the keyword you'd like to remove.")
                 self.state = KeywordState.REMOVE_KEYWORD
                 return
             elif str(payload.emoji) == '4️⃣':
                 # done/cancel
                 self.state = KeywordState.CANCELLED_KEYWORDS
-                await message.channel.send("Ending the keyword editing process.")
+                await self.send(message.channel, "Ending the keyword editing process.")
                 return
             
-            await message.channel.send("Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either 1️⃣, 2️⃣, 3️⃣, or 4️⃣")
+            await self.send(message.channel, "Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either 1️⃣, 2️⃣, 3️⃣, or 4️⃣")
             return
         
         return
     
+    def prompt_message_id(self):
+        return self.abuse_category_message_id
+
+    async def send(self, channel, content):
+        # Keyword editing is never urgent, so it waits behind report traffic
+        return await self.client.outbound.send(channel, content, priority=Priority.LOW)
+
     def keywords_done(self):
         return self.state == KeywordState.CANCELLED_KEYWORDS
     
@@ -0,0 +1,135 @@
+# localClassifier.py
+import re
+import zlib
+import numpy as np
+from scoreCache import normalize
+
+class HashingVectorizer:
+    '''
+    Turns text into sparse feature vectors without a vocabulary: word unigrams, word bigrams and
+    character n-grams are hashed into n_features buckets with a sign bit to reduce collisions.
+    Rows are L2 normalized.
+    '''
+
+    def __init__(self, n_features=2 ** 18, char_ngrams=(3, 5)):
+        self.n_features = n_features
+        self.char_ngrams = tuple(char_ngrams)
+
+    def features(self, text):
+        text = normalize(text)
+        words = re.findall(r'\w+', text)
+        features = ['w:' + word for word in words]
+        features += ['b:' + first + ' ' + second for first, second in zip(words, words[1:])]
+        padded = f' {text} '
+        for n in range(self.char_ngrams[0], self.char_ngrams[1] + 1):
+            features += ['c:' + padded[i:i + n] for i in range(len(padded) - n + 1)]
+        return features
+
+    def transform_one(self, text):
+        hashes = np.fromiter((zlib.crc32(f.encode('utf-8')) for f in self.features(text)), dtype=np.uint32)
+        if hashes.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+        indices, inverse = np.unique(hashes % self.n_features, return_inverse=True)
+        values = np.zeros(indices.size, dtype=np.float32)
+        np.add.at(values, inverse, signs)
+        norm = np.linalg.norm(values)
+        if norm > 0:
+            values /= norm
+        return indices.astype(np.int64), values
+
+    def transform(self, texts):
+        '''
+        Returns the batch in CSR form as (indptr, indices, values).
+        '''
+        rows = [self.transform_one(text) for text in texts]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([indices.size for indices, _ in rows])
+        if not rows:
+            return indptr, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        indices = np.concatenate([indices for indices, _ in rows])
+        values = np.concatenate([values for _, values in rows])
+        return indptr, indices, values
+
+
+def row_ids(indptr):
+    return np.repeat(np.arange(indptr.size - 1), np.diff(indptr))
+
+
+class LocalClassifier:
+    '''
+    Linear model over hashed n-gram features, scored entirely with NumPy on the CPU. Messages whose
+    toxicity probability is at or below benign_threshold are treated as benign (the cascade's reject
+    test) so the bot can skip the Perspective call for them. is_benign() is that same test.
+    '''
+
+    def __init__(self, weights, bias, vectorizer, benign_threshold, holdout_recall_loss=None):
+        self.weights = weights
+        self.bias = bias
+        self.vectorizer = vectorizer
+        self.benign_threshold = benign_threshold
+        self.holdout_recall_loss = holdout_recall_loss # Share of toxic holdout messages the threshold skipped
+
+    @classmethod
+    def load(cls, path):
+        model = np.load(path)
+        vectorizer = HashingVectorizer(int(model['n_features']), tuple(int(n) for n in model['char_ngrams']))
+        holdout_recall_loss = float(model['holdout_recall_loss']) if 'holdout_recall_loss' in model else np.nan
+        if np.isnan(holdout_recall_loss):
+            holdout_recall_loss = None
+        return cls(model['weights'], float(model['bias']), vectorizer, float(model['benign_threshold']), holdout_recall_loss)
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            weights=self.weights.astype(np.float32),
+            bias=self.bias,
+            n_features=self.vectorizer.n_features,
+            char_ngrams=np.array(self.vectorizer.char_ngrams),
+            benign_threshold=self.benign_threshold,
+            holdout_recall_loss=np.nan if self.holdout_recall_loss is None else self.holdout_recall_loss,
+        )
+
+    def is_benign(self, probabilities):
+        return probabilities <= self.benign_threshold
+
+    def predict_proba(self, texts):
+        indptr, indices, values = self.vectorizer.transform(texts)
+        logits = np.bincount(row_ids(indptr), weights=self.weights[indices] * values, minlength=len(texts)) + self.bias
+        return 1.0 / (1.0 + np.exp(-logits))
+
+
+def train(texts, labels, vectorizer, epochs=5, learning_rate=0.5, l2=1e-6, batch_size=256, seed=0):
+    '''
+    Fits logistic regression weights with mini-batch SGD. Positive examples are weighted up to
+    balance the classes. Returns (weights, bias).
+    '''
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels, dtype=np.float32)
+    positives = max(labels.sum(), 1.0)
+    positive_weight = (labels.size - positives) / positives if labels.size > positives else 1.0
+    rows = [vectorizer.transform_one(text) for text in texts]
+
+    weights = np.zeros(vectorizer.n_features, dtype=np.float32)
+    bias = 0.0
+    for epoch in range(epochs):
+        order = rng.permutation(len(rows))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            indptr = np.zeros(batch.size + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([rows[i][0].size for i in batch])
+            indices = np.concatenate([rows[i][0] for i in batch])
+            values = np.concatenate([rows[i][1] for i in batch])
+            batch_rows = row_ids(indptr)
+
+            logits = np.bincount(batch_rows, weights=weights[indices] * values, minlength=batch.size) + bias
+            probabilities = 1.0 / (1.0 + np.exp(-logits))
+            y = labels[batch]
+            errors = (probabilities - y) * np.where(y > 0, positive_weight, 1.0)
+
+            gradient = np.zeros_like(weights)
+            np.add.at(gradient, indices, values * errors[batch_rows])
+            step = learning_rate / batch.size
+            weights -= step * gradient + learning_rate * l2 * weights
+            bias -= step * errors.sum()
+    return weights, bias
@@ -0,0 +1,127 @@
+# logPipeline.py
+import logging
+import logging.handlers
+import queue
+import time
+
+
+class RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    '''
+    Rotates the log once it reaches max_bytes or once every interval seconds, whichever comes first,
+    keeping backup_count old files as <filename>.1 (the newest) to <filename>.<backup_count>.
+    '''
+
+    def __init__(self, filename, max_bytes, backup_count, interval=None):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Hands records to the writer thread through a bounded queue. When a storm of events fills the
+    queue, records are dropped and counted rather than making the caller (the event loop) wait.
+    '''
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The record stays in this process, so only what could change before the writer gets to it
+        # is settled here: the arguments go into the message and the traceback into text. Formatting
+        # the line happens on the writer thread.
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    '''
+    QueueListener whose stop() works on a full queue. The stop sentinel waits up to stop_timeout
+    seconds for the writer to make room, after which the oldest records are discarded for it.
+    '''
+
+    def __init__(self, log_queue, *handlers, stop_timeout=10.0, respect_handler_level=False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.stop_timeout = stop_timeout
+        self.discarded = 0
+
+    def enqueue_sentinel(self):
+        try:
+            self.queue.put(self._sentinel, timeout=self.stop_timeout)
+            return
+        except queue.Full:
+            pass
+        while True:
+            try:
+                self.queue.put_nowait(self._sentinel)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.discarded += 1
+                except queue.Empty:
+                    pass
+
+
+class LogPipeline:
+    '''
+    Logging that never writes to disk on the event loop. Loggers put records on a bounded queue and
+    a QueueListener thread formats them and writes them to a size and time rotated file, and those
+    at console_level or above to the console too. Levels are set per logger (e.g. {'': 'INFO',
+    'discord': 'DEBUG'}), so chatty modules can be turned down without losing the rest.
+    '''
+
+    def __init__(self, filename, levels, max_bytes, backup_count, interval=None, queue_size=10000, console_level=None):
+        self.filename = filename
+        self.levels = levels
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.file_handler = RotatingFileHandler(filename, max_bytes, backup_count, interval)
+        formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+        self.file_handler.setFormatter(formatter)
+        handlers = [self.file_handler]
+        if console_level is not None:
+            console = logging.StreamHandler()
+            console.setLevel(console_level)
+            console.setFormatter(formatter)
+            handlers.append(console)
+        self.listener = DrainingQueueListener(self.queue, *handlers, respect_handler_level=True)
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'dropped': self.handler.dropped + self.listener.discarded}
+
+    def start(self):
+        for name, level in self.levels.items():
+            logging.getLogger(name or None).setLevel(level)
+        logging.getLogger().addHandler(self.handler)
+        self.listener.start()
+
+    def stop(self):
+        # Writes out whatever is still queued before closing the file
+        logging.getLogger().removeHandler(self.handler)
+        try:
+            self.listener.stop()
+        finally:
+            self.file_handler.close()
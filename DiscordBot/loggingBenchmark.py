@@ -0,0 +1,128 @@
+# loggingBenchmark.py
+# Measures how much logging holds up the event loop during a storm of gateway events. Each event is
+# logged at DEBUG the way discord.py logs what it receives, and a sampler task measures how late
+# the loop wakes it up. Three setups are compared: logging off, the old synchronous FileHandler on
+# the loop, and LogPipeline (queue plus writer thread). --write-delay makes every write to the file
+# slower, like a busy or network disk, which is where writing on the loop hurts most.
+#
+#   python loggingBenchmark.py --rate 20000 --seconds 5
+#   python loggingBenchmark.py --rate 20000 --seconds 5 --write-delay 0.0005
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from logPipeline import LogPipeline
+
+logger = logging.getLogger('discord.gateway')
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def slow_down(handler, delay):
+    # Every record the handler writes takes delay seconds longer, on whichever thread writes it
+    emit = handler.emit
+
+    def slow_emit(record):
+        time.sleep(delay)
+        emit(record)
+    handler.emit = slow_emit
+
+
+def setup(mode, path, args):
+    # Returns a function that undoes the setup and reports how many records were dropped
+    root = logging.getLogger()
+    if mode == 'off':
+        logger.setLevel(logging.WARNING)
+        return lambda: 0
+    if mode == 'sync':
+        # What bot.py used to do
+        logger.setLevel(logging.DEBUG)
+        handler = logging.FileHandler(filename=path, encoding='utf-8', mode='w')
+        handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+        slow_down(handler, args.write_delay)
+        root.addHandler(handler)
+
+        def undo():
+            root.removeHandler(handler)
+            handler.close()
+            return 0
+        return undo
+    pipeline = LogPipeline(path, {'discord': 'DEBUG'}, 1024 * 1024 * 1024, 1, queue_size=args.queue_size)
+    slow_down(pipeline.file_handler, args.write_delay)
+    pipeline.start()
+
+    def undo():
+        dropped = pipeline.handler.dropped
+        pipeline.stop()
+        return dropped
+    return undo
+
+
+async def sample_lag(lags, stop, interval=0.005):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def storm(args, payload):
+    # Events arrive in bursts every tick, like gateway messages read off the socket together
+    per_tick = max(1, int(args.rate * args.tick))
+    events = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.seconds:
+        for _ in range(per_tick):
+            logger.debug('For Shard ID %s: WebSocket Event: %s', 0, payload)
+            events += 1
+        await asyncio.sleep(args.tick)
+    return events, time.perf_counter() - start
+
+
+async def measure(mode, args):
+    payload = {'op': 0, 't': 'MESSAGE_CREATE', 'd': {'content': 'x' * args.payload}}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'discord.log')
+        undo = setup(mode, path, args)
+        lags = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_lag(lags, stop))
+        events, elapsed = await storm(args, payload)
+        stop.set()
+        await sampler
+        # Time until the writer has caught up, which the loop didn't have to wait for
+        flush_start = time.perf_counter()
+        dropped = undo()
+        flush = time.perf_counter() - flush_start
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+    return events, elapsed, lags, dropped, flush, size
+
+
+def main(args):
+    print(f"{args.rate} events/s for {args.seconds}s in bursts every {args.tick * 1000:.0f}ms, {args.write_delay * 1000:.2f}ms extra per write")
+    print(f"{'mode':>8}  {'events/s':>10}  {'lag p50 ms':>10}  {'lag p99 ms':>10}  {'lag max ms':>10}  {'dropped':>8}  {'drain s':>7}  {'log MB':>7}")
+    for mode in args.modes:
+        events, elapsed, lags, dropped, flush, size = asyncio.run(measure(mode, args))
+        print(
+            f"{mode:>8}  {events / elapsed:>10,.0f}  {percentile(lags, 50) * 1000:>10.2f}  {percentile(lags, 99) * 1000:>10.2f}  "
+            f"{max(lags, default=0.0) * 1000:>10.2f}  {dropped:>8}  {flush:>7.2f}  {size / 1024 / 1024:>7.1f}"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure event loop lag with logging off, on the loop and through LogPipeline.")
+    parser.add_argument('--modes', type=lambda value: value.split(','), default=['off', 'sync', 'pipeline'], help="Comma-separated setups to try: off, sync, pipeline")
+    parser.add_argument('--rate', type=int, default=20000, help="Gateway events per second")
+    parser.add_argument('--seconds', type=float, default=5.0, help="How long the storm lasts")
+    parser.add_argument('--tick', type=float, default=0.01, help="Seconds between bursts of events")
+    parser.add_argument('--payload', type=int, default=200, help="Characters of message content in each logged event")
+    parser.add_argument('--write-delay', type=float, default=0.0, help="Extra seconds each write to the log file takes")
+    parser.add_argument('--queue-size', type=int, default=50000, help="LogPipeline queue size")
+    main(parser.parse_args())
@@ -0,0 +1,144 @@
+# messageResolver.py
+import asyncio
+import discord
+import re
+import time
+from collections import OrderedDict
+
+# https://discord.com/channels/<guild>/<channel>/<message>
+LINK_PATTERN = re.compile(r'/(\d+)/(\d+)/(\d+)')
+
+
+class LinkError(Exception):
+    pass
+
+class InvalidLink(LinkError):
+    pass
+
+class UnknownGuild(LinkError):
+    pass
+
+class UnknownChannel(LinkError):
+    pass
+
+# Discord's error code for a channel that doesn't exist, as opposed to a message that doesn't
+UNKNOWN_CHANNEL = 10003
+
+
+class MessageResolver:
+    '''
+    Turns message links into discord.Message objects for every review flow. Fetched messages are
+    kept in an LRU with a TTL, concurrent lookups of the same message share one fetch, and entries
+    are invalidated when Discord reports the message was edited or deleted. A fetch that was in
+    flight when its message changed is returned to its callers but not cached.
+    '''
+
+    def __init__(self, client, max_entries=1024, ttl=300.0):
+        self.client = client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache = OrderedDict() # Map from message ID to (expires_at, message), least recently used first
+        self.pending = {} # Map from message ID to the in-flight fetch
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.invalidations = 0
+
+    def stats(self):
+        return {
+            'cached_messages': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'fetches': self.fetches,
+            'invalidations': self.invalidations,
+        }
+
+    @staticmethod
+    def parse(text):
+        '''
+        Returns (guild ID, channel ID, message ID) from a message link, or None.
+        '''
+        m = LINK_PATTERN.search(text)
+        if not m:
+            return None
+        return int(m.group(1)), int(m.group(2)), int(m.group(3))
+
+    async def resolve(self, text):
+        '''
+        Fetches the message a link points to. Raises InvalidLink, UnknownGuild or UnknownChannel
+        for links the bot can't follow, and discord.NotFound if the message doesn't exist.
+
+        Guilds on shards another process runs aren't in this process's cache, so their messages are
+        fetched over REST by channel ID, and Discord decides whether the bot can see them.
+        '''
+        ids = self.parse(text)
+        if ids is None:
+            raise InvalidLink(text)
+        guild_id, channel_id, message_id = ids
+        guild = self.client.get_guild(guild_id)
+        if guild:
+            channel = guild.get_channel(channel_id)
+            if not channel:
+                raise UnknownChannel(channel_id)
+            return await self.fetch(channel_id, message_id, channel)
+        if self.client.runs_guild(guild_id):
+            raise UnknownGuild(guild_id)
+        try:
+            return await self.fetch(channel_id, message_id, guild_id=guild_id)
+        except discord.Forbidden:
+            raise UnknownGuild(guild_id)
+        except discord.NotFound as e:
+            if e.code == UNKNOWN_CHANNEL:
+                raise UnknownChannel(channel_id)
+            raise
+
+    async def fetch(self, channel_id, message_id, channel=None, guild_id=None):
+        '''
+        Fetches a message by ID. guild_id is needed for messages in guilds this process doesn't
+        cache, whose messages would otherwise come back without a guild.
+        '''
+        message = await self.lookup(channel_id, message_id, channel, guild_id)
+        if message.guild is None and guild_id is not None:
+            # Only the ID is known, which is all routing a report needs
+            message.guild = discord.Object(id=guild_id)
+        return message
+
+    async def lookup(self, channel_id, message_id, channel, guild_id):
+        entry = self.cache.get(message_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            self.cache.move_to_end(message_id)
+            return entry[1]
+        self.misses += 1
+
+        future = self.pending.get(message_id)
+        if future is None:
+            if channel is None:
+                channel = self.client.get_channel(channel_id) or self.client.get_partial_messageable(channel_id, guild_id=guild_id)
+            future = asyncio.ensure_future(self._fetch(channel, message_id))
+            self.pending[message_id] = future
+
+            def forget(done):
+                if self.pending.get(message_id) is done:
+                    del self.pending[message_id]
+            future.add_done_callback(forget)
+        return await asyncio.shield(future)
+
+    async def _fetch(self, channel, message_id):
+        self.fetches += 1
+        message = await channel.fetch_message(message_id)
+        # invalidate() drops the pending fetch, so only cache if nothing changed while we waited
+        if self.pending.get(message_id) is asyncio.current_task():
+            self.cache[message_id] = (time.monotonic() + self.ttl, message)
+            self.cache.move_to_end(message_id)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return message
+
+    def invalidate(self, message_id):
+        # Called from on_raw_message_edit/on_raw_message_delete
+        self.invalidations += 1
+        self.cache.pop(message_id, None)
+        self.pending.pop(message_id, None)
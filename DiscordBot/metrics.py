@@ -0,0 +1,197 @@
+# metrics.py
+import bisect
+import logging
+import time
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a keyword match (well under a millisecond) to a slow OpenAI call
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    '''
+    Latency histogram of one stage: how many observations fell in each bucket, their sum and how
+    many ended in an exception.
+    '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last one is +Inf
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+    def snapshot(self):
+        return list(self.counts), self.sum, self.errors
+
+
+class Timer:
+    '''
+    Context manager that records the time spent inside it as one observation of a stage. Works
+    around awaits too.
+    '''
+    __slots__ = ('registry', 'stage', 'start')
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.stage, time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+class Registry:
+    '''
+    Stage latency histograms and event counters for this process, rendered in the Prometheus text
+    format. Recording is a perf_counter call, a bisect and a few additions on the event loop thread,
+    so it stays on in production. Classifier worker processes send their snapshot() over now and
+    then and it is added in with merge(), and collectors added with add_collector() turn the
+    components' stats() dicts into gauges when the endpoint is scraped.
+    '''
+
+    def __init__(self, prefix='modbot'):
+        self.prefix = prefix
+        self.stages = {} # Map from stage name to its Histogram
+        self.events = {} # Map from event name to how many times it happened
+        self.remote = {} # Map from source (e.g. a classifier worker) to its latest snapshot
+        self.collectors = {} # Map from component name to its stats function
+
+    def timed(self, stage):
+        return Timer(self, stage)
+
+    def observe(self, stage, seconds, error=False):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds, error)
+
+    def count(self, event, amount=1):
+        self.events[event] = self.events.get(event, 0) + amount
+
+    def add_collector(self, component, stats):
+        self.collectors[component] = stats
+
+    def snapshot(self):
+        # Plain data, so it can be pickled across processes
+        return {
+            'stages': {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+            'events': dict(self.events),
+        }
+
+    def merge(self, source, snapshot):
+        # Snapshots are cumulative, so the latest one from each source replaces the one before
+        self.remote[source] = snapshot
+
+    def combined(self):
+        stages = {}
+        events = dict(self.events)
+        for snapshot in [self.snapshot()] + list(self.remote.values()):
+            for stage, (counts, total, errors) in snapshot['stages'].items():
+                if stage not in stages:
+                    stages[stage] = [[0] * len(counts), 0.0, 0]
+                merged = stages[stage]
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += errors
+        for snapshot in self.remote.values():
+            for event, count in snapshot['events'].items():
+                events[event] = events.get(event, 0) + count
+        return stages, events
+
+    def render(self):
+        stages, events = self.combined()
+        name = f'{self.prefix}_stage_seconds'
+        lines = [f'# HELP {name} Time spent in each stage.', f'# TYPE {name} histogram']
+        for stage, (counts, total, _) in sorted(stages.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+
+        name = f'{self.prefix}_stage_errors_total'
+        lines += [f'# HELP {name} Stage runs that ended in an exception.', f'# TYPE {name} counter']
+        for stage, (_, _, errors) in sorted(stages.items()):
+            lines.append(f'{name}{{stage="{stage}"}} {errors}')
+
+        name = f'{self.prefix}_events_total'
+        lines += [f'# HELP {name} Things worth counting, e.g. fallbacks.', f'# TYPE {name} counter']
+        for event, count in sorted(events.items()):
+            lines.append(f'{name}{{event="{event}"}} {count}')
+
+        name = f'{self.prefix}_component'
+        lines += [f'# HELP {name} Numbers from each component\'s stats().', f'# TYPE {name} gauge']
+        for component, stats in sorted(self.collectors.items()):
+            try:
+                values = flatten(stats())
+            except Exception:
+                logger.exception(f"Failed to collect stats of {component}")
+                continue
+            for stat, value in values:
+                lines.append(f'{name}{{component="{component}",stat="{stat}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def flatten(stats, prefix=''):
+    # Yields (name, number) for every number in a stats() dict, with nested keys joined by '_'
+    for key, value in stats.items():
+        key = f'{prefix}{key}'
+        if isinstance(value, bool):
+            yield key, int(value)
+        elif isinstance(value, (int, float)):
+            yield key, value
+        elif isinstance(value, dict):
+            yield from flatten(value, f'{key}_')
+
+
+class MetricsServer:
+    '''
+    Serves a registry at http://host:port/metrics for Prometheus to scrape.
+    '''
+
+    def __init__(self, registry, host='127.0.0.1', port=9152):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request):
+        return web.Response(
+            body=self.registry.render().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+        )
+
+
+# The registry of this process; modules record into it through these
+REGISTRY = Registry()
+timed = REGISTRY.timed
+observe = REGISTRY.observe
+count = REGISTRY.count
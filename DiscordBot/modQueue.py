@@ -0,0 +1,299 @@
+# modQueue.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import discord
+from outboundDispatcher import Priority
+from report import PriorityLevel
+from tracing import TRACER, trace_id_for
+
+logger = logging.getLogger(__name__)
+
+# Times a first embed that other reports were merged into is sent before giving up, and the wait
+# before the first retry (doubled each time)
+REPOST_ATTEMPTS = 3
+REPOST_DELAY = 1.0
+# Reporters listed by name in a merged embed before the rest are just counted
+MAX_LISTED_REPORTERS = 10
+
+# Lower rank is reviewed first
+PRIORITY_RANK = {PriorityLevel.HIGH: 0, PriorityLevel.MEDIUM: 1, PriorityLevel.LOW: 2}
+PRIORITY_COLORS = {
+    PriorityLevel.LOW: discord.Color.blue(),
+    PriorityLevel.MEDIUM: discord.Color.gold(),
+    PriorityLevel.HIGH: discord.Color.red(),
+}
+
+
+def has_named_field(embed, name):
+    return any(field.name == name for field in embed.fields)
+
+
+def set_named_field(embed, name, value, inline=False):
+    # Updates the embed field with this name, or adds it if the embed doesn't have one yet
+    for index, field in enumerate(embed.fields):
+        if field.name == name:
+            embed.set_field_at(index, name=name, value=value, inline=field.inline)
+            return
+    embed.add_field(name=name, value=value, inline=inline)
+
+
+class QueueItem:
+    '''
+    One flagged message waiting for moderation and the single mod-channel embed that represents it.
+    '''
+
+    def __init__(self, flagged_message, mod_channel, embed, priority):
+        self.flagged_message_id = flagged_message.id
+        self.flagged_message = flagged_message
+        self.mod_channel = mod_channel
+        self.embed = embed
+        self.priority = priority
+        self.reporters = {} # IDs of users who reported it, in the order they did; automatic flags aren't counted
+        self.reports = 0
+        self.labels = []
+        self.opened_at = time.monotonic()
+        self.resolved_at = None
+        self.message = None # The mod-channel message, once it has been sent
+        self.dirty = False # The embed changed since it was last sent
+        self.editing = None
+
+    def rank(self):
+        return PRIORITY_RANK[self.priority]
+
+    def add_report(self, reporter_id, priority, label):
+        self.reports += 1
+        if reporter_id is not None:
+            self.reporters[reporter_id] = True
+        if PRIORITY_RANK[priority] < self.rank():
+            self.priority = priority
+        if label and label not in self.labels:
+            self.labels.append(label)
+        self.dirty = True
+
+    def render(self):
+        self.embed.color = PRIORITY_COLORS[self.priority]
+        set_named_field(self.embed, "Priority", self.priority.value, inline=True)
+        if self.reports > 1:
+            set_named_field(self.embed, "Reports", f"{self.reports} ({len(self.reporters)} users)", inline=True)
+        # The first user report names its reporter; once there are more (or a user report was merged
+        # into an automatic flag) list them all
+        if len(self.reporters) > 1 or (self.reporters and not has_named_field(self.embed, "Reported by")):
+            listed = ", ".join(f"<@{reporter_id}>" for reporter_id in itertools.islice(self.reporters, MAX_LISTED_REPORTERS))
+            if len(self.reporters) > MAX_LISTED_REPORTERS:
+                listed += f" and {len(self.reporters) - MAX_LISTED_REPORTERS} more"
+            set_named_field(self.embed, "Reported by", listed, inline=True)
+        if len(self.labels) > 1:
+            set_named_field(self.embed, "All reported abuse types", ", ".join(self.labels))
+        # Lets a moderator's actions be matched up with this report in the traces
+        self.embed.set_footer(text=f"Trace {trace_id_for(self.flagged_message_id)}")
+        return self.embed
+
+
+class ModQueue:
+    '''
+    Index of open mod-channel reports keyed by the flagged message's ID. A report about a message
+    that already has an open embed is merged into it, and the embed is edited in place with the
+    report count and the highest priority seen, so 50 reports of one message show up as one item.
+    Edits are coalesced, so a burst of duplicates costs a single edit per embed.
+
+    Open items are also kept in a heap ordered by priority and age, which pending() uses to list
+    the most urgent work first. Resolved items stay merged for resolved_ttl seconds (a late
+    report reopens them) and are then forgotten; open items are forgotten after open_ttl.
+    '''
+
+    def __init__(self, outbound, resolved_ttl=3600.0, open_ttl=7 * 24 * 3600.0, sweep_interval=60.0):
+        self.outbound = outbound
+        self.resolved_ttl = resolved_ttl
+        self.open_ttl = open_ttl
+        self.sweep_interval = sweep_interval
+        self.items = {} # Map from flagged message ID to QueueItem
+        self.heap = [] # (rank, sequence, flagged message ID), with stale entries skipped lazily
+        self.sequence = itertools.count()
+        self.sweeper = None
+        self.edits = set()
+
+        # Metrics
+        self.posted = 0
+        self.merged = 0
+        self.resolved = 0
+        self.expired = 0
+
+    def stats(self):
+        return {
+            'open_items': sum(1 for item in self.items.values() if item.resolved_at is None),
+            'tracked_items': len(self.items),
+            'posted': self.posted,
+            'merged': self.merged,
+            'resolved': self.resolved,
+            'expired': self.expired,
+        }
+
+    def start(self):
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            try:
+                await self.sweeper
+            except asyncio.CancelledError:
+                pass
+            self.sweeper = None
+
+    # Reports ------------------------------------------------------------------
+
+    async def post(self, flagged_message, mod_channel, embed, priority, reporter_id=None, label=None):
+        '''
+        Posts embed for flagged_message, or merges the report into the embed already open for it.
+        Returns the mod-channel message (None if the first embed for the message is still sending).
+        '''
+        item = self.items.get(flagged_message.id)
+        if item is not None:
+            self.merged += 1
+            item.add_report(reporter_id, priority, label)
+            if item.resolved_at is not None:
+                # Reported again after a moderator dealt with it, so it needs another look
+                item.resolved_at = None
+                item.opened_at = time.monotonic()
+                set_named_field(item.embed, "Status", "Reopened after a new report")
+            self.push(item)
+            self.schedule_edit(item)
+            return item.message
+
+        item = QueueItem(flagged_message, mod_channel, embed, priority)
+        item.add_report(reporter_id, priority, label)
+        self.items[flagged_message.id] = item
+        self.push(item)
+        item.dirty = False
+        try:
+            item.message = await self.outbound.send(mod_channel, embed=item.render(), priority=self.outbound_priority(item))
+        except Exception as e:
+            if item.reports == 1:
+                del self.items[flagged_message.id]
+                raise
+            # Reports merged in while this was sending were told the embed is on its way, so keep
+            # trying to post it with them
+            logger.warning(f"Could not post the mod-channel report for message {flagged_message.id}, retrying: {e}")
+            item.dirty = True
+            item.editing = asyncio.create_task(self.repost(item))
+            self.edits.add(item.editing)
+            item.editing.add_done_callback(self.edits.discard)
+            return None
+        self.posted += 1
+        # Duplicates that arrived while the embed was being sent
+        self.schedule_edit(item)
+        return item.message
+
+    def set_field(self, flagged_message_id, name, value, inline=False):
+        '''
+        Fills in a field of an item's embed, e.g. a subcategory that was classified after posting.
+        '''
+        item = self.items.get(flagged_message_id)
+        if item is None:
+            return
+        set_named_field(item.embed, name, value, inline)
+        item.dirty = True
+        self.schedule_edit(item)
+
+    def resolve(self, flagged_message_id, outcome):
+        item = self.items.get(flagged_message_id)
+        if item is None or item.resolved_at is not None:
+            return
+        item.resolved_at = time.monotonic()
+        self.resolved += 1
+        TRACER.event(trace_id_for(flagged_message_id), 'resolved', outcome=outcome)
+        set_named_field(item.embed, "Status", outcome)
+        item.dirty = True
+        self.schedule_edit(item)
+
+    def pending(self, limit=10):
+        '''
+        The most urgent open items, highest priority first and oldest first within a priority.
+        '''
+        while self.heap and self.stale(self.heap[0]):
+            heapq.heappop(self.heap)
+        entries = heapq.nsmallest(limit, (entry for entry in self.heap if not self.stale(entry)))
+        return [self.items[entry[2]] for entry in entries]
+
+    def outbound_priority(self, item):
+        return Priority.HIGH if item.priority == PriorityLevel.HIGH else Priority.NORMAL
+
+    # Heap ---------------------------------------------------------------------
+
+    def push(self, item):
+        heapq.heappush(self.heap, (item.rank(), next(self.sequence), item.flagged_message_id))
+        # Rebuild once stale entries (from priority bumps and resolved items) dominate the heap
+        if len(self.heap) > 2 * len(self.items) + 64:
+            self.heap = [entry for entry in self.heap if not self.stale(entry)]
+            heapq.heapify(self.heap)
+
+    def stale(self, entry):
+        rank, _, flagged_message_id = entry
+        item = self.items.get(flagged_message_id)
+        return item is None or item.resolved_at is not None or item.rank() != rank
+
+    # Edits --------------------------------------------------------------------
+
+    def schedule_edit(self, item):
+        # One edit loop per item; changes made while an edit is in flight are sent by the next pass
+        if item.message is None or item.editing is not None or not item.dirty:
+            return
+        item.editing = asyncio.create_task(self.edit(item))
+        self.edits.add(item.editing)
+        item.editing.add_done_callback(self.edits.discard)
+
+    async def repost(self, item):
+        delay = REPOST_DELAY
+        try:
+            for attempt in range(REPOST_ATTEMPTS):
+                await asyncio.sleep(delay)
+                delay *= 2
+                item.dirty = False
+                try:
+                    item.message = await self.outbound.send(item.mod_channel, embed=item.render(), priority=self.outbound_priority(item))
+                except Exception as e:
+                    item.dirty = True
+                    logger.warning(f"Could not post the mod-channel report for message {item.flagged_message_id} (attempt {attempt + 2}): {e}")
+                    continue
+                self.posted += 1
+                return
+            logger.error(f"Gave up posting the mod-channel report for message {item.flagged_message_id}; {item.reports} reports were lost")
+            if self.items.get(item.flagged_message_id) is item:
+                del self.items[item.flagged_message_id]
+        finally:
+            item.editing = None
+            # Reports merged in while reposting
+            if item.message is not None:
+                self.schedule_edit(item)
+
+    async def edit(self, item):
+        try:
+            while item.dirty:
+                item.dirty = False
+                await self.outbound.edit(item.message, embed=item.render(), priority=self.outbound_priority(item))
+        except Exception as e:
+            logger.warning(f"Could not update the mod-channel report for message {item.flagged_message_id}: {e}")
+        finally:
+            item.editing = None
+
+    # Expiry -------------------------------------------------------------------
+
+    def sweep(self):
+        now = time.monotonic()
+        for flagged_message_id, item in list(self.items.items()):
+            if item.resolved_at is not None:
+                expired = now - item.resolved_at > self.resolved_ttl
+            else:
+                expired = now - item.opened_at > self.open_ttl
+            if expired and item.editing is None:
+                del self.items[flagged_message_id]
+                self.expired += 1
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
@@ -1,6 +1,10 @@
 from enum import Enum, auto
 import discord
-import re
+import metrics
+from tracing import TRACER, trace_id_for
+from sessionPersistence import message_ref, fetch_message_ref, fetch_user
+from outboundDispatcher import Priority
+from messageResolver import InvalidLink, UnknownGuild, UnknownChannel
 
 class ModState(Enum):
     REPORT_START = auto()
@@ -28,10 +32,19 @@ class ModState(Enum):
 
     BLOCK_USER = auto()
 
+URGENT_STATES = {
+    ModState.URGENT_VIOLENCE_CHOSEN,
+    ModState.URGENT_SELF_HARM,
+    ModState.URGENT_DIRECT_THREAT,
+    ModState.OFFENSIVE_TERRORISM,
+}
+
 class ModReport:
     START_KEYWORD = "mod"
+    # Plain attributes saved by to_state() so the review survives a restart
+    PERSISTED_FIELDS = ['follow_up_message_id', 'abuse_category_message_id', 'trace_id']
 
-    def __init__(self, client, three_person_team_channel, user_flag_counts, db):
+    def __init__(self, client, three_person_team_channel, flag_counts):
         self.state = ModState.REPORT_START
         self.client = client
         self.flagged_message = None
@@ -40,8 +53,10 @@ class ModReport:
         self.linked_message = None
         self.dm_channel = None
         self.three_person_team_channel = three_person_team_channel
-        self.user_flag_counts = user_flag_counts
-        self.db = db
+        self.flag_counts = flag_counts
+        self.abuse_category_message_id = None
+        self.cancelled = False
+        self.trace_id = None # Trace of the flagged message, once it has been found
         self.reactions = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣']
     
     async def handle_message(self, message):
@@ -50,42 +65,44 @@ class ModReport:
         '''
 
         if message.content == self.START_KEYWORD:
-            await message.channel.send("Please paste the link to the message you want to review.")
+            await self.send(message.channel, "Please paste the link to the message you want to review.")
             self.state = ModState.AWAITING_MESSAGE
             self.mod_channel = message.channel
             return
 
         if self.state == ModState.AWAITING_MESSAGE:
-            # Parse out the three ID strings from the message link
             self.linked_message = message
-            m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
-            if not m:
-                await message.channel.send("I'm sorry, I couldn't read that link. Please try again.")
+            # Fetch the message the link points to; repeat lookups are served from the shared cache
+            try:
+                with metrics.timed('link_resolve'):
+                    self.flagged_message = await self.client.message_resolver.resolve(message.content)
+            except InvalidLink:
+                await self.send(message.channel, "I'm sorry, I couldn't read that link. Please try again.")
                 return
-            guild = self.client.get_guild(int(m.group(1)))
-            if not guild:
-                await message.channel.send("I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again.")
+            except UnknownGuild:
+                await self.send(message.channel, "I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again.")
                 return
-            channel = guild.get_channel(int(m.group(2)))
-            if not channel:
-                await message.channel.send("It seems this channel was deleted or never existed. Please try again.")
+            except UnknownChannel:
+                await self.send(message.channel, "It seems this channel was deleted or never existed. Please try again.")
                 return
-            try:
-                self.flagged_message = await channel.fetch_message(int(m.group(3)))
             except discord.errors.NotFound:
-                await message.channel.send("It seems this message was deleted or never existed. Please try again.")
+                await self.send(message.channel, "It seems this message was deleted or never existed. Please try again.")
                 return
 
             self.state = ModState.MESSAGE_IDENTIFIED
+            self.trace_id = trace_id_for(self.flagged_message.id)
+            TRACER.event(self.trace_id, 'review_started', flow='moderation', moderator_id=message.author.id)
+            # Load the author's flag count now so choosing an action doesn't wait on the database
+            self.flag_counts.warm(self.flagged_message.author.id)
 
-            await message.channel.send(
+            await self.send(message.channel, 
                 f"I found this message and will now start the moderation process privately."
             )
 
             self.dm_channel = await message.author.create_dm()
             self.dm_message_author_channel = await self.flagged_message.author.create_dm()
 
-            sent_message = await self.dm_channel.send(
+            sent_message = await self.send(self.dm_channel, 
                 f"I found this message:\n"
                 f"```{self.flagged_message.author.name}: {self.flagged_message.content}```\n"
                 "Please react with the corresponding number for how to take the appropriate action with the flagged message:\n"
@@ -96,14 +113,13 @@ class ModReport:
                 "5️⃣ - Cancel manual report")
             self.abuse_category_message_id = sent_message.id
             self.follow_up_message_id = sent_message.id
-            for reaction in self.reactions:
-                await sent_message.add_reaction(reaction)
+            self.client.outbound.add_reactions(sent_message, self.reactions, self.outbound_priority())
             return
     
     async def handle_reaction(self, payload, message):
         if payload.message_id != self.follow_up_message_id:
             # If the reaction is not on the follow-up message, ignore it
-            await self.dm_channel.send("Please react to the message that contains emoji options to choose from.")
+            await self.send(self.dm_channel, "Please react to the message that contains emoji options to choose from.")
             return
             
         reaction = str(payload.emoji)
@@ -121,8 +137,7 @@ class ModReport:
                 self.state = ModState.OTHERS_CHOSEN
                 await self.handle_others_reaction()
             elif reaction == '5️⃣':
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -134,16 +149,15 @@ class ModReport:
                 await self.handle_message(self.linked_message)
             elif reaction == '2️⃣':
                 # send to review team
-                await self.three_person_team_channel.send(
+                await self.send(self.three_person_team_channel, 
                     f"User flagged the following message as 'Other'. Now pending further moderation.\n"
                     f"```{self.flagged_message.content}```")
 
-                await self.dm_channel.send("Report sent to three-person review team for further moderation. This moderation process is complete and further action will be pending.")
+                await self.send(self.dm_channel, "Report sent to three-person review team for further moderation. This moderation process is complete and further action will be pending.")
                 self.state = ModState.OTHERS_REVIEW_TEAM
             elif reaction == '3️⃣':
                 # cancel
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -152,42 +166,36 @@ class ModReport:
 
         elif self.state == ModState.HARASSMENT_CHOSEN:
             if reaction == '1️⃣':
-                users_ref = self.db.collection("users")
-                user_ref = users_ref.document(str(self.flagged_message.author.id))
-                user_doc = user_ref.get()
-                # Check if the document exists
-                flag_counts = 0
-                if user_doc.exists:
-                    flag_counts = user_doc.to_dict().get('flag_counts', 0)
+                with metrics.timed('flag_count_lookup'):
+                    flag_counts = await self.flag_counts.get(self.flagged_message.author.id)
 
-                await self.dm_channel.send(f"The user {self.flagged_message.author.name} has been previously flagged {flag_counts} times.")
+                await self.send(self.dm_channel, f"The user {self.flagged_message.author.name} has been previously flagged {flag_counts} times.")
 
                 # remove post
-                await self.dm_channel.send("Removing post...")
+                await self.send(self.dm_channel, "Removing post...")
                 
                 action_message = ""
                 if flag_counts < 5:
-                    await self.dm_message_author_channel.send(f"Your message below has been removed because it does not comply with our community guidelines. Please review the guidelines.\n```{self.flagged_message.content}```")
+                    await self.send(self.dm_message_author_channel, f"Your message below has been removed because it does not comply with our community guidelines. Please review the guidelines.\n```{self.flagged_message.content}```")
                     action_message = "Removed post. This moderation process is complete."
                 elif 5 <= flag_counts < 10:
-                    await self.dm_message_author_channel.send(f"You have been suspended for 3 days for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
+                    await self.send(self.dm_message_author_channel, f"You have been suspended for 3 days for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
                     action_message = "Suspended user for 3 days and removed post. This moderation process is complete."
                 else:
-                    await self.dm_message_author_channel.send(f"You have been banned for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
+                    await self.send(self.dm_message_author_channel, f"You have been banned for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
                     action_message = "Banned user and removed post. This moderation process is complete."
 
-                await self.flagged_message.delete()
+                await self.remove_post()
 
-                await self.dm_channel.send(action_message)
+                await self.send(self.dm_channel, action_message)
                 self.state = ModState.REPORT_COMPLETE
 
             elif reaction == '2️⃣':
-                await self.dm_channel.send("No action taken. This moderation process is complete.")
+                await self.send(self.dm_channel, "No action taken. This moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '3️⃣':
                 # cancel
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -202,8 +210,7 @@ class ModReport:
                 await self.handle_offensive_content_inciting_violence_reaction()
             elif reaction == '3️⃣':
                 # cancel manual moderation
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -211,18 +218,16 @@ class ModReport:
         elif self.state == ModState.OFFENSIVE_CONTENT_NOT_INCITING_VIOLENCE or self.state == ModState.OFFENSIVE_DANGEROUS_DEPICTION:
             if reaction == '1️⃣':
                 # remove post
-                await self.dm_channel.send("Removing post...")
-                await self.dm_message_author_channel.send(f"Your message below has been removed because it does not comply with our community guidelines. Please review the guidelines.\n```{self.flagged_message.content}```")
-                await self.flagged_message.delete()
-                await self.dm_channel.send("This post has been removed and the moderation process is complete.")
+                await self.send(self.dm_channel, "Removing post...")
+                await self.send(self.dm_message_author_channel, f"Your message below has been removed because it does not comply with our community guidelines. Please review the guidelines.\n```{self.flagged_message.content}```")
+                await self.remove_post()
+                await self.send(self.dm_channel, "This post has been removed and the moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '2️⃣':
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             elif reaction == '3️⃣':
                 # cancel
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -242,8 +247,7 @@ class ModReport:
                 await self.handle_offensive_violence_other_reaction()
             elif reaction == '5️⃣':
                 # cancel
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -251,18 +255,17 @@ class ModReport:
         elif self.state == ModState.OFFENSIVE_TERRORISM:
             if reaction == '1️⃣':
                 # ban user
-                await self.dm_message_author_channel.send(f"You have been banned for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
+                await self.send(self.dm_message_author_channel, f"You have been banned for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
                 # removing post
-                await self.dm_channel.send("Removing post...")
-                await self.flagged_message.delete()
+                await self.send(self.dm_channel, "Removing post...")
+                await self.remove_post()
 
                 # notify law enforcement
                 # basically do nothing... just a simulation
-                await self.dm_channel.send("Removed post, banned user, and sent automatic report to law enforcement. The moderation process is complete.")
+                await self.send(self.dm_channel, "Removed post, banned user, and sent automatic report to law enforcement. The moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '2️⃣':
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -270,16 +273,15 @@ class ModReport:
         elif self.state == ModState.OFFENSIVE_ANIMAL_ABUSE:
             if reaction == '1️⃣':
                 # removing post
-                await self.dm_message_author_channel.send(f"Your message below has been removed because it does not comply with our community guidelines. Please review the guidelines.\n```{self.flagged_message.content}```")
-                await self.dm_channel.send("Removing post...")
-                await self.flagged_message.delete()
+                await self.send(self.dm_message_author_channel, f"Your message below has been removed because it does not comply with our community guidelines. Please review the guidelines.\n```{self.flagged_message.content}```")
+                await self.send(self.dm_channel, "Removing post...")
+                await self.remove_post()
                 # notify APS
                 # basically do nothing... just a simulation
-                await self.dm_channel.send("Removed post and sent automatic report to animal protective services. The moderation process is complete.")
+                await self.send(self.dm_channel, "Removed post and sent automatic report to animal protective services. The moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '2️⃣':
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -290,16 +292,15 @@ class ModReport:
                 self.state = ModState.OFFENSIVE_CONTENT_INCITING_VIOLENCE
             elif reaction == '2️⃣':
                 # send to review team
-                await self.three_person_team_channel.send(
+                await self.send(self.three_person_team_channel, 
                     f"User flagged the following message as 'Inciting Violence -> Other'. Now pending further moderation.\n"
                     f"```{self.flagged_message.content}```")
 
-                await self.dm_channel.send("Report sent to three-person review team for further moderation. This moderation process is complete and further action will be pending.")
+                await self.send(self.dm_channel, "Report sent to three-person review team for further moderation. This moderation process is complete and further action will be pending.")
                 self.state = ModState.OTHERS_REVIEW_TEAM
             elif reaction == '3️⃣':
                 # cancel
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -315,8 +316,7 @@ class ModReport:
                 await self.handle_urgent_direct_threat_reaction()
             elif reaction == '3️⃣':
                 # cancel
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -324,23 +324,22 @@ class ModReport:
         elif self.state == ModState.URGENT_SELF_HARM:
             if reaction == '1️⃣':
                 # send resources to user
-                await self.flagged_message.author.send(f"We have seen your message below and are here to help. Here are some mental health resources: [link]. The message has also been removed from our platform to help keep our community safe.\n```{self.flagged_message.content}```")
+                await self.send(self.flagged_message.author, f"We have seen your message below and are here to help. Here are some mental health resources: [link]. The message has also been removed from our platform to help keep our community safe.\n```{self.flagged_message.content}```")
                 # remove post
-                await self.dm_channel.send("Removing post...")
-                await self.flagged_message.delete()
-                await self.dm_channel.send("Removed post and sent mental health resources to user. The moderation process is complete.")
+                await self.send(self.dm_channel, "Removing post...")
+                await self.remove_post()
+                await self.send(self.dm_channel, "Removed post and sent mental health resources to user. The moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '2️⃣':
                 # removing post
-                await self.dm_message_author_channel.send(f"Your message below has been removed because it does not comply with our community guidelines. Please review the guidelines.\n```{self.flagged_message.content}```")
-                await self.dm_channel.send("Removing post...")
-                await self.flagged_message.delete()
-                await self.dm_channel.send("Removed post. The moderation process is complete.")
+                await self.send(self.dm_message_author_channel, f"Your message below has been removed because it does not comply with our community guidelines. Please review the guidelines.\n```{self.flagged_message.content}```")
+                await self.send(self.dm_channel, "Removing post...")
+                await self.remove_post()
+                await self.send(self.dm_channel, "Removed post. The moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '3️⃣':
                 # cancel
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -348,52 +347,46 @@ class ModReport:
         elif self.state == ModState.URGENT_DIRECT_THREAT:
             if reaction == '1️⃣':
                 # No action
-                await self.dm_channel.send("No action taken. The moderation process is complete.")
+                await self.send(self.dm_channel, "No action taken. The moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '2️⃣':
-                users_ref = self.db.collection("users")
-                user_ref = users_ref.document(str(self.flagged_message.author.id))
-                user_doc = user_ref.get()
-                # Check if the document exists
-                flag_counts = 0
-                if user_doc.exists:
-                    flag_counts = user_doc.to_dict().get('flag_counts', 0)
+                with metrics.timed('flag_count_lookup'):
+                    flag_counts = await self.flag_counts.get(self.flagged_message.author.id)
 
-                await self.dm_channel.send(f"The user {self.flagged_message.author.name} has been previously flagged {flag_counts} times.")
+                await self.send(self.dm_channel, f"The user {self.flagged_message.author.name} has been previously flagged {flag_counts} times.")
 
                 # remove post
-                await self.dm_channel.send("Removing post...")
+                await self.send(self.dm_channel, "Removing post...")
                 
                 action_message = ""
                 if flag_counts < 5:
                     action_message = "Removed post. This moderation process is complete."
                 elif 5 <= flag_counts < 10:
-                    await self.dm_message_author_channel.send(f"You have been suspended for 3 days for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
+                    await self.send(self.dm_message_author_channel, f"You have been suspended for 3 days for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
                     action_message = "Suspended user for 3 days and removed post. This moderation process is complete."
                 else:
-                    await self.dm_message_author_channel.send(f"You have been banned for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
+                    await self.send(self.dm_message_author_channel, f"You have been banned for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
                     action_message = "Banned user and removed post. This moderation process is complete."
 
-                await self.flagged_message.delete()
+                await self.remove_post()
 
-                await self.dm_channel.send(action_message)
+                await self.send(self.dm_channel, action_message)
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '3️⃣':
                 # ban user
-                await self.dm_message_author_channel.send(f"You have been banned for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
+                await self.send(self.dm_message_author_channel, f"You have been banned for the following message, and it has been removed from our platform. Please review the community guidelines.\n```{self.flagged_message.content}```")
 
                 # removing post
-                await self.dm_channel.send("Removing post...")
-                await self.flagged_message.delete()
+                await self.send(self.dm_channel, "Removing post...")
+                await self.remove_post()
 
                 # notify law enforcement
                 # basically do nothing... just a simulation
-                await self.dm_channel.send("Removed post, banned user, and sent automatic report to law enforcement. The moderation process is complete.")
+                await self.send(self.dm_channel, "Removed post, banned user, and sent automatic report to law enforcement. The moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '4️⃣':
                 # cancel
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -533,13 +526,57 @@ class ModReport:
     
     async def send_follow_up_question(self, question, num_reactions):
         # Send a follow-up question and update the state
-        # sent_message = await self.flagged_message.channel.send(question)
-        sent_message = await self.dm_channel.send(question)
+        # sent_message = await self.send(self.flagged_message.channel, question)
+        sent_message = await self.send(self.dm_channel, question)
         self.follow_up_message_id = sent_message.id
-        for reaction in self.reactions[:num_reactions]:
-            await sent_message.add_reaction(reaction)
+        self.client.outbound.add_reactions(sent_message, self.reactions[:num_reactions], self.outbound_priority())
         # self.state = ModState.FOLLOW_UP_QUESTION_AWAITING_ANSWER
 
+    def prompt_message_id(self):
+        return self.follow_up_message_id
+
+    async def remove_post(self):
+        # The state the moderator removed it from is the category flag-to-removal latency is grouped by
+        with TRACER.span(self.trace_id, 'removal', flow='moderation', category=self.state.name):
+            await self.client.outbound.delete(self.flagged_message, self.outbound_priority())
+
+    async def cancel(self):
+        await self.send(self.dm_channel, "Canceled manual moderation.")
+        self.cancelled = True
+        self.state = ModState.REPORT_COMPLETE
+
+    def outbound_priority(self):
+        # Violent threats and self harm are handled ahead of other moderation traffic
+        return Priority.HIGH if self.state in URGENT_STATES else Priority.NORMAL
+
+    async def send(self, channel, content):
+        return await self.client.outbound.send(channel, content, priority=self.outbound_priority())
+
+    def to_state(self):
+        state = {field: getattr(self, field) for field in self.PERSISTED_FIELDS}
+        state['state'] = self.state.name
+        state['flagged_message'] = message_ref(self.flagged_message)
+        state['linked_message'] = message_ref(self.linked_message)
+        state['mod_channel'] = self.mod_channel.id if self.mod_channel else None
+        state['review_channel'] = self.three_person_team_channel.id if self.three_person_team_channel else None
+        return state
+
+    @classmethod
+    async def restore(cls, client, moderator_id, state, three_person_team_channel, flag_counts):
+        report = cls(client, three_person_team_channel, flag_counts)
+        for field in cls.PERSISTED_FIELDS:
+            setattr(report, field, state.get(field))
+        report.state = ModState[state['state']]
+        report.flagged_message = await fetch_message_ref(client, state['flagged_message'])
+        report.linked_message = await fetch_message_ref(client, state['linked_message'])
+        if state['mod_channel'] is not None:
+            report.mod_channel = client.get_channel(state['mod_channel'])
+        if report.flagged_message is not None:
+            moderator = await fetch_user(client, moderator_id)
+            report.dm_channel = await moderator.create_dm()
+            report.dm_message_author_channel = await report.flagged_message.author.create_dm()
+        return report
+
     def report_complete(self):
         return self.state == ModState.REPORT_COMPLETE
     
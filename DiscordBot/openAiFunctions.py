@@ -1,16 +1,50 @@
-from openai import OpenAI
+import asyncio
+import random
+import openai
+import metrics
+from openai import AsyncOpenAI
+
+SUBCATEGORY_PROMPT = "You are a content moderation system. Classify each input into one of the following hate speech subcategories: racism, sexism, homophobia, transphobia, xenophobia, or other."
+FALLBACK_SUBCATEGORY = "Unclassified (classifier unavailable)"
 
 class OpenAIFunctions:
-    def __init__(self, api_key):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key, max_in_flight=4, timeout=10.0, max_retries=3, backoff=0.5):
+        # Built-in retries are turned off so ours can add jitter and stay inside the deadline
+        self.async_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    async def detect_subcategory_async(self, text):
+        '''
+        Asks the LLM for the hate speech subcategory of text. At most max_in_flight requests run at
+        once, rate limits and server errors are retried with jittered exponential backoff, and if no
+        answer arrives within timeout seconds (including retries) FALLBACK_SUBCATEGORY is returned.
+        '''
+        try:
+            with metrics.timed('detect_subcategory'):
+                async with self.semaphore:
+                    return await asyncio.wait_for(self._detect_with_retries(text), self.timeout)
+        except (asyncio.TimeoutError, openai.OpenAIError):
+            metrics.count('detect_subcategory_fallback')
+            return FALLBACK_SUBCATEGORY
 
-    def detect_subcategory(self, text):
-        response = self.client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a content moderation system. Classify each input into one of the following hate speech subcategories: racism, sexism, homophobia, transphobia, xenophobia, or other."},
-                {"role": "user", "content": text}
-            ],
-            model="gpt-3.5-turbo"
-        )
-        subcategory = response.choices[0].message.content
-        return subcategory
\ No newline at end of file
+    async def _detect_with_retries(self, text):
+        attempt = 0
+        while True:
+            try:
+                response = await self.async_client.chat.completions.create(
+                    messages=[
+                        {"role": "system", "content": SUBCATEGORY_PROMPT},
+                        {"role": "user", "content": text}
+                    ],
+                    model="gpt-3.5-turbo"
+                )
+                return response.choices[0].message.content
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError):
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                # Full jitter keeps a burst of flagged messages from retrying in lockstep
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
@@ -0,0 +1,241 @@
+# outboundDispatcher.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import metrics
+from collections import OrderedDict, deque
+from enum import IntEnum
+
+logger = logging.getLogger(__name__)
+
+# Idle routes kept around so their buckets remember recent usage
+MAX_IDLE_ROUTES = 1024
+# How many queue waits are kept per priority class for percentiles
+WAIT_SAMPLES = 1000
+
+
+class Priority(IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class PriorityGate:
+    '''
+    Semaphore that hands free slots to the highest-priority waiter first (FIFO within a priority).
+    '''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.waiters = [] # Heap of (priority, sequence, future)
+        self.sequence = itertools.count()
+
+    async def acquire(self, priority):
+        if self.in_use < self.limit and not self.waiters:
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before we were cancelled
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # Pass the slot straight on so in_use doesn't change
+                future.set_result(None)
+                return
+        self.in_use -= 1
+
+
+class Route:
+    '''
+    One Discord rate-limit bucket, e.g. messages in a channel. Calls queued on a route run one at a
+    time in priority order, paced by a token bucket of `limit` calls every `period` seconds.
+    '''
+
+    def __init__(self, key, limit, period):
+        self.key = key
+        self.limit = limit
+        self.period = period
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.queue = [] # Heap of (priority, sequence, queued_at, call, future, attempt)
+        self.worker = None
+
+    def delay(self):
+        # Seconds until the next call on this route may start
+        now = time.monotonic()
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / self.period)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.period / self.limit
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class OutboundDispatcher:
+    '''
+    Central scheduler for everything the bot sends to Discord. Calls are grouped into per-route
+    buckets (messages, reactions, edits and deletions per channel) that are paced to Discord's
+    limits, and a shared pool of max_in_flight slots is handed out by priority so urgent reports
+    are not stuck behind help text and menu reactions. Reactions are pipelined: add_reactions()
+    queues them in order and returns straight away instead of making the flow wait on each one.
+    '''
+
+    def __init__(self, max_in_flight=8, rate_limits=None, max_retries=3):
+        # Map from route kind to (calls, per seconds)
+        self.rate_limits = rate_limits or {'message': (5, 5.0), 'reaction': (1, 0.25), 'edit': (5, 5.0), 'delete': (5, 1.0)}
+        self.max_retries = max_retries
+        self.gate = PriorityGate(max_in_flight)
+        self.routes = OrderedDict() # Map from (kind, channel ID) to Route, most recently used last
+        self.sequence = itertools.count()
+
+        # Metrics
+        self.queued = {priority: 0 for priority in Priority}
+        self.sent = {priority: 0 for priority in Priority}
+        self.failed = {priority: 0 for priority in Priority}
+        self.rate_limited = 0
+        self.waits = {priority: deque(maxlen=WAIT_SAMPLES) for priority in Priority}
+
+    def stats(self):
+        stats = {'routes': len(self.routes), 'in_flight': self.gate.in_use, 'rate_limited': self.rate_limited}
+        for priority in Priority:
+            name = priority.name.lower()
+            waits = sorted(self.waits[priority])
+            stats[f'{name}_queued'] = self.queued[priority]
+            stats[f'{name}_sent'] = self.sent[priority]
+            stats[f'{name}_failed'] = self.failed[priority]
+            stats[f'{name}_wait_p50'] = waits[len(waits) // 2] if waits else 0.0
+            stats[f'{name}_wait_p99'] = waits[int(len(waits) * 0.99)] if waits else 0.0
+            stats[f'{name}_wait_max'] = waits[-1] if waits else 0.0
+        return stats
+
+    def depth(self):
+        return sum(len(route.queue) for route in self.routes.values())
+
+    async def stop(self):
+        for route in list(self.routes.values()):
+            if route.worker is not None:
+                route.worker.cancel()
+            for entry in route.queue:
+                entry[4].cancel()
+            route.queue.clear()
+        workers = [route.worker for route in self.routes.values() if route.worker is not None]
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    # Calls --------------------------------------------------------------------
+
+    def send(self, channel, content=None, priority=Priority.NORMAL, **kwargs):
+        # channel can be anything messageable: a text channel, DM channel or user
+        channel_id = getattr(channel, 'id', None)
+        return self.submit('message', channel_id, lambda: channel.send(content, **kwargs), priority)
+
+    def edit(self, message, priority=Priority.NORMAL, **kwargs):
+        return self.submit('edit', message.channel.id, lambda: message.edit(**kwargs), priority)
+
+    def delete(self, message, priority=Priority.NORMAL):
+        return self.submit('delete', message.channel.id, message.delete, priority)
+
+    def add_reactions(self, message, emojis, priority=Priority.NORMAL):
+        '''
+        Queues the reactions in order and returns without waiting for them. Failures are logged.
+        '''
+        futures = []
+        for emoji in emojis:
+            future = self.submit('reaction', message.channel.id, lambda emoji=emoji: message.add_reaction(emoji), priority)
+            future.add_done_callback(self.log_failure)
+            futures.append(future)
+        return futures
+
+    def submit(self, kind, channel_id, call, priority=Priority.NORMAL):
+        '''
+        Queues call (a function returning a coroutine) on the (kind, channel) route. Returns a
+        future with its result.
+        '''
+        priority = Priority(priority)
+        route = self.route((kind, channel_id))
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(route.queue, (priority, next(self.sequence), time.monotonic(), call, future, 0))
+        self.queued[priority] += 1
+        if route.worker is None:
+            route.worker = asyncio.create_task(self.drain(route))
+        return future
+
+    def route(self, key):
+        route = self.routes.get(key)
+        if route is None:
+            limit, period = self.rate_limits.get(key[0], (5, 5.0))
+            route = Route(key, limit, period)
+            self.routes[key] = route
+            self.prune()
+        self.routes.move_to_end(key)
+        return route
+
+    def prune(self):
+        idle = [key for key, route in self.routes.items() if route.worker is None and not route.queue]
+        for key in idle[:max(0, len(idle) - MAX_IDLE_ROUTES)]:
+            del self.routes[key]
+
+    def log_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Outbound Discord call failed: {future.exception()}")
+
+    # Worker -------------------------------------------------------------------
+
+    async def drain(self, route):
+        try:
+            while route.queue:
+                delay = route.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                priority, sequence, queued_at, call, future, attempt = heapq.heappop(route.queue)
+                if future.done():
+                    continue
+                await self.gate.acquire(priority)
+                try:
+                    if attempt == 0:
+                        self.waits[priority].append(time.monotonic() - queued_at)
+                    route.take()
+                    with metrics.timed(f'discord_{route.key[0]}'):
+                        result = await call()
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    retry_after = getattr(e, 'retry_after', None)
+                    if getattr(e, 'status', None) == 429 and attempt < self.max_retries:
+                        # Back off the whole route and retry in the same position
+                        self.rate_limited += 1
+                        route.pause(retry_after or route.period)
+                        heapq.heappush(route.queue, (priority, sequence, queued_at, call, future, attempt + 1))
+                    else:
+                        self.failed[priority] += 1
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    self.sent[priority] += 1
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self.gate.release()
+        finally:
+            route.worker = None
@@ -0,0 +1,98 @@
+# perspectiveBenchmark.py
+# Measures messages/sec and latency percentiles of PerspectiveClient against a local stub
+# server that mimics the Perspective discovery document and analyze endpoint.
+#
+#   python perspectiveBenchmark.py --messages 2000 --latency 0.05 --max-in-flight 20
+import argparse
+import asyncio
+import random
+import time
+from aiohttp import web
+from perspectiveClient import PerspectiveClient, PerspectiveError, ATTRIBUTES
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def make_stub_app(latency, jitter):
+    async def discovery(request):
+        root = f"http://{request.host}/"
+        return web.json_response({
+            'rootUrl': root,
+            'servicePath': '',
+            'resources': {'comments': {'methods': {'analyze': {'path': 'v1alpha1/comments:analyze'}}}}
+        })
+
+    async def analyze(request):
+        body = await request.json()
+        await asyncio.sleep(max(0.0, random.gauss(latency, jitter)))
+        return web.json_response({
+            'attributeScores': {
+                attribute: {'summaryScore': {'value': random.random()}}
+                for attribute in body['requestedAttributes']
+            }
+        })
+
+    app = web.Application()
+    app.router.add_get('/$discovery/rest', discovery)
+    app.router.add_post('/v1alpha1/comments:analyze', analyze)
+    return app
+
+
+async def run(args):
+    runner = web.AppRunner(make_stub_app(args.latency, args.jitter))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', args.port)
+    await site.start()
+
+    client = PerspectiveClient(
+        'stub-key',
+        f"http://127.0.0.1:{args.port}/$discovery/rest?version=v1alpha1",
+        max_in_flight=args.max_in_flight,
+        timeout=args.timeout,
+    )
+    await client.start()
+
+    latencies = []
+    errors = 0
+
+    async def score(i):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            await client.analyze(f"benchmark message {i}", ATTRIBUTES)
+        except PerspectiveError:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(score(i) for i in range(args.messages)))
+    elapsed = time.perf_counter() - start
+
+    await client.close()
+    await runner.cleanup()
+
+    print(f"messages:      {args.messages} ({errors} errors/timeouts)")
+    print(f"max in flight: {args.max_in_flight}")
+    print(f"stub latency:  {args.latency * 1000:.1f}ms +/- {args.jitter * 1000:.1f}ms")
+    print(f"elapsed:       {elapsed:.2f}s")
+    print(f"throughput:    {args.messages / elapsed:.1f} messages/sec")
+    print(f"p50 latency:   {percentile(latencies, 50) * 1000:.1f}ms")
+    print(f"p99 latency:   {percentile(latencies, 99) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark PerspectiveClient against a local stub server.")
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--max-in-flight', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--latency', type=float, default=0.05, help="Mean stub response time in seconds")
+    parser.add_argument('--jitter', type=float, default=0.01, help="Std deviation of stub response time in seconds")
+    parser.add_argument('--port', type=int, default=8765)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,73 @@
+# perspectiveClient.py
+import asyncio
+import aiohttp
+
+ATTRIBUTES = ['TOXICITY', 'SEVERE_TOXICITY', 'IDENTITY_ATTACK']
+
+class PerspectiveError(Exception):
+    pass
+
+class PerspectiveTimeout(PerspectiveError):
+    pass
+
+class PerspectiveClient:
+    '''
+    Async client for the Perspective comment analyzer. The discovery document is fetched once
+    in start() and every request after that reuses one pooled HTTP session, so scoring a message
+    never blocks the event loop. At most max_in_flight requests run at the same time and each
+    one is abandoned after timeout seconds.
+    '''
+
+    def __init__(self, api_key, discovery_url, max_in_flight=10, timeout=5.0):
+        self.api_key = api_key
+        self.discovery_url = discovery_url
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.session = None
+        self.analyze_url = None
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def start(self):
+        if self.session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+        # Build the analyze endpoint from the discovery document once instead of on every call
+        async with self.session.get(self.discovery_url, timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+            response.raise_for_status()
+            doc = await response.json(content_type=None)
+        method = doc['resources']['comments']['methods']['analyze']
+        self.analyze_url = doc['rootUrl'] + doc.get('servicePath', '') + method.get('flatPath', method['path'])
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def analyze(self, text, attributes=ATTRIBUTES):
+        '''
+        Returns a map from each requested attribute to its summary score.
+        '''
+        if self.session is None:
+            await self.start()
+
+        analyze_request = {
+            'comment': {'text': text},
+            'requestedAttributes': {attribute: {} for attribute in attributes}
+        }
+
+        async with self.semaphore:
+            try:
+                response = await asyncio.wait_for(self._post(analyze_request), self.timeout)
+            except asyncio.TimeoutError:
+                raise PerspectiveTimeout(f"Perspective request timed out after {self.timeout}s")
+            except aiohttp.ClientError as e:
+                raise PerspectiveError(str(e)) from e
+
+        return {attribute: response['attributeScores'][attribute]['summaryScore']['value'] for attribute in attributes}
+
+    async def _post(self, body):
+        async with self.session.post(self.analyze_url, params={'key': self.api_key}, json=body) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
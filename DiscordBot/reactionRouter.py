@@ -0,0 +1,82 @@
+# reactionRouter.py
+from collections import OrderedDict
+import discord
+
+
+class ReactionRouter:
+    '''
+    Routes reactions to report sessions without asking Discord for the reacted-to message. Every
+    time a session sends a prompt its message ID is indexed (prompt message ID -> session store and
+    user ID), so on_raw_reaction_add can find the owner straight from payload.message_id and hand the
+    handler a PartialMessage. Messages that really have to be fetched go through the client's
+    message resolver and its cache.
+    '''
+
+    def __init__(self, client, max_routes=50000):
+        self.client = client
+        self.max_routes = max_routes
+        self.routes = OrderedDict() # Map from prompt message ID to (session store, user ID)
+
+        # Metrics
+        self.routed = 0
+        self.unrouted = 0
+        self.fetches = 0
+
+    def stats(self):
+        return {
+            'indexed_prompts': len(self.routes),
+            'routed': self.routed,
+            'unrouted': self.unrouted,
+            'message_fetches': self.fetches,
+        }
+
+    def register(self, sessions, user_id):
+        '''
+        Indexes the prompt the user's session is currently waiting on. Call after every transition.
+        '''
+        if user_id not in sessions.sessions:
+            return
+        message_id = sessions.sessions[user_id][1].prompt_message_id()
+        if message_id is None:
+            return
+        self.routes[message_id] = (sessions, user_id)
+        self.routes.move_to_end(message_id)
+        while len(self.routes) > self.max_routes:
+            self.routes.popitem(last=False)
+
+    def route(self, payload):
+        '''
+        Returns (session store, user ID) for a reaction on an indexed prompt by the prompt's owner.
+        '''
+        entry = self.routes.get(payload.message_id)
+        if entry is None:
+            self.unrouted += 1
+            return None
+        sessions, user_id = entry
+        if user_id != payload.user_id or user_id not in sessions:
+            # The session has ended (or someone else reacted), so this prompt leads nowhere now
+            if user_id not in sessions:
+                del self.routes[payload.message_id]
+            self.unrouted += 1
+            return None
+        self.routed += 1
+        return entry
+
+    def partial_message(self, channel_id, message_id):
+        # A PartialMessage has the channel and ID the handlers need without a REST call
+        channel = self.client.get_channel(channel_id) or self.client.get_partial_messageable(channel_id)
+        return channel.get_partial_message(message_id)
+
+    async def fetch_message(self, channel_id, message_id):
+        '''
+        Fetches a full message (e.g. to check its author) through the shared message resolver.
+        Returns None if it can't be read.
+        '''
+        self.fetches += 1
+        try:
+            return await self.client.message_resolver.fetch(channel_id, message_id)
+        except (discord.NotFound, discord.Forbidden):
+            return None
+
+    def forget_message(self, message_id):
+        self.routes.pop(message_id, None)
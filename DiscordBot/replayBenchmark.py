@@ -0,0 +1,390 @@
+# replayBenchmark.py
+# Replays a recorded stream of monitored-channel messages through ModBot's real auto-flagging path
+# (handle_channel_message -> scoring queue -> detection cascade -> handle_verdict -> mod queue ->
+# outbound dispatcher) without connecting to anything. Discord, Firestore, Perspective and OpenAI
+# are replaced by stand-ins that answer after a configurable latency. Reports messages/sec,
+# end-to-end latency percentiles (from a message arriving to its verdict being handled, including
+# the mod-channel post) and API calls per 1k messages, so regressions show up before deploy.
+#
+# Each line of the stream is a JSON object such as
+#   {"content": "some message", "author_id": 7, "author": "name", "t": 0.25}
+# where t (seconds since the first message) is only used with --speed. Recorded Perspective scores
+# ("scores": {"TOXICITY": 0.1, ...}) and an LLM "subcategory" are replayed when present; otherwise
+# they are derived from a hash of the content. Without a stream file, --synthetic messages are
+# generated instead.
+#
+#   python replayBenchmark.py messages.jsonl --perspective-latency 0.08 --openai-latency 0.6
+#   python replayBenchmark.py --synthetic 5000 --speed 0
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import config
+from bot import ModBot
+from classifier import Classifier
+from outboundDispatcher import OutboundDispatcher
+from perspectiveClient import ATTRIBUTES
+from scoreCache import ScoreCache
+
+GUILD_ID = 1
+MONITORED_CHANNEL_ID = 10
+MOD_CHANNEL_ID = 11
+GROUP_NUM = 0
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class Latency:
+    def __init__(self, mean, jitter):
+        self.mean = mean
+        self.jitter = jitter
+
+    def sample(self):
+        return max(0.0, self.mean * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def wait(self):
+        await asyncio.sleep(self.sample())
+
+
+# Discord ----------------------------------------------------------------------
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.text_channels = []
+
+
+class FakeUser:
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.name = name
+
+
+class FakeChannel:
+    def __init__(self, channel_id, name, guild, latency, calls):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.latency = latency
+        self.calls = calls
+        self.next_id = channel_id * 1_000_000
+
+    async def send(self, content=None, **kwargs):
+        self.calls['discord'] += 1
+        await self.latency.wait()
+        self.next_id += 1
+        return FakeMessage(self.next_id, self, content, FakeUser(0, "Group 0 Bot"))
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel, content, author, recorded=None):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.author = author
+        self.jump_url = f"https://discord.com/channels/{channel.guild.id}/{channel.id}/{message_id}"
+        self.recorded = recorded or {}
+
+    async def edit(self, **kwargs):
+        self.channel.calls['discord'] += 1
+        await self.channel.latency.wait()
+
+    async def add_reaction(self, emoji):
+        self.channel.calls['discord'] += 1
+        await self.channel.latency.wait()
+
+    async def delete(self):
+        self.channel.calls['discord'] += 1
+        await self.channel.latency.wait()
+
+
+# Firestore --------------------------------------------------------------------
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self.exists = data is not None
+        self.data = data
+        self.update_time = 0
+
+    def to_dict(self):
+        return dict(self.data or {})
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+
+    def get(self):
+        # Called through asyncio.to_thread, like the real client
+        self.db.calls['firestore'] += 1
+        time.sleep(self.db.latency.sample())
+        return FakeSnapshot(self.db.documents.get(self.path))
+
+    def set(self, data, merge=False):
+        self.db.calls['firestore'] += 1
+        time.sleep(self.db.latency.sample())
+        self.db.documents[self.path] = data
+        self.db.notify(self.path)
+        return FakeSnapshot(data)
+
+    def on_snapshot(self, callback):
+        if not self.db.realtime:
+            raise ListenerUnavailable("snapshot listeners are turned off for this run")
+        watch = FakeWatch(self.db, self.path, callback)
+        self.db.watches.append(watch)
+        # Like the real client, the current document is delivered first
+        self.db.notify(self.path)
+        return watch
+
+
+class ListenerUnavailable(Exception):
+    # Stands in for the error the real client raises when it can't open a listen stream
+    pass
+
+
+class FakeWatch:
+    def __init__(self, db, path, callback):
+        self.db = db
+        self.path = path
+        self.callback = callback
+
+    def unsubscribe(self):
+        if self in self.db.watches:
+            self.db.watches.remove(self)
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def document(self, document_id):
+        return FakeDocument(self.db, (self.name, document_id))
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+
+    def set(self, ref, data, merge=False):
+        pass
+
+    def commit(self):
+        self.db.calls['firestore'] += 1
+        time.sleep(self.db.latency.sample())
+
+
+class FakeFirestore:
+    '''
+    In-memory Firestore. With realtime=False snapshot listeners can't be opened, so the keyword
+    store falls back to polling as it does when the real listen stream is unavailable.
+    '''
+
+    def __init__(self, latency, calls, keywords, realtime=True):
+        self.latency = latency
+        self.calls = calls
+        self.realtime = realtime
+        self.documents = {('config', 'keywords'): {'keywords_list': keywords}}
+        self.watches = []
+
+    def notify(self, path):
+        # The real client calls listeners from its own thread
+        snapshot = FakeSnapshot(self.documents.get(path))
+        for watch in self.watches:
+            if watch.path == path:
+                threading.Thread(target=watch.callback, args=([snapshot], [], None), daemon=True).start()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+# Perspective and OpenAI -------------------------------------------------------
+
+def hashed_scores(text):
+    # Skewed towards benign like real traffic, and stable for repeated content
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    toxicity = (digest[0] / 255) ** 3
+    return {
+        'TOXICITY': toxicity,
+        'SEVERE_TOXICITY': toxicity * digest[1] / 255,
+        'IDENTITY_ATTACK': (digest[2] / 255) ** 12,
+    }
+
+
+class FakePerspective:
+    def __init__(self, latency, calls, recorded):
+        self.latency = latency
+        self.calls = calls
+        self.recorded = recorded # Map from content to recorded scores
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def analyze(self, text, attributes=ATTRIBUTES):
+        self.calls['perspective'] += 1
+        await self.latency.wait()
+        scores = self.recorded.get(text) or hashed_scores(text)
+        return {attribute: scores[attribute] for attribute in attributes}
+
+
+class FakeOpenAI:
+    def __init__(self, latency, calls, recorded):
+        self.latency = latency
+        self.calls = calls
+        self.recorded = recorded # Map from content to recorded subcategory
+
+    async def detect_subcategory_async(self, text):
+        self.calls['openai'] += 1
+        await self.latency.wait()
+        if text in self.recorded:
+            return self.recorded[text]
+        return random.Random(text).choice(['racism', 'sexism', 'homophobia', 'transphobia', 'xenophobia', 'other'])
+
+
+# Replay -----------------------------------------------------------------------
+
+class ReplayBot(ModBot):
+    '''
+    ModBot that records when each replayed message's verdict has been fully handled.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.arrived = {} # Map from message ID to the time it was handed to handle_channel_message
+        self.verdict_latencies = []
+        self.flagged_messages = 0
+        self.all_done = asyncio.Event()
+        self.expected = None
+
+    async def handle_verdict(self, message, result):
+        await super().handle_verdict(message, result)
+        if result.flagged:
+            self.flagged_messages += 1
+        self.verdict_latencies.append(time.perf_counter() - self.arrived.pop(message.id))
+        if self.expected is not None and len(self.verdict_latencies) >= self.expected:
+            self.all_done.set()
+
+
+def load_stream(args):
+    if args.stream:
+        with open(args.stream) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    rng = random.Random(args.seed)
+    words = ["hello", "anyone", "up", "for", "a", "game", "tonight", "that", "was", "great", "see", "you", "later"]
+    records = []
+    for i in range(args.synthetic):
+        content = " ".join(rng.choices(words, k=rng.randint(3, 20)))
+        if rng.random() < 0.02:
+            content += " idiot"
+        records.append({'content': content, 'author_id': rng.randrange(500), 't': i / 200})
+    return records
+
+
+async def replay(args):
+    # The session database and score cache live here for the run only
+    with tempfile.TemporaryDirectory(prefix='replay-') as directory:
+        await replay_in(args, directory)
+
+
+async def replay_in(args, directory):
+    records = load_stream(args)
+    calls = {'discord': 0, 'firestore': 0, 'perspective': 0, 'openai': 0}
+    recorded_scores = {record['content']: record['scores'] for record in records if 'scores' in record}
+    recorded_subcategories = {record['content']: record['subcategory'] for record in records if 'subcategory' in record}
+    # Keep the benchmark's sessions out of the real session database
+    config.SESSION_DB_PATH = os.path.join(directory, 'sessions.sqlite3')
+
+    classifier = Classifier(
+        {},
+        perspective=FakePerspective(Latency(args.perspective_latency, args.jitter), calls, recorded_scores),
+        open_ai_functions=FakeOpenAI(Latency(args.openai_latency, args.jitter), calls, recorded_subcategories),
+        score_cache=ScoreCache(os.path.join(directory, 'scores.sqlite3'), max_entries=config.SCORE_CACHE_MAX_ENTRIES),
+    )
+    db = FakeFirestore(Latency(args.firestore_latency, args.jitter), calls, args.keywords, realtime=not args.poll_keywords)
+    client = ReplayBot({}, shard_count=1, db=db, classifier=classifier)
+    if args.no_rate_limits:
+        unlimited = (1_000_000, 1.0)
+        client.outbound = OutboundDispatcher(config.OUTBOUND_MAX_IN_FLIGHT, {kind: unlimited for kind in config.OUTBOUND_RATE_LIMITS})
+
+    discord_latency = Latency(args.discord_latency, args.jitter)
+    guild = FakeGuild(GUILD_ID)
+    monitored = FakeChannel(MONITORED_CHANNEL_ID, f'group-{GROUP_NUM}', guild, discord_latency, calls)
+    mod_channel = FakeChannel(MOD_CHANNEL_ID, f'group-{GROUP_NUM}-mod', guild, discord_latency, calls)
+    guild.text_channels = [monitored, mod_channel]
+    client.channels.set_group(GROUP_NUM)
+    client.channels.add_guild(guild)
+    await client.start_services()
+
+    messages = [
+        FakeMessage(i + 1, monitored, record['content'], FakeUser(record.get('author_id', 0), record.get('author', 'user')), record)
+        for i, record in enumerate(records)
+    ]
+    client.expected = len(messages)
+    start = time.perf_counter()
+    for message in messages:
+        if args.speed > 0:
+            delay = start + message.recorded.get('t', 0) / args.speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        client.arrived[message.id] = time.perf_counter()
+        await client.handle_channel_message(message)
+    ingested = time.perf_counter() - start
+    try:
+        await asyncio.wait_for(client.all_done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    # Subcategories and embed edits still in flight count towards API calls
+    await asyncio.sleep(args.settle)
+    await client.stop_services()
+
+    handled = len(client.verdict_latencies)
+    print(f"replayed {len(messages)} messages ({handled} handled, {len(messages) - handled} unfinished), {client.flagged_messages} flagged")
+    print(f"ingest: {len(messages) / ingested:,.0f} messages/s   end to end: {handled / elapsed:,.1f} messages/s over {elapsed:.2f}s")
+    latencies = client.verdict_latencies
+    print(
+        f"latency p50: {percentile(latencies, 50) * 1000:.1f}ms  p95: {percentile(latencies, 95) * 1000:.1f}ms  "
+        f"p99: {percentile(latencies, 99) * 1000:.1f}ms  max: {max(latencies, default=0) * 1000:.1f}ms"
+    )
+    per_1k = 1000 / max(len(messages), 1)
+    print("API calls per 1k messages: " + ", ".join(f"{name} {count * per_1k:.1f}" for name, count in calls.items()))
+    for name, stage in classifier.stats()['stages'].items():
+        print(f"  {name}: runs {stage['runs']}  accepts {stage['accepts']}  rejects {stage['rejects']}  timeouts {stage['timeouts']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay recorded messages through the auto-flagging path.")
+    parser.add_argument('stream', nargs='?', help="JSONL file of recorded messages")
+    parser.add_argument('--synthetic', type=int, default=2000, help="Messages to generate when no stream is given")
+    parser.add_argument('--speed', type=float, default=0.0, help="Replay at this multiple of the recorded pace; 0 sends as fast as possible")
+    parser.add_argument('--perspective-latency', type=float, default=0.08, help="Seconds per Perspective call")
+    parser.add_argument('--openai-latency', type=float, default=0.6, help="Seconds per OpenAI call")
+    parser.add_argument('--discord-latency', type=float, default=0.05, help="Seconds per Discord REST call")
+    parser.add_argument('--firestore-latency', type=float, default=0.03, help="Seconds per Firestore call")
+    parser.add_argument('--jitter', type=float, default=0.3, help="Latencies vary by up to this fraction either way")
+    parser.add_argument('--keywords', nargs='*', default=["idiot"], help="Manual keyword list")
+    parser.add_argument('--no-rate-limits', action='store_true', help="Don't pace calls to the mod channel")
+    parser.add_argument('--poll-keywords', action='store_true', help="Make keyword snapshot listeners unavailable so the keyword store polls")
+    parser.add_argument('--timeout', type=float, default=120.0, help="Seconds to wait for outstanding verdicts")
+    parser.add_argument('--settle', type=float, default=1.0, help="Seconds to let background calls finish before counting")
+    parser.add_argument('--seed', type=int, default=152)
+    asyncio.run(replay(parser.parse_args()))
@@ -1,6 +1,10 @@
 from enum import Enum, auto
 import discord
-import re
+import metrics
+from tracing import TRACER, trace_id_for
+from sessionPersistence import message_ref, fetch_message_ref, fetch_user
+from outboundDispatcher import Priority
+from messageResolver import InvalidLink, UnknownGuild, UnknownChannel
 
 class State(Enum):
     REPORT_START = auto()
@@ -21,10 +25,166 @@ class PriorityLevel(Enum):
     MEDIUM = "Medium"
     HIGH = "High"
 
+# Urgent reports (immediate danger, CSAM, self harm) are sent to Discord ahead of everything else
+OUTBOUND_PRIORITIES = {
+    PriorityLevel.LOW: Priority.NORMAL,
+    PriorityLevel.MEDIUM: Priority.NORMAL,
+    PriorityLevel.HIGH: Priority.HIGH,
+}
+
+class Option:
+    '''
+    One choice in a reporting menu: the emoji that picks it, the label shown next to it, the state
+    it leads to and what it records on the report. Options with a reply send that text instead of
+    the next state's menu.
+    '''
+
+    def __init__(self, emoji, label, next_state, final_state=None, priority=None, reply=None):
+        self.emoji = emoji
+        self.label = label
+        self.next_state = next_state
+        self.final_state = final_state
+        self.priority = priority
+        self.reply = reply
+
+class Menu:
+    '''
+    The prompt sent when a report enters a state, and the options users can react with. The prompt
+    text, reactions and error replies are built once when the module is loaded.
+    '''
+
+    def __init__(self, header, message_attr, options, wrong_message):
+        self.message_attr = message_attr # Report attribute holding the ID of the sent prompt
+        self.options = options
+        self.wrong_message = wrong_message
+        self.template = header + "".join(f"\n{option.emoji} - {option.label}" for option in options if option.label)
+        self.reactions = [option.emoji for option in options]
+        emojis = self.reactions
+        choices = emojis[0] if len(emojis) == 1 else ", ".join(emojis[:-1]) + " or " + emojis[-1]
+        self.unknown_emoji = f"Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either {choices}"
+
+REACT_TO_OPTIONS = "Please react to the message that contains emoji options to choose from."
+REACT_TO_CONFIRMATION = "Please respond by reacting directly to the block confirmation message above with the appropriate emoji."
+
+def block_user(label, priority=None, final_state=None):
+    # Most categories end by asking whether to block the reported user
+    return Option(None, label, State.BLOCK_USER, final_state or label, priority)
+
+def numbered(*options):
+    return [
+        Option(emoji, option.label, option.next_state, option.final_state, option.priority, option.reply)
+        for emoji, option in zip(['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣'], options)
+    ]
+
+# Prompts keyed by the state they are sent in. Adding a category only means adding an option here.
+MENUS = {
+    State.MESSAGE_IDENTIFIED: Menu(
+        "I found this message:\n"
+        "```{message.author.name}: {message.content}```\n"
+        "Please react with the corresponding number for the reason of your report:",
+        'abuse_category_message_id',
+        numbered(
+            Option(None, "Harassment", State.HARASSMENT_CHOSEN),
+            Option(None, "Offensive Content", State.OFFENSIVE_CONTENT_CHOSEN),
+            Option(None, "Urgent Violence", State.URGENT_VIOLENCE_CHOSEN),
+            Option(None, "Others/I don't like this", State.OTHERS_CHOSEN,
+                   reply="We're here to help. Can you describe the issue in more detail?"),
+        ),
+        REACT_TO_OPTIONS,
+    ),
+    State.HARASSMENT_CHOSEN: Menu(
+        "Please react with the corresponding number for which type of harassment you're reporting:",
+        'harassment_type_message_id',
+        numbered(
+            block_user("Trolling"),
+            block_user("Impersonation"),
+            block_user("Directed Hate Speech", PriorityLevel.MEDIUM),
+            block_user("Doxing"),
+            block_user("Unwanted Sexual Content", PriorityLevel.HIGH),
+        ),
+        REACT_TO_OPTIONS,
+    ),
+    State.OFFENSIVE_CONTENT_CHOSEN: Menu(
+        "Please react with the corresponding number for which type of offensive content you're reporting:",
+        'offensive_content_type_message_id',
+        numbered(
+            block_user("Protected Characteristics (race, color, religion etc.)", PriorityLevel.MEDIUM, "Protected Characteristics"),
+            block_user("Sexually Graphic Content", PriorityLevel.MEDIUM),
+            block_user("Child Sexual Abuse Material", PriorityLevel.HIGH),
+            block_user("Drug Use"),
+            Option(None, "Inciting/Glorifying Violence", State.INCITING_VIOLENCE_CHOSEN),
+        ),
+        REACT_TO_OPTIONS,
+    ),
+    State.INCITING_VIOLENCE_CHOSEN: Menu(
+        "Please react with the corresponding number for which type of violence you're reporting:",
+        'inciting_violence_message_id',
+        numbered(
+            block_user("Dangerous Acts", PriorityLevel.MEDIUM, "Inciting/Glorifying Dangerous Acts"),
+            block_user("Terrorism", PriorityLevel.MEDIUM, "Inciting/Glorifying Terrorism"),
+            block_user("Animal Abuse", PriorityLevel.MEDIUM, "Inciting/Glorifying Animal Abuse"),
+            block_user("Depiction of Physical Violence", final_state="Inciting/Glorifying Physical Violence"),
+            block_user("Other", final_state="Inciting/Glorifying Violence"),
+        ),
+        REACT_TO_OPTIONS,
+    ),
+    State.URGENT_VIOLENCE_CHOSEN: Menu(
+        "Are you in immediate danger?\n"
+        "If so, please react to this message with 👍.\n"
+        "Otherwise, react to this message with 👎.",
+        'immediate_danger_message_id',
+        [
+            Option('👍', None, State.REPORT_COMPLETE, "Immediate Danger", PriorityLevel.HIGH,
+                   reply="Please call 911. We will address this report with the highest priority."),
+            Option('👎', None, State.NOT_IMMEDIATE_DANGER),
+        ],
+        REACT_TO_CONFIRMATION,
+    ),
+    State.NOT_IMMEDIATE_DANGER: Menu(
+        "What category of violence would you classify this as:",
+        'urgent_violence_category_message_id',
+        numbered(
+            Option(None, "Self Harm", State.REPORT_COMPLETE, "Self Harm", PriorityLevel.HIGH,
+                   reply="Thank you for reporting. We will contact local authorities"),
+            block_user("Directed Threat", PriorityLevel.HIGH),
+        ),
+        REACT_TO_CONFIRMATION,
+    ),
+    State.BLOCK_USER: Menu(
+        "Thank you for your report. Would you like to block this user?\n"
+        "If so, please react to this message with 👍.\n"
+        "Otherwise, react to this message with 👎.",
+        'block_user_message_id',
+        [
+            Option('👍', None, State.REPORT_COMPLETE,
+                   reply="You have chosen to block the user, and we have processed your request. We appreciate your help in maintaining a safe community environment."),
+            Option('👎', None, State.REPORT_COMPLETE,
+                   reply="You have chosen not to block the user. We appreciate your help in maintaining a safe community environment."),
+        ],
+        REACT_TO_CONFIRMATION,
+    ),
+}
+
+# Precomputed (state, emoji) -> option table used to dispatch every reaction
+TRANSITIONS = {
+    (state, option.emoji): option
+    for state, menu in MENUS.items()
+    for option in menu.options
+}
+
+# Sending an explanation for "Others" leads to the block prompt like every other category
+OTHERS_EXPLAINED = block_user("Others/I don't like this")
+
 class Report:
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
     HELP_KEYWORD = "help"
+    # Plain attributes saved by to_state() so the report survives a restart
+    PERSISTED_FIELDS = [
+        'abuse_category_message_id', 'block_user_message_id', 'harassment_type_message_id',
+        'offensive_content_type_message_id', 'inciting_violence_message_id', 'immediate_danger_message_id',
+        'urgent_violence_category_message_id', 'other_explanation', 'final_state', 'trace_id',
+    ]
 
     def __init__(self, client, reporter):
         self.reporter = reporter
@@ -41,7 +201,7 @@ class Report:
         self.priority_level = PriorityLevel.LOW
         self.other_explanation = None
         self.final_state = None
-        self.reactions = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣']
+        self.trace_id = None # Trace of the reported message, once it has been found
     
     async def handle_message(self, message):
         '''
@@ -52,7 +212,7 @@ class Report:
 
         if message.content == self.CANCEL_KEYWORD:
             self.state = State.REPORT_CANCELLED
-            await message.channel.send("Report cancelled.")
+            await self.send(message.channel, "Report cancelled.")
             return
         
         if self.state == State.REPORT_START:
@@ -61,401 +221,76 @@ class Report:
             reply += "Please copy paste the link to the message you want to report.\n"
             reply += "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
             self.state = State.AWAITING_MESSAGE
-            await message.channel.send(reply)
+            await self.send(message.channel, reply)
             return
         
         if self.state == State.AWAITING_MESSAGE:
-            # Parse out the three ID strings from the message link
-            m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
-            if not m:
-                await message.channel.send("I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel.")
+            # Fetch the message the link points to; repeat lookups are served from the shared cache
+            try:
+                with metrics.timed('link_resolve'):
+                    self.message = await self.client.message_resolver.resolve(message.content)
+            except InvalidLink:
+                await self.send(message.channel, "I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel.")
                 return
-            guild = self.client.get_guild(int(m.group(1)))
-            if not guild:
-                await message.channel.send("I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again.")
+            except UnknownGuild:
+                await self.send(message.channel, "I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again.")
                 return
-            channel = guild.get_channel(int(m.group(2)))
-            if not channel:
-                await message.channel.send("It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel.")
+            except UnknownChannel:
+                await self.send(message.channel, "It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel.")
                 return
-            try:
-                self.message = await channel.fetch_message(int(m.group(3)))
             except discord.errors.NotFound:
-                await message.channel.send("It seems this message was deleted or never existed. Please try again or say `cancel` to cancel.")
+                await self.send(message.channel, "It seems this message was deleted or never existed. Please try again or say `cancel` to cancel.")
                 return
 
             # Here we've found the message - it's up to you to decide what to do next!
+            self.trace_id = trace_id_for(self.message.id)
+            TRACER.event(self.trace_id, 'user_report_started', reporter_id=self.reporter.id)
             self.state = State.MESSAGE_IDENTIFIED
-            sent_message = await message.channel.send(
-                f"I found this message:\n"
-                f"```{self.message.author.name}: {self.message.content}```\n"
-                "Please react with the corresponding number for the reason of your report:\n"
-                "1️⃣ - Harassment\n"
-                "2️⃣ - Offensive Content\n"
-                "3️⃣ - Urgent Violence\n"
-                "4️⃣ - Others/I don't like this")
-            self.abuse_category_message_id = sent_message.id
-            for reaction in self.reactions[:4]:
-                await sent_message.add_reaction(reaction)
-
+            await self.prompt(message.channel)
             return
         
         if self.state == State.OTHERS_CHOSEN:
             # TODO: Save this message somehow
             self.other_explanation = message.content
-            self.final_state = "Others/I don't like this"
-
-            self.state = State.BLOCK_USER
-            sent_message = await message.channel.send(
-                "Thank you for your report. Would you like to block this user?\n"
-                "If so, please react to this message with 👍.\n"
-                "Otherwise, react to this message with 👎."
-            )
-            self.block_user_message_id = sent_message.id
-
-            for reaction in ['👍', '👎']:
-                await sent_message.add_reaction(reaction)
+            await self.choose(OTHERS_EXPLAINED, message.channel)
             return
         
         return
     
     async def handle_reaction(self, payload, message):
-        if self.state == State.MESSAGE_IDENTIFIED:
-            if payload.message_id != self.abuse_category_message_id:
-                await message.channel.send("Please react to the message that contains emoji options to choose from.")
-                return
-            
-            if str(payload.emoji) == '1️⃣':
-                self.state = State.HARASSMENT_CHOSEN
-                sent_message = await message.channel.send(
-                    "Please react with the corresponding number for which type of harassment you're reporting:\n"
-                    "1️⃣ - Trolling\n"
-                    "2️⃣ - Impersonation\n"
-                    "3️⃣ - Directed Hate Speech\n"
-                    "4️⃣ - Doxing\n"
-                    "5️⃣ - Unwanted Sexual Content\n")
-                self.harassment_type_message_id = sent_message.id
-                for reaction in self.reactions:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '2️⃣':
-                self.state = State.OFFENSIVE_CONTENT_CHOSEN
-                sent_message = await message.channel.send(
-                    "Please react with the corresponding number for which type of offensive content you're reporting:\n"
-                    "1️⃣ - Protected Characteristics (race, color, religion etc.)\n"
-                    "2️⃣ - Sexually Graphic Content\n"
-                    "3️⃣ - Child Sexual Abuse Material\n"
-                    "4️⃣ - Drug Use\n"
-                    "5️⃣ - Inciting/Glorifying  Violence\n")
-                self.offensive_content_type_message_id = sent_message.id
-                for reaction in self.reactions:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '3️⃣':
-                self.state = State.URGENT_VIOLENCE_CHOSEN
-                sent_message = await message.channel.send(
-                    "Are you in immediate danger?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.immediate_danger_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '4️⃣':
-                self.state = State.OTHERS_CHOSEN
-                await message.channel.send("We're here to help. Can you describe the issue in more detail?")
-                return
-            
-            await message.channel.send("Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either 1️⃣, 2️⃣, 3️⃣, or 4️⃣")
+        # Look up what this reaction does in the transition table instead of walking every state
+        menu = MENUS.get(self.state)
+        if menu is None:
             return
-        
-        if self.state == State.HARASSMENT_CHOSEN:
-            if payload.message_id != self.harassment_type_message_id:
-                await message.channel.send("Please react to the message that contains emoji options to choose from.")
-                return
-            
-            if str(payload.emoji) == '1️⃣': # Trolling
-                self.state = State.BLOCK_USER
-                self.final_state = "Trolling"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '2️⃣': # Impersonation
-                self.state = State.BLOCK_USER
-                self.final_state = "Impersonation"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '3️⃣': # Directed Hate Speech
-                self.state = State.BLOCK_USER
-                self.priority_level = PriorityLevel.MEDIUM
-                self.final_state = "Directed Hate Speech"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '4️⃣': # Doxing
-                self.state = State.BLOCK_USER
-                self.final_state = "Doxing"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '5️⃣': # Unwanted Sexual Content
-                self.state = State.BLOCK_USER
-                self.priority_level = PriorityLevel.HIGH
-                self.final_state = "Unwanted Sexual Content"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            
-            await message.channel.send("Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either 1️⃣, 2️⃣, 3️⃣, 4️⃣ or 5️⃣")
+        if payload.message_id != getattr(self, menu.message_attr):
+            await self.send(message.channel, menu.wrong_message)
             return
-        
-        if self.state == State.OFFENSIVE_CONTENT_CHOSEN:
-            if payload.message_id != self.offensive_content_type_message_id:
-                await message.channel.send("Please react to the message that contains emoji options to choose from.")
-                return
-            
-            if str(payload.emoji) == '1️⃣': # Protected Characteristics
-                self.state = State.BLOCK_USER
-                self.priority_level = PriorityLevel.MEDIUM
-                self.final_state = "Protected Characteristics"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '2️⃣': # Sexually Graphic Content
-                self.state = State.BLOCK_USER
-                self.priority_level = PriorityLevel.MEDIUM
-                self.final_state = "Sexually Graphic Content"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '3️⃣': # Child Sexual Abuse Material
-                self.state = State.BLOCK_USER
-                self.priority_level = PriorityLevel.HIGH
-                self.final_state = "Child Sexual Abuse Material"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '4️⃣': # Drug Use
-                self.state = State.BLOCK_USER
-                self.final_state = "Drug Use"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '5️⃣': # Inciting/Glorifying Violence
-                self.state = State.INCITING_VIOLENCE_CHOSEN
-                sent_message = await message.channel.send(
-                    "Please react with the corresponding number for which type of violence you're reporting:\n"
-                    "1️⃣ - Dangerous Acts\n"
-                    "2️⃣ - Terrorism\n"
-                    "3️⃣ - Animal Abuse\n"
-                    "4️⃣ - Depiction of Physical Violence\n"
-                    "5️⃣ - Other\n"
-                )
-                self.inciting_violence_message_id = sent_message.id
-                for reaction in self.reactions:
-                    await sent_message.add_reaction(reaction)
-                return
-            
-            await message.channel.send("Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either 1️⃣, 2️⃣, 3️⃣, 4️⃣ or 5️⃣")
-            return
-        
-        if self.state == State.INCITING_VIOLENCE_CHOSEN:
-            if payload.message_id != self.inciting_violence_message_id:
-                await message.channel.send("Please react to the message that contains emoji options to choose from.")
-                return
-            
-            if str(payload.emoji) == '1️⃣': # Dangerous Acts
-                self.state = State.BLOCK_USER
-                self.priority_level = PriorityLevel.MEDIUM
-                self.final_state = "Inciting/Glorifying Dangerous Acts"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '2️⃣': # Terrorism
-                self.state = State.BLOCK_USER
-                self.priority_level = PriorityLevel.MEDIUM
-                self.final_state = "Inciting/Glorifying Terrorism"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '3️⃣': # Animal Abuse
-                self.state = State.BLOCK_USER
-                self.priority_level = PriorityLevel.MEDIUM
-                self.final_state = "Inciting/Glorifying Animal Abuse"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '4️⃣': # Depiction of Physical Violence
-                self.state = State.BLOCK_USER
-                self.final_state = "Inciting/Glorifying Physical Violence"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            elif str(payload.emoji) == '5️⃣': # Other
-                self.state = State.BLOCK_USER
-                self.final_state = "Inciting/Glorifying Violence"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            
-            await message.channel.send("Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either 1️⃣, 2️⃣, 3️⃣, 4️⃣ or 5️⃣")
-            return
-        
-        if self.state == State.URGENT_VIOLENCE_CHOSEN:
-            if payload.message_id != self.immediate_danger_message_id:
-                await message.channel.send("Please respond by reacting directly to the block confirmation message above with the appropriate emoji.")
-                return
-            
-            if str(payload.emoji) == '👍':
-                self.state = State.REPORT_COMPLETE
-                self.priority_level = PriorityLevel.HIGH
-                self.final_state = "Immediate Danger"
-                await message.channel.send("Please call 911. We will address this report with the highest priority.")
-                return
-            elif str(payload.emoji) == '👎':
-                self.state = State.NOT_IMMEDIATE_DANGER
-                sent_message = await message.channel.send(
-                    "What category of violence would you classify this as:\n"
-                    "1️⃣ - Self Harm\n"
-                    "2️⃣ - Directed Threat\n")
-                self.urgent_violence_category_message_id = sent_message.id
-                return
-            
-            await message.channel.send("Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either 👍 or 👎")
-            return
-        
-        if self.state == State.NOT_IMMEDIATE_DANGER:
-            if payload.message_id != self.urgent_violence_category_message_id:
-                await message.channel.send("Please respond by reacting directly to the block confirmation message above with the appropriate emoji.")
-                return
-            
-            if str(payload.emoji) == '1️⃣':
-                self.state = State.REPORT_COMPLETE
-                self.priority_level = PriorityLevel.HIGH
-                self.final_state = "Self Harm"
-                await message.channel.send("Thank you for reporting. We will contact local authorities")
-                return
-            elif str(payload.emoji) == '2️⃣':
-                self.state = State.BLOCK_USER
-                self.priority_level = PriorityLevel.HIGH
-                self.final_state = "Directed Threat"
-                sent_message = await message.channel.send(
-                    "Thank you for your report. Would you like to block this user?\n"
-                    "If so, please react to this message with 👍.\n"
-                    "Otherwise, react to this message with 👎."
-                )
-                self.block_user_message_id = sent_message.id
-                for reaction in ['👍', '👎']:
-                    await sent_message.add_reaction(reaction)
-                return
-            
-            await message.channel.send("Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either 1️⃣ or 2️⃣")
+        option = TRANSITIONS.get((self.state, str(payload.emoji)))
+        if option is None:
+            await self.send(message.channel, menu.unknown_emoji)
             return
+        await self.choose(option, message.channel)
 
-        if self.state == State.BLOCK_USER:
-            if payload.message_id != self.block_user_message_id:
-                await message.channel.send("Please respond by reacting directly to the block confirmation message above with the appropriate emoji.")
-                return
-            
-            if str(payload.emoji) == '👍':
-                self.state = State.REPORT_COMPLETE
-                await message.channel.send("You have chosen to block the user, and we have processed your request. We appreciate your help in maintaining a safe community environment.")
-                return
-            elif str(payload.emoji) == '👎':
-                self.state = State.REPORT_COMPLETE
-                await message.channel.send("You have chosen not to block the user. We appreciate your help in maintaining a safe community environment.")
-                return
-            
-            await message.channel.send("Sorry, I don't understand what you mean by this emoji. Please react to the previous message with either 👍 or 👎")
-            return
-        
-        return
+    async def choose(self, option, channel):
+        self.state = option.next_state
+        if option.final_state is not None:
+            self.final_state = option.final_state
+        if option.priority is not None:
+            self.priority_level = option.priority
+        if option.reply is not None:
+            await self.send(channel, option.reply)
+        else:
+            await self.prompt(channel)
+
+    async def prompt(self, channel):
+        '''
+        Sends the menu for the current state and remembers which message it was so only reactions
+        to that message are accepted.
+        '''
+        menu = MENUS[self.state]
+        sent_message = await self.send(channel, menu.template.format(message=self.message))
+        setattr(self, menu.message_attr, sent_message.id)
+        self.client.outbound.add_reactions(sent_message, menu.reactions, self.outbound_priority())
     
     async def send_report_to_mod_channel(self, mod_channel):
         if self.state != State.REPORT_COMPLETE:
@@ -480,8 +315,38 @@ class Report:
         if self.other_explanation:
             embed.add_field(name="User explanation", value=self.other_explanation, inline=False)
 
-        await mod_channel.send(embed=embed)
+        # Reports of a message that is already in the mod channel are merged into its embed
+        with metrics.timed('mod_channel_send'), TRACER.span(self.trace_id, 'mod_channel_post', source='user_report', category=self.final_state, priority=self.priority_level.value):
+            await self.client.shard_state(self.message.guild.id).mod_queue.post(self.message, mod_channel, embed, self.priority_level, self.reporter.id, self.final_state)
+
+
+    def prompt_message_id(self):
+        # The menu this report is waiting for a reaction on, if any
+        menu = MENUS.get(self.state)
+        return getattr(self, menu.message_attr) if menu else None
+
+    def outbound_priority(self):
+        return OUTBOUND_PRIORITIES[self.priority_level]
+
+    async def send(self, channel, content):
+        return await self.client.outbound.send(channel, content, priority=self.outbound_priority())
+
+    def to_state(self):
+        state = {field: getattr(self, field) for field in self.PERSISTED_FIELDS}
+        state['state'] = self.state.name
+        state['priority'] = self.priority_level.value
+        state['message'] = message_ref(self.message)
+        return state
 
+    @classmethod
+    async def restore(cls, client, reporter_id, state):
+        report = cls(client, await fetch_user(client, reporter_id))
+        for field in cls.PERSISTED_FIELDS:
+            setattr(report, field, state.get(field))
+        report.state = State[state['state']]
+        report.priority_level = PriorityLevel(state['priority'])
+        report.message = await fetch_message_ref(client, state['message'])
+        return report
 
     def report_complete(self):
         return self.state == State.REPORT_COMPLETE
@@ -0,0 +1,119 @@
+# reportBenchmark.py
+# Measures how long Report.handle_reaction takes per transition. Every path through the reporting
+# menus is generated from the transition table and replayed against a fake DM channel, so the
+# numbers cover dispatch, prompt building and queueing on the outbound dispatcher, not Discord
+# round-trips.
+#
+#   python reportBenchmark.py --rounds 2000
+import argparse
+import asyncio
+import statistics
+import time
+from outboundDispatcher import OutboundDispatcher
+from report import Report, State, MENUS, TRANSITIONS, OTHERS_EXPLAINED
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel, content=""):
+        self.id = message_id
+        self.channel = channel
+        self.content = content
+        self.author = FakeUser("reported-user")
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+class FakeUser:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeChannel:
+    def __init__(self):
+        self.id = 1
+        self.next_id = 0
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.next_id += 1
+        self.sent += 1
+        return FakeMessage(self.next_id, self, content)
+
+
+class FakeClient:
+    def __init__(self):
+        # Pacing is turned off so only the dispatcher's own overhead is measured
+        unlimited = (1_000_000, 1.0)
+        self.outbound = OutboundDispatcher(max_in_flight=64, rate_limits={kind: unlimited for kind in ('message', 'reaction', 'edit', 'delete')})
+
+
+class FakePayload:
+    def __init__(self, message_id, emoji):
+        self.message_id = message_id
+        self.emoji = emoji
+
+
+def paths(state=State.MESSAGE_IDENTIFIED, prefix=()):
+    '''
+    Yields every sequence of reactions that takes a report from state to a state with no menu.
+    '''
+    if state == State.OTHERS_CHOSEN:
+        yield from paths(OTHERS_EXPLAINED.next_state, prefix)
+        return
+    menu = MENUS.get(state)
+    if menu is None:
+        yield prefix
+        return
+    for option in menu.options:
+        yield from paths(option.next_state, prefix + (option.emoji,))
+
+
+async def replay(client, path, channel, timings):
+    report = Report(client, FakeUser("reporter"))
+    report.message = FakeMessage(0, channel, "reported message")
+    report.state = State.MESSAGE_IDENTIFIED
+    await report.prompt(channel)
+    for emoji in path:
+        if report.state == State.OTHERS_CHOSEN:
+            # "Others" asks for a typed explanation before the block prompt
+            report.other_explanation = "explanation"
+            await report.choose(OTHERS_EXPLAINED, channel)
+        menu = MENUS[report.state]
+        payload = FakePayload(getattr(report, menu.message_attr), emoji)
+        start = time.perf_counter()
+        await report.handle_reaction(payload, FakeMessage(payload.message_id, channel))
+        timings.append(time.perf_counter() - start)
+    assert report.report_complete(), path
+
+
+async def run(args):
+    all_paths = list(paths())
+    channel = FakeChannel()
+    client = FakeClient()
+    timings = []
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for path in all_paths:
+            await replay(client, path, channel, timings)
+    elapsed = time.perf_counter() - start
+    await client.outbound.stop()
+
+    # Table lookup alone, without sending the next prompt
+    keys = list(TRANSITIONS) * 100
+    lookup_start = time.perf_counter()
+    for key in keys:
+        TRANSITIONS.get(key)
+    lookup = (time.perf_counter() - lookup_start) / len(keys)
+
+    timings.sort()
+    print(f"{len(all_paths)} distinct paths, {len(TRANSITIONS)} transitions in the table")
+    print(f"transitions replayed: {len(timings)} in {elapsed:.2f}s ({len(timings) / elapsed:,.0f}/s)")
+    print(f"handle_reaction p50: {statistics.median(timings) * 1e6:.1f}us  p99: {timings[int(len(timings) * 0.99)] * 1e6:.1f}us")
+    print(f"table lookup: {lookup * 1e9:.0f}ns")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark reporting-flow transitions.")
+    parser.add_argument('--rounds', type=int, default=1000, help="Times every path is replayed")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,456 @@
+# reportLoadSimulator.py
+# Drives many synthetic users through the reporting flows at once: users reporting a message over
+# DM (Report), moderators reviewing one from the mod channel (ModReport) and the review team
+# (ThreePersonReport). Every step goes through ModBot's real entry points, on_message and
+# on_raw_reaction_add, with stand-in messages, channels and reaction payloads, so session storage,
+# reaction routing, link resolution and the outbound dispatcher are all exercised. Users read each
+# prompt, wait a while and react with one of the options it lists, until their flow ends.
+#
+# Measures the latency of every transition (keyed by flow and the state it started from), event
+# loop lag and resident memory per live session. --output saves the results as JSON and --compare
+# prints how a run differs from a saved one, so changes to the flow code can be compared run to run.
+#
+#   python reportLoadSimulator.py --users 2000 --output before.json
+#   python reportLoadSimulator.py --users 2000 --output after.json --compare before.json
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import traceback
+import config
+from bot import ModBot
+from classifier import Classifier
+from outboundDispatcher import OutboundDispatcher
+from report import State
+from scoreCache import ScoreCache
+from replayBenchmark import Latency, FakeFirestore, FakePerspective, FakeOpenAI, percentile
+
+GUILD_ID = 1
+MONITORED_CHANNEL_ID = 10
+MOD_CHANNEL_ID = 11
+REVIEW_CHANNEL_ID = 12
+GROUP_NUM = 0
+BOT_USER_ID = 1
+
+# The emojis a prompt offers, in the order they are listed
+OPTION_PATTERN = re.compile('[1-9]️⃣|👍|👎')
+
+FLOWS = ['report', 'moderation', 'review']
+
+
+def resident_memory():
+    # Bytes of memory this process has resident right now
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Not Linux: the peak is the best available
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': max(values, default=0) * 1000,
+    }
+
+
+# Discord ----------------------------------------------------------------------
+
+class SimGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.text_channels = []
+
+    def get_channel(self, channel_id):
+        return next((channel for channel in self.text_channels if channel.id == channel_id), None)
+
+
+class SimUser:
+    def __init__(self, user_id, name, simulator):
+        self.id = user_id
+        self.name = name
+        self.simulator = simulator
+        self.dm = None
+
+    async def create_dm(self):
+        if self.dm is None:
+            self.dm = self.simulator.add_channel(None, f"dm-{self.id}")
+        return self.dm
+
+    async def send(self, content=None, **kwargs):
+        channel = await self.create_dm()
+        return await channel.send(content, **kwargs)
+
+
+class SimChannel:
+    def __init__(self, channel_id, name, guild, simulator):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.simulator = simulator
+        self.messages = {} # Map from message ID to the messages sent here
+
+    async def send(self, content=None, **kwargs):
+        self.simulator.calls['discord'] += 1
+        await self.simulator.discord_latency.wait()
+        return self.add_message(self.simulator.bot_user, content)
+
+    def add_message(self, author, content):
+        message = SimMessage(self.simulator.next_id(), self, content, author)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        self.simulator.calls['discord'] += 1
+        await self.simulator.discord_latency.wait()
+        return self.messages[message_id]
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or SimMessage(message_id, self, None, None)
+
+
+class SimMessage:
+    def __init__(self, message_id, channel, content, author):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.author = author
+        guild_id = channel.guild.id if channel.guild else '@me'
+        self.jump_url = f"https://discord.com/channels/{guild_id}/{channel.id}/{message_id}"
+
+    async def edit(self, **kwargs):
+        self.channel.simulator.calls['discord'] += 1
+        await self.channel.simulator.discord_latency.wait()
+
+    async def add_reaction(self, emoji):
+        self.channel.simulator.calls['discord'] += 1
+        await self.channel.simulator.discord_latency.wait()
+
+    async def delete(self):
+        # Left in place so other moderators can still review it
+        self.channel.simulator.calls['discord'] += 1
+        await self.channel.simulator.discord_latency.wait()
+
+
+class SimPayload:
+    def __init__(self, user_id, channel_id, message_id, emoji, guild_id=None):
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.emoji = emoji
+        self.guild_id = guild_id
+
+
+class SimBot(ModBot):
+    '''
+    ModBot answering user, guild and channel lookups from the simulator instead of a gateway cache.
+    '''
+    user = None
+
+    def __init__(self, simulator, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.simulator = simulator
+        self.user = simulator.bot_user
+
+    def get_guild(self, guild_id):
+        return self.simulator.guild if guild_id == GUILD_ID else None
+
+    def get_channel(self, channel_id):
+        return self.simulator.channels.get(channel_id)
+
+    def get_partial_messageable(self, channel_id, guild_id=None):
+        return self.simulator.channels[channel_id]
+
+    def get_user(self, user_id):
+        return self.simulator.users.get(user_id)
+
+
+# Simulation -------------------------------------------------------------------
+
+class Simulator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.calls = {'discord': 0, 'firestore': 0}
+        self.discord_latency = Latency(args.discord_latency, args.jitter)
+        self.ids = 1000
+        self.channels = {} # Map from channel ID to every channel, DMs included
+        self.users = {}
+        self.bot_user = SimUser(BOT_USER_ID, f"Group {GROUP_NUM} Bot", self)
+        self.guild = SimGuild(GUILD_ID)
+        self.monitored = self.add_channel(self.guild, f'group-{GROUP_NUM}', MONITORED_CHANNEL_ID)
+        self.mod_channel = self.add_channel(self.guild, f'group-{GROUP_NUM}-mod', MOD_CHANNEL_ID)
+        self.review_channel = self.add_channel(self.guild, f'group-{GROUP_NUM}-3-person-review-team', REVIEW_CHANNEL_ID)
+        self.guild.text_channels = [self.monitored, self.mod_channel, self.review_channel]
+        self.directory = None
+        self.client = None
+
+        # Results
+        self.transitions = {} # Map from "flow state" to the latency of every transition out of it
+        self.lags = []
+        self.memory = [] # (seconds since start, resident bytes, live sessions)
+        self.outcomes = {'completed': 0, 'abandoned': 0, 'failed': 0}
+        self.errors = {}
+
+    def next_id(self):
+        self.ids += 1
+        return self.ids
+
+    def add_channel(self, guild, name, channel_id=None):
+        channel = SimChannel(channel_id or self.next_id(), name, guild, self)
+        self.channels[channel.id] = channel
+        return channel
+
+    def build_client(self):
+        args = self.args
+        scores = os.path.join(self.directory, 'scores.sqlite3')
+        # Nothing is classified; the stand-ins only keep the classifier from needing API keys
+        classifier = Classifier(
+            {},
+            perspective=FakePerspective(Latency(0, 0), {'perspective': 0}, {}),
+            open_ai_functions=FakeOpenAI(Latency(0, 0), {'openai': 0}, {}),
+            score_cache=ScoreCache(scores, max_entries=config.SCORE_CACHE_MAX_ENTRIES),
+        )
+        db = FakeFirestore(Latency(args.firestore_latency, args.jitter), self.calls, [])
+        client = SimBot(self, {}, shard_count=1, db=db, classifier=classifier)
+        if args.no_rate_limits:
+            unlimited = (1_000_000, 1.0)
+            client.outbound = OutboundDispatcher(config.OUTBOUND_MAX_IN_FLIGHT, {kind: unlimited for kind in config.OUTBOUND_RATE_LIMITS})
+        client.channels.set_group(GROUP_NUM)
+        client.channels.add_guild(self.guild)
+        return client
+
+    def session_store(self, flow):
+        return {'report': self.client.reports, 'moderation': self.client.mod_reports, 'review': self.client.three_mod_reports}[flow]
+
+    def live_sessions(self):
+        return sum(len(sessions) for sessions in self.client.session_stores())
+
+    def session(self, flow, user):
+        # Peeks without counting as activity
+        entry = self.session_store(flow).sessions.get(user.id)
+        return entry[1] if entry else None
+
+    async def think(self):
+        await asyncio.sleep(self.rng.expovariate(1 / self.args.think) if self.args.think > 0 else 0)
+
+    async def timed(self, flow, user, event):
+        session = self.session(flow, user)
+        key = f"{flow} {session.state.name if session else 'NEW'}"
+        start = time.perf_counter()
+        await event
+        self.transitions.setdefault(key, []).append(time.perf_counter() - start)
+
+    async def say(self, flow, user, channel, content):
+        await self.timed(flow, user, self.client.on_message(channel.add_message(user, content)))
+
+    async def react(self, flow, user, prompt, emoji):
+        payload = SimPayload(user.id, prompt.channel.id, prompt.id, emoji, prompt.guild.id if prompt.guild else None)
+        await self.timed(flow, user, self.client.on_raw_reaction_add(payload))
+
+    async def run_user(self, flow, user, target, delay):
+        await asyncio.sleep(delay)
+        if flow == 'report':
+            channel = await user.create_dm()
+            start = "report"
+        else:
+            channel = self.mod_channel if flow == 'moderation' else self.review_channel
+            start = "mod"
+        await self.say(flow, user, channel, start)
+        await self.think()
+        await self.say(flow, user, channel, target.jump_url)
+        for _ in range(self.args.max_steps):
+            session = self.session(flow, user)
+            if session is None:
+                self.outcomes['completed'] += 1
+                return
+            await self.think()
+            if flow == 'report' and session.state == State.OTHERS_CHOSEN:
+                # "Others" asks for a typed explanation
+                await self.say(flow, user, user.dm, "They keep posting this in every channel.")
+                continue
+            prompt = user.dm.messages.get(session.prompt_message_id())
+            options = OPTION_PATTERN.findall(prompt.content) if prompt else []
+            if not options:
+                break
+            await self.react(flow, user, prompt, self.rng.choice(options))
+        self.outcomes['abandoned'] += 1
+
+    async def guarded(self, flow, user, target, delay):
+        try:
+            await self.run_user(flow, user, target, delay)
+        except Exception as e:
+            self.outcomes['failed'] += 1
+            name = type(e).__name__
+            if name not in self.errors:
+                traceback.print_exc()
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    async def sample_lag(self, interval=0.01):
+        # How late the loop wakes this task up is how long everything else waits behind handlers
+        while True:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            self.lags.append(max(0.0, time.perf_counter() - expected))
+
+    async def sample_memory(self, start, interval=0.25):
+        while True:
+            self.memory.append((time.perf_counter() - start, resident_memory(), self.live_sessions()))
+            await asyncio.sleep(interval)
+
+    async def run(self):
+        # The session database and score cache live here for the run only
+        with tempfile.TemporaryDirectory(prefix='flows-') as directory:
+            self.directory = directory
+            return await self.simulate()
+
+    async def simulate(self):
+        args = self.args
+        # Keep the simulator's sessions out of the real session database
+        config.SESSION_DB_PATH = os.path.join(self.directory, 'sessions.sqlite3')
+        self.client = self.build_client()
+        await self.client.start_services()
+
+        targets = [
+            self.monitored.add_message(SimUser(self.next_id(), f"poster-{i}", self), f"reported message {i}")
+            for i in range(args.targets)
+        ]
+        weights = [args.report_share, args.moderation_share, args.review_share]
+        plan = []
+        for _ in range(args.users):
+            user = SimUser(self.next_id(), f"user-{len(plan)}", self)
+            self.users[user.id] = user
+            await user.create_dm()
+            flow = self.rng.choices(FLOWS, weights)[0]
+            plan.append((flow, user, self.rng.choice(targets), self.rng.uniform(0, args.ramp)))
+
+        # Everything the simulator itself holds is in place, so growth from here is the bot's
+        baseline = resident_memory()
+        start = time.perf_counter()
+        samplers = [asyncio.create_task(self.sample_lag()), asyncio.create_task(self.sample_memory(start))]
+        users = [asyncio.create_task(self.guarded(*entry)) for entry in plan]
+        done, pending = await asyncio.wait(users, timeout=args.timeout)
+        elapsed = time.perf_counter() - start
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self.outcomes['abandoned'] += len(pending)
+        self.memory.append((elapsed, resident_memory(), self.live_sessions()))
+        for task in samplers:
+            task.cancel()
+        component_stats = {
+            'outbound': self.client.outbound.stats(),
+            'reaction_router': self.client.reaction_router.stats(),
+            'message_resolver': self.client.message_resolver.stats(),
+            'sessions': {sessions.name: sessions.stats() for sessions in self.client.session_stores()},
+        }
+        await self.client.stop_services()
+        return self.results(baseline, elapsed, component_stats)
+
+    def results(self, baseline, elapsed, component_stats):
+        _, peak_rss, peak_live = max(self.memory, key=lambda sample: (sample[2], sample[1]))
+        transitions = sum(len(latencies) for latencies in self.transitions.values())
+        return {
+            'args': vars(self.args),
+            'users': self.args.users,
+            'outcomes': self.outcomes,
+            'errors': self.errors,
+            'elapsed': elapsed,
+            'transitions_per_second': transitions / elapsed,
+            'all_transitions': summarize([latency for latencies in self.transitions.values() for latency in latencies]),
+            'transitions': {key: summarize(latencies) for key, latencies in sorted(self.transitions.items())},
+            'loop_lag': summarize(self.lags),
+            'memory': {
+                'baseline_mb': baseline / 2**20,
+                'peak_live_sessions': peak_live,
+                'resident_mb_at_peak': peak_rss / 2**20,
+                'bytes_per_session': (peak_rss - baseline) / peak_live if peak_live else 0,
+            },
+            'api_calls_per_transition': {name: count / max(transitions, 1) for name, count in self.calls.items()},
+            'components': component_stats,
+        }
+
+
+# Reporting --------------------------------------------------------------------
+
+def print_results(results, baseline=None):
+    def change(path, value):
+        # " (+12%)" against the same figure in the baseline run, if there is one
+        if baseline is None:
+            return ""
+        old = baseline
+        for key in path:
+            old = old.get(key) if isinstance(old, dict) else None
+        if not old:
+            return ""
+        return f" ({(value - old) / old:+.0%})"
+
+    outcomes = results['outcomes']
+    print(f"{results['users']} users: {outcomes['completed']} completed, {outcomes['abandoned']} abandoned, {outcomes['failed']} failed in {results['elapsed']:.1f}s")
+    for name, count in results['errors'].items():
+        print(f"  {name}: {count}")
+    overall = results['all_transitions']
+    print(
+        f"transitions: {overall['count']} ({results['transitions_per_second']:,.0f}/s)  "
+        f"p50 {overall['p50_ms']:.1f}ms{change(['all_transitions', 'p50_ms'], overall['p50_ms'])}  "
+        f"p99 {overall['p99_ms']:.1f}ms{change(['all_transitions', 'p99_ms'], overall['p99_ms'])}"
+    )
+    print(f"{'transition from':<52} {'count':>6} {'p50 ms':>16} {'p95 ms':>9} {'p99 ms':>16} {'max ms':>9}")
+    for key, stats in results['transitions'].items():
+        p50 = f"{stats['p50_ms']:.1f}{change(['transitions', key, 'p50_ms'], stats['p50_ms'])}"
+        p99 = f"{stats['p99_ms']:.1f}{change(['transitions', key, 'p99_ms'], stats['p99_ms'])}"
+        print(f"{key:<52} {stats['count']:>6} {p50:>16} {stats['p95_ms']:>9.1f} {p99:>16} {stats['max_ms']:>9.1f}")
+    lag = results['loop_lag']
+    print(
+        f"event loop lag p50: {lag['p50_ms']:.2f}ms  p99: {lag['p99_ms']:.2f}ms{change(['loop_lag', 'p99_ms'], lag['p99_ms'])}  "
+        f"max: {lag['max_ms']:.2f}ms{change(['loop_lag', 'max_ms'], lag['max_ms'])}"
+    )
+    memory = results['memory']
+    print(
+        f"memory: {memory['baseline_mb']:.1f}MB before, {memory['resident_mb_at_peak']:.1f}MB at {memory['peak_live_sessions']} live sessions, "
+        f"~{memory['bytes_per_session']:,.0f} bytes per session{change(['memory', 'bytes_per_session'], memory['bytes_per_session'])}"
+    )
+    print("API calls per transition: " + ", ".join(f"{name} {count:.2f}" for name, count in results['api_calls_per_transition'].items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate many users going through the reporting flows at once.")
+    parser.add_argument('--users', type=int, default=1000, help="Synthetic users, each going through one flow")
+    parser.add_argument('--report-share', type=float, default=0.85, help="Relative share of users reporting over DM")
+    parser.add_argument('--moderation-share', type=float, default=0.1, help="Relative share of moderators reviewing from the mod channel")
+    parser.add_argument('--review-share', type=float, default=0.05, help="Relative share of review team members")
+    parser.add_argument('--targets', type=int, default=200, help="Distinct messages being reported")
+    parser.add_argument('--ramp', type=float, default=10.0, help="Seconds over which users start")
+    parser.add_argument('--think', type=float, default=2.0, help="Mean seconds a user takes between steps")
+    parser.add_argument('--max-steps', type=int, default=20, help="Reactions before a user gives up on a flow")
+    parser.add_argument('--discord-latency', type=float, default=0.05, help="Seconds per Discord REST call")
+    parser.add_argument('--firestore-latency', type=float, default=0.03, help="Seconds per Firestore call")
+    parser.add_argument('--jitter', type=float, default=0.3, help="Latencies vary by up to this fraction either way")
+    parser.add_argument('--no-rate-limits', action='store_true', help="Don't pace calls to Discord")
+    parser.add_argument('--timeout', type=float, default=300.0, help="Seconds before unfinished users are abandoned")
+    parser.add_argument('--output', help="Save the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--seed', type=int, default=152)
+    args = parser.parse_args()
+
+    results = asyncio.run(Simulator(args).run())
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
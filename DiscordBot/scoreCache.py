@@ -0,0 +1,159 @@
+# scoreCache.py
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+def normalize(text):
+    '''
+    Normalizes text so trivially different copies (case, unicode width, extra whitespace)
+    of the same message share one cache entry.
+    '''
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return re.sub(r'\s+', ' ', text).strip()
+
+def content_hash(text):
+    return hashlib.sha256(normalize(text).encode('utf-8')).hexdigest()
+
+class ScoreCache:
+    '''
+    Two-level cache for classifier results keyed by (namespace, normalized content hash).
+    Lookups check an in-memory LRU with a TTL first and fall back to a SQLite file that
+    survives restarts. Disk reads and writes run off the event loop.
+    '''
+
+    def __init__(self, path, max_entries=10000, ttl=3600, disk_ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        self.memory = OrderedDict() # Map from (namespace, hash) to (expires_at, value)
+        self.pending = {} # Map from (namespace, hash) to the future computing that value
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS scores ('
+            'namespace TEXT NOT NULL, hash TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL, '
+            'PRIMARY KEY (namespace, hash))'
+        )
+        self.conn.commit()
+
+        # Metrics
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def stats(self):
+        return {
+            'memory_entries': len(self.memory),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # Memory level -------------------------------------------------------------
+
+    def _memory_get(self, key):
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.memory[key]
+            self.expirations += 1
+            return None
+        self.memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key, value):
+        self.memory[key] = (time.monotonic() + self.ttl, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    # Disk level ---------------------------------------------------------------
+
+    def _disk_get(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT value, created_at FROM scores WHERE namespace = ? AND hash = ?', key
+            ).fetchone()
+        if row is None or row[1] + self.disk_ttl < time.time():
+            return None
+        return json.loads(row[0])
+
+    def _disk_set(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO scores (namespace, hash, value, created_at) VALUES (?, ?, ?, ?)',
+                (*key, json.dumps(value), time.time())
+            )
+            self.conn.commit()
+
+    # Public API ---------------------------------------------------------------
+
+    async def get(self, namespace, text):
+        key = (namespace, content_hash(text))
+        value = self._memory_get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        value = await asyncio.to_thread(self._disk_get, key)
+        if value is not None:
+            self.disk_hits += 1
+            self._memory_set(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    async def set(self, namespace, text, value):
+        key = (namespace, content_hash(text))
+        self._memory_set(key, value)
+        await asyncio.to_thread(self._disk_set, key, value)
+
+    async def get_or_compute(self, namespace, text, compute, should_cache=None):
+        '''
+        Returns the cached value for text, or awaits compute() and caches its result. Concurrent
+        misses for the same content share a single compute() call. If should_cache is given, only
+        results for which should_cache(value) is true are stored.
+        '''
+        value = await self.get(namespace, text)
+        if value is not None:
+            return value
+
+        key = (namespace, content_hash(text))
+        if key in self.pending:
+            return await asyncio.shield(self.pending[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            value = await compute()
+            if should_cache is None or should_cache(value):
+                await self.set(namespace, text, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting on it
+            future.exception()
+            raise
+        finally:
+            del self.pending[key]
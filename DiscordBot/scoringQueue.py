@@ -0,0 +1,122 @@
+# scoringQueue.py
+import asyncio
+import logging
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+class ScoringQueue:
+    '''
+    Collects messages into micro-batches and scores every message in a batch concurrently.
+    A batch is dispatched as soon as it holds max_batch_size messages or max_wait seconds have
+    passed since its first message arrived, whichever comes first. Each result is handed to
+    on_result(message, scores).
+
+    At most max_batches batches are scored at once. Until one of them finishes no new batch is
+    collected, so the queue fills up and put() waits instead of batches piling up during a raid.
+    '''
+
+    def __init__(self, score, on_result, max_batch_size=32, max_wait=0.05, max_queue_size=10000, max_batches=8):
+        self.score = score
+        self.on_result = on_result
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.batch_slots = asyncio.Semaphore(max_batches)
+        self.worker = None
+        self.in_flight = set() # Batches that are still being scored
+
+        # Metrics
+        self.enqueued = 0
+        self.scored = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.batch_sizes = Counter() # Map from batch size to the number of batches of that size
+
+    def start(self):
+        if self.worker is None:
+            self.worker = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        for task in self.in_flight:
+            task.cancel()
+        await asyncio.gather(*self.in_flight, return_exceptions=True)
+        self.in_flight.clear()
+
+    async def put(self, message):
+        # Waits when the queue is full so a raid applies backpressure instead of growing memory
+        await self.queue.put(message)
+        self.enqueued += 1
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {
+            'queue_depth': self.depth(),
+            'enqueued': self.enqueued,
+            'scored': self.scored,
+            'failed': self.failed,
+            'batches': self.batches,
+            'batches_in_flight': len(self.in_flight),
+            'last_batch_size': self.last_batch_size,
+            'batch_sizes': dict(self.batch_sizes),
+        }
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        while True:
+            # Wait for a free slot before taking messages off the queue, so a full house backs up into put()
+            await self.batch_slots.acquire()
+            try:
+                batch = await self.next_batch()
+            except BaseException:
+                self.batch_slots.release()
+                raise
+            self.batches += 1
+            self.last_batch_size = len(batch)
+            self.batch_sizes[len(batch)] += 1
+            # Don't wait for this batch to finish before collecting the next one
+            task = asyncio.create_task(self.dispatch(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def dispatch(self, batch):
+        try:
+            await asyncio.gather(*(self.process(message) for message in batch))
+        finally:
+            self.batch_slots.release()
+
+    async def process(self, message):
+        try:
+            scores = await self.score(message)
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Could not score message {getattr(message, 'id', None)}: {e}")
+            return
+        self.scored += 1
+        try:
+            await self.on_result(message, scores)
+        except Exception:
+            logger.exception(f"Failed to handle scores for message {getattr(message, 'id', None)}")
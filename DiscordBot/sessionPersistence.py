@@ -0,0 +1,212 @@
+# sessionPersistence.py
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def message_ref(message):
+    # Messages are stored as [channel ID, message ID, guild ID] and fetched again on restore
+    if message is None:
+        return None
+    return [message.channel.id, message.id, message.guild.id if message.guild else None]
+
+async def fetch_message_ref(client, ref):
+    if ref is None:
+        return None
+    # Sessions saved before the guild ID was stored only have the first two
+    channel_id, message_id, guild_id = (list(ref) + [None])[:3]
+    return await client.message_resolver.fetch(channel_id, message_id, guild_id=guild_id)
+
+async def fetch_user(client, user_id):
+    return client.get_user(user_id) or await client.fetch_user(user_id)
+
+
+class SessionPersistence:
+    '''
+    Restart-safe copy of in-flight report sessions in a SQLite (WAL) file. Each session is stored as
+    a small JSON document of IDs and enum names under (kind, user ID).
+
+    save() and delete() never block: they record the latest state in memory and a background
+    writer thread commits everything that changed in one transaction, so a session that moves
+    through several states between commits is written once. The set of stored keys is kept in
+    memory so checking whether a user has a session to restore costs no disk read.
+
+    With shared=True the file is shared with bot processes running other shards, so any of them may
+    have written a session since this one started. has() can no longer answer from memory, and a
+    delete only removes the row if it is still the version this process saved, so a session that
+    another process has since moved on is left alone. A shared file also carries handoffs: work
+    about a guild on another process's shard (e.g. a finished user report, which arrives by DM on
+    the process running shard 0) is left for the process running that shard to pick up.
+    '''
+
+    def __init__(self, path, flush_interval=0.05, shared=False):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'kind TEXT NOT NULL, user_id INTEGER NOT NULL, state TEXT NOT NULL, updated_at REAL NOT NULL, '
+            'PRIMARY KEY (kind, user_id))'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS handoffs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, shard_id INTEGER NOT NULL, kind TEXT NOT NULL, '
+            'payload TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self.conn.commit()
+        self.keys = set(self.conn.execute('SELECT kind, user_id FROM sessions').fetchall())
+
+        self.pending = {} # Map from (kind, user_id) to (state, updated_at); a state of None deletes the row
+        self.writing = {} # The batch currently being committed, in the same format as pending
+        self.lock = threading.Lock() # Guards pending and writing; held only briefly on the event loop
+        self.db_lock = threading.Lock() # Guards the connection
+        self.wake = threading.Event()
+        self.stopping = False
+        self.writer = threading.Thread(target=self.write_loop, name='session-writer', daemon=True)
+        self.writer.start()
+
+        # Metrics
+        self.saves = 0
+        self.commits = 0
+        self.rows_written = 0
+        self.handed_off = 0
+        self.taken = 0
+
+    def stats(self):
+        return {
+            'stored_sessions': len(self.keys),
+            'pending_writes': len(self.pending),
+            'saves': self.saves,
+            'commits': self.commits,
+            'rows_written': self.rows_written,
+            'handed_off': self.handed_off,
+            'taken': self.taken,
+        }
+
+    def has(self, kind, user_id):
+        return self.shared or (kind, user_id) in self.keys
+
+    def save(self, kind, user_id, state):
+        '''
+        Returns the saved version's timestamp, which identifies it to load() and delete().
+        '''
+        updated_at = time.time()
+        with self.lock:
+            self.pending[(kind, user_id)] = (json.dumps(state, separators=(',', ':')), updated_at)
+            self.keys.add((kind, user_id))
+        self.saves += 1
+        self.wake.set()
+        return updated_at
+
+    def delete(self, kind, user_id, updated_at=None):
+        with self.lock:
+            if self.shared:
+                if updated_at is None:
+                    # This process never saved the session, so whatever is stored belongs to another one
+                    return
+            elif (kind, user_id) not in self.keys:
+                return
+            self.pending[(kind, user_id)] = (None, updated_at)
+            self.keys.discard((kind, user_id))
+        self.wake.set()
+
+    async def load(self, kind, user_id):
+        '''
+        Returns (state, updated_at) for the session, or None if there isn't one.
+        '''
+        with self.lock:
+            for batch in (self.pending, self.writing):
+                if (kind, user_id) in batch:
+                    state, updated_at = batch[(kind, user_id)]
+                    return None if state is None else (json.loads(state), updated_at)
+        row = await asyncio.to_thread(self._read, kind, user_id)
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _read(self, kind, user_id):
+        with self.db_lock:
+            return self.conn.execute(
+                'SELECT state, updated_at FROM sessions WHERE kind = ? AND user_id = ?', (kind, user_id)
+            ).fetchone()
+
+    # Handoffs -----------------------------------------------------------------
+    # Both block on the database, so they are run with asyncio.to_thread
+
+    def hand_off(self, shard_id, kind, payload):
+        with self.db_lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO handoffs (shard_id, kind, payload, created_at) VALUES (?, ?, ?, ?)',
+                (shard_id, kind, json.dumps(payload, separators=(',', ':')), time.time()),
+            )
+        self.handed_off += 1
+
+    def take_handoffs(self, shard_ids):
+        '''
+        Removes and returns [(kind, payload)] handed off to any of shard_ids, oldest first.
+        '''
+        shard_ids = list(shard_ids)
+        placeholders = ','.join('?' * len(shard_ids))
+        with self.db_lock, self.conn:
+            rows = self.conn.execute(
+                f'SELECT id, kind, payload FROM handoffs WHERE shard_id IN ({placeholders}) ORDER BY id', shard_ids
+            ).fetchall()
+            self.conn.executemany('DELETE FROM handoffs WHERE id = ?', [(row[0],) for row in rows])
+        self.taken += len(rows)
+        return [(kind, json.loads(payload)) for _, kind, payload in rows]
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            self.writing, self.pending = self.pending, {}
+        batch = self.writing
+        upserts = [(kind, user_id, state, updated_at) for (kind, user_id), (state, updated_at) in batch.items() if state is not None]
+        deletes = [(kind, user_id) for (kind, user_id), (state, updated_at) in batch.items() if state is None and not self.shared]
+        # Shared files only lose the row this process last wrote
+        versioned_deletes = [(kind, user_id, updated_at) for (kind, user_id), (state, updated_at) in batch.items() if state is None and self.shared]
+        try:
+            with self.db_lock, self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO sessions (kind, user_id, state, updated_at) VALUES (?, ?, ?, ?)', upserts
+                )
+                self.conn.executemany('DELETE FROM sessions WHERE kind = ? AND user_id = ?', deletes)
+                self.conn.executemany('DELETE FROM sessions WHERE kind = ? AND user_id = ? AND updated_at = ?', versioned_deletes)
+        except Exception:
+            with self.lock:
+                # Newer changes win over the batch that failed
+                self.pending = {**batch, **self.pending}
+            self.wake.set()
+            raise
+        finally:
+            with self.lock:
+                self.writing = {}
+        self.commits += 1
+        self.rows_written += len(batch)
+
+    def write_loop(self):
+        while not self.stopping:
+            self.wake.wait()
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to persist report sessions")
+            # Let more transitions pile up so they share the next transaction
+            time.sleep(self.flush_interval)
+
+    def close(self):
+        self.stopping = True
+        self.wake.set()
+        self.writer.join()
+        self.flush()
+        with self.db_lock:
+            self.conn.close()
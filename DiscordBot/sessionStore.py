@@ -0,0 +1,194 @@
+# sessionStore.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+logger = logging.getLogger(__name__)
+
+IDLE = 'idle'
+CAPACITY = 'capacity'
+
+class SessionStore(MutableMapping):
+    '''
+    Dict of in-flight report flows keyed by user ID that cannot grow without bound. A session that
+    hasn't been touched for idle_timeout seconds is evicted by a background sweeper (or when it is
+    next looked up), and once more than max_entries sessions are open the least recently used one
+    is evicted. on_evict(key, session, reason) is awaited for every eviction so the user can be told
+    their flow was closed. Reading a session with store[key] counts as activity.
+
+    With a persistence layer, persist(key) saves the session's to_state() after a transition and
+    removing a session deletes its saved copy. restore_session(key) brings a saved session back
+    after a restart using restore(key, state). When the persistence layer is shared with other
+    shard processes, restore_session(key) also reloads a session that another process has moved on
+    since this one last saved it, and drops it if that process finished it.
+    '''
+
+    def __init__(self, name, idle_timeout=1800.0, max_entries=10000, sweep_interval=60.0, on_evict=None, persistence=None, restore=None):
+        self.name = name
+        self.idle_timeout = idle_timeout
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self.on_evict = on_evict
+        self.persistence = persistence
+        self.restore = restore
+        self.sessions = OrderedDict() # Map from key to (last_active, session), least recently used first
+        self.versions = {} # Map from key to the updated_at of the copy this store last saved or loaded
+        self.sweeper = None
+        self.notifications = set()
+
+        # Metrics
+        self.evicted = {IDLE: 0, CAPACITY: 0}
+
+    def stats(self):
+        return {
+            'live': len(self.sessions),
+            'evicted_idle': self.evicted[IDLE],
+            'evicted_capacity': self.evicted[CAPACITY],
+        }
+
+    def start(self):
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            try:
+                await self.sweeper
+            except asyncio.CancelledError:
+                pass
+            self.sweeper = None
+
+    # Mapping interface --------------------------------------------------------
+
+    def __getitem__(self, key):
+        # Expiry is only checked by `in` and the sweeper so a session can't vanish between a
+        # membership check and the lookup that follows it
+        _, session = self.sessions[key]
+        self.sessions[key] = (time.monotonic(), session)
+        self.sessions.move_to_end(key)
+        return session
+
+    def __setitem__(self, key, session):
+        self.sessions[key] = (time.monotonic(), session)
+        self.sessions.move_to_end(key)
+        while len(self.sessions) > self.max_entries:
+            oldest = next(iter(self.sessions))
+            self.evict(oldest, CAPACITY)
+
+    def __delitem__(self, key):
+        del self.sessions[key]
+        if self.persistence is not None:
+            self.persistence.delete(self.name, key, self.versions.pop(key, None))
+
+    def __contains__(self, key):
+        if self.expired(key):
+            self.evict(key, IDLE)
+        return key in self.sessions
+
+    def __iter__(self):
+        return iter(list(self.sessions))
+
+    def __len__(self):
+        return len(self.sessions)
+
+    # Persistence --------------------------------------------------------------
+
+    def persist(self, key):
+        if self.persistence is not None and key in self.sessions:
+            self.versions[key] = self.persistence.save(self.name, key, self.sessions[key][1].to_state())
+
+    async def restore_session(self, key):
+        '''
+        Loads key's saved session back into memory if it isn't already there. Sessions that were
+        idle too long before the restart are discarded instead.
+        '''
+        if self.persistence is None:
+            return
+        if key in self.sessions:
+            if self.persistence.shared:
+                await self.refresh_session(key)
+            return
+        if not self.persistence.has(self.name, key):
+            return
+        saved = await self.persistence.load(self.name, key)
+        if saved is None or key in self.sessions:
+            return
+        state, updated_at = saved
+        session = None
+        if time.time() - updated_at <= self.idle_timeout:
+            try:
+                session = await self.restore(key, state)
+            except Exception as e:
+                logger.warning(f"Could not restore {self.name} session for {key}: {e}")
+        if session is None:
+            self.persistence.delete(self.name, key, updated_at)
+            return
+        if key not in self.sessions:
+            self[key] = session
+            self.versions[key] = updated_at
+
+    async def refresh_session(self, key):
+        # Another shard process may have handled this user's last event, so storage has the latest copy
+        version = self.versions.get(key)
+        saved = await self.persistence.load(self.name, key)
+        if key not in self.sessions or self.versions.get(key) != version:
+            return
+        if saved is None:
+            if version is not None:
+                # Finished (or cancelled) by the other process
+                del self.sessions[key]
+                del self.versions[key]
+            return
+        state, updated_at = saved
+        if updated_at == version:
+            return
+        try:
+            session = await self.restore(key, state)
+        except Exception as e:
+            logger.warning(f"Could not reload {self.name} session for {key}: {e}")
+            return
+        if session is not None and key in self.sessions and self.versions.get(key) == version:
+            self.sessions[key] = (time.monotonic(), session)
+            self.sessions.move_to_end(key)
+            self.versions[key] = updated_at
+
+    # Eviction -----------------------------------------------------------------
+
+    def expired(self, key, now=None):
+        entry = self.sessions.get(key)
+        if entry is None:
+            return False
+        return (now or time.monotonic()) - entry[0] > self.idle_timeout
+
+    def evict(self, key, reason):
+        _, session = self.sessions.pop(key)
+        self.evicted[reason] += 1
+        if self.persistence is not None:
+            self.persistence.delete(self.name, key, self.versions.pop(key, None))
+        if self.on_evict is not None:
+            task = asyncio.create_task(self.notify(key, session, reason))
+            self.notifications.add(task)
+            task.add_done_callback(self.notifications.discard)
+
+    async def notify(self, key, session, reason):
+        try:
+            await self.on_evict(key, session, reason)
+        except Exception as e:
+            logger.warning(f"Could not notify {key} that their {self.name} session expired: {e}")
+
+    def sweep(self):
+        now = time.monotonic()
+        # Sessions are ordered by last activity, so stop at the first one that is still live
+        while self.sessions:
+            key = next(iter(self.sessions))
+            if not self.expired(key, now):
+                break
+            self.evict(key, IDLE)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
@@ -0,0 +1,138 @@
+# shardBenchmark.py
+# Load test for sharded operation. A synthetic gateway stream (monitored-channel messages from many
+# guilds plus moderator flow transitions) is split across 1, 2, 4, ... processes the way
+# shardLauncher.py splits shards: each process only handles events of guilds on its shards. Messages
+# go through the keyword matcher and transitions through a SessionStore saved to a session database
+# shared by every process, so the numbers include the cost of sharing sessions through storage.
+#
+#   python shardBenchmark.py --shards 8 --processes 1,2,4 --events 200000
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from keywordMatcher import KeywordMatcher
+from sessionPersistence import SessionPersistence
+from sessionStore import SessionStore
+from shardLauncher import split_shards
+from shardState import shard_id_for
+
+WORDS = ["hello", "there", "anyone", "up", "for", "a", "game", "tonight", "that", "was", "great", "see", "you", "later", "lol"]
+
+
+class FakeFlow:
+    def __init__(self, step=0):
+        self.step = step
+
+    def to_state(self):
+        return {'step': self.step}
+
+
+def make_events(args):
+    '''
+    The same stream in every process: (guild ID, user ID, content), where content None is a
+    moderator flow transition.
+    '''
+    rng = random.Random(args.seed)
+    # Snowflakes, so guilds spread over shards the way Discord spreads them
+    guilds = [rng.getrandbits(42) << 22 for _ in range(args.guilds)]
+    events = []
+    for _ in range(args.events):
+        guild_id = rng.choice(guilds)
+        if rng.random() < args.session_rate:
+            events.append((guild_id, rng.randrange(args.moderators), None))
+        else:
+            events.append((guild_id, rng.randrange(1_000_000), " ".join(rng.choices(WORDS, k=rng.randint(5, 40)))))
+    return events
+
+
+async def handle_events(events, matcher, sessions):
+    flagged = 0
+    for i, (guild_id, user_id, content) in enumerate(events):
+        if content is not None:
+            if matcher.matches(content):
+                flagged += 1
+        else:
+            await sessions.restore_session(user_id)
+            if user_id not in sessions:
+                sessions[user_id] = FakeFlow()
+            sessions[user_id].step += 1
+            sessions.persist(user_id)
+        if i % 100 == 0:
+            # Let the session writer and other tasks in, as the gateway reader would between events
+            await asyncio.sleep(0)
+    return flagged
+
+
+async def restore_flow(user_id, state):
+    return FakeFlow(state['step'])
+
+
+def worker(args, shard_ids, db_path, shared, barrier, results):
+    shard_ids = set(shard_ids)
+    # Discord only delivers this process the events of guilds on its shards
+    events = [event for event in make_events(args) if shard_id_for(event[0], args.shards) in shard_ids]
+    matcher = KeywordMatcher([f"badword{i}" for i in range(args.keywords)] + ["lol"])
+    persistence = SessionPersistence(db_path, shared=shared)
+
+    async def run():
+        sessions = SessionStore("moderation", persistence=persistence, restore=restore_flow)
+        barrier.wait()
+        start = time.perf_counter()
+        await handle_events(events, matcher, sessions)
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    persistence.close()
+    results.put((len(events), elapsed))
+
+
+def measure(args, processes):
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'sessions.sqlite3')
+        # One process runs every shard and owns the session database; more have to share it
+        shared = processes > 1
+        workers = [
+            context.Process(target=worker, args=(args, shard_ids, db_path, shared, barrier, results))
+            for shard_ids in split_shards(args.shards, processes)
+        ]
+        for process in workers:
+            process.start()
+        outcomes = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+    events = sum(count for count, _ in outcomes)
+    # The stream is done once the slowest process is done
+    elapsed = max(elapsed for _, elapsed in outcomes)
+    return len(workers), events, elapsed, max(count for count, _ in outcomes)
+
+
+def main(args):
+    print(f"{args.events} events from {args.guilds} guilds over {args.shards} shards, {args.session_rate:.0%} session transitions")
+    # Processes only run in parallel up to the number of cores
+    print(f"{os.cpu_count()} CPU(s) available")
+    print(f"{'processes':>9}  {'events':>8}  {'busiest':>8}  {'seconds':>7}  {'events/s':>10}  {'speedup':>7}")
+    baseline = None
+    for processes in args.processes:
+        processes, events, elapsed, busiest = measure(args, processes)
+        throughput = events / elapsed
+        baseline = baseline or throughput
+        print(f"{processes:>9}  {events:>8}  {busiest:>8}  {elapsed:>7.2f}  {throughput:>10,.0f}  {throughput / baseline:>6.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure throughput as shards are spread over more processes.")
+    parser.add_argument('--shards', type=int, default=8, help="Total number of gateway shards")
+    parser.add_argument('--processes', type=lambda value: [int(n) for n in value.split(',')], default=[1, 2, 4], help="Comma-separated process counts to try")
+    parser.add_argument('--events', type=int, default=200000, help="Events in the stream")
+    parser.add_argument('--guilds', type=int, default=1000, help="Guilds the events come from")
+    parser.add_argument('--moderators', type=int, default=200, help="Moderators with flows open")
+    parser.add_argument('--session-rate', type=float, default=0.05, help="Share of events that are flow transitions")
+    parser.add_argument('--keywords', type=int, default=500, help="Keywords in the matcher")
+    parser.add_argument('--seed', type=int, default=152)
+    main(parser.parse_args())
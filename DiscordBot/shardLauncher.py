@@ -0,0 +1,56 @@
+# shardLauncher.py
+# Runs the bot's gateway shards across several processes. Each process connects its own slice of
+# the shards and keeps the state of those shards' guilds, while report sessions are shared through
+# the session database (config.SESSION_DB_PATH) so a flow can continue on whichever process
+# receives its next event. DMs only reach the process running shard 0, so a user report about a
+# guild on another process's shard (and a review of one finished over DM) is handed off through the
+# same database to the process running that shard, which keeps the guild's only mod queue. Every
+# process logs to its own discord-<n>.log, writes spans to its own traces-<n>.jsonl and serves
+# metrics on config.METRICS_PORT + n.
+#
+#   python shardLauncher.py --shards 4 --processes 2
+import argparse
+import multiprocessing
+import config
+
+
+def split_shards(shard_count, processes):
+    # Round-robin so guilds (spread over shards by ID) are spread evenly over the processes
+    return [list(range(shard_count))[i::processes] for i in range(processes) if i < shard_count]
+
+
+def run_process(index, shard_ids, shard_count):
+    # Imported here so each child builds its own client
+    import bot
+    # Every process serves its own metrics, on consecutive ports
+    metrics_port = config.METRICS_PORT + index if config.METRICS_PORT is not None else None
+    trace_file = f'traces-{index}.jsonl' if config.TRACE_FILE is not None else None
+    bot.run(shard_ids=shard_ids, shard_count=shard_count, log_file=f'discord-{index}.log', metrics_port=metrics_port, trace_file=trace_file)
+
+
+def main(args):
+    if args.shards is None:
+        raise Exception("Set SHARD_COUNT in config.py (or pass --shards) so every process agrees on the shard count.")
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for index, shard_ids in enumerate(split_shards(args.shards, args.processes)):
+        process = context.Process(target=run_process, args=(index, shard_ids, args.shards), name=f'shards-{index}')
+        process.start()
+        print(f"Started process {process.pid} for shards {shard_ids}")
+        processes.append(process)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # The children got the Ctrl-C too; give them time to flush sessions and flag counts
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the bot's shards across several processes.")
+    parser.add_argument('--shards', type=int, default=config.SHARD_COUNT, help="Total number of gateway shards")
+    parser.add_argument('--processes', type=int, default=config.SHARD_PROCESSES, help="Number of bot processes")
+    main(parser.parse_args())
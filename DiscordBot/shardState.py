@@ -0,0 +1,45 @@
+# shardState.py
+
+
+def shard_id_for(guild_id, shard_count):
+    '''
+    The gateway shard Discord delivers a guild's events on. DMs (guild_id None) always arrive on shard 0.
+    '''
+    if guild_id is None or not shard_count:
+        return 0
+    return (guild_id >> 22) % shard_count
+
+
+class ShardState:
+    '''
+    State that belongs to the guilds of one gateway shard: the scoring queue for messages in their
+    monitored channels (None when classification runs in worker processes) and the queue of open
+    reports in their mod channels. A busy shard only backs up its own queues, and a process running
+    a subset of the shards only holds those shards' state.
+
+    Report sessions belong to users rather than guilds (a moderator's flow moves between the mod
+    channel and their DMs, which always arrive on shard 0), so they stay in the client's session
+    stores and are shared with other shard processes through the session database.
+    '''
+
+    def __init__(self, shard_id, scoring_queue, mod_queue):
+        self.shard_id = shard_id
+        self.scoring_queue = scoring_queue
+        self.mod_queue = mod_queue
+
+    def stats(self):
+        return {
+            'shard_id': self.shard_id,
+            'scoring': self.scoring_queue.stats() if self.scoring_queue else None,
+            'mod_queue': self.mod_queue.stats(),
+        }
+
+    def start(self):
+        if self.scoring_queue is not None:
+            self.scoring_queue.start()
+        self.mod_queue.start()
+
+    async def stop(self):
+        if self.scoring_queue is not None:
+            await self.scoring_queue.stop()
+        await self.mod_queue.stop()
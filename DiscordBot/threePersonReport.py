@@ -1,6 +1,10 @@
 from enum import Enum, auto
 import discord
-import re
+import metrics
+from tracing import TRACER, trace_id_for
+from sessionPersistence import message_ref, fetch_message_ref, fetch_user
+from outboundDispatcher import Priority
+from messageResolver import InvalidLink, UnknownGuild, UnknownChannel
 
 class ModState(Enum):
     REPORT_START = auto()
@@ -11,6 +15,8 @@ class ModState(Enum):
 
 class ThreePersonReport:
     START_KEYWORD = "mod"
+    # Plain attributes saved by to_state() so the review survives a restart
+    PERSISTED_FIELDS = ['follow_up_message_id', 'abuse_category_message_id', 'trace_id']
 
     def __init__(self, client, three_person_team_channel):
         self.state = ModState.REPORT_START
@@ -21,6 +27,9 @@ class ThreePersonReport:
         self.linked_message = None
         self.dm_channel = None
         self.three_person_team_channel = three_person_team_channel
+        self.abuse_category_message_id = None
+        self.cancelled = False
+        self.trace_id = None # Trace of the flagged message, once it has been found
     
     async def handle_message(self, message):
         '''
@@ -28,7 +37,7 @@ class ThreePersonReport:
         '''
 
         if message.content == self.START_KEYWORD:
-            await message.channel.send("Please paste the link to the message you want to review.")
+            await self.send(message.channel, "Please paste the link to the message you want to review.")
             self.state = ModState.AWAITING_MESSAGE
             self.mod_channel = message.channel
             # print('awaiting message')
@@ -36,35 +45,35 @@ class ThreePersonReport:
 
         if self.state == ModState.AWAITING_MESSAGE:
             # print('awaiting message')
-            # Parse out the three ID strings from the message link
             self.linked_message = message
-            m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
-            if not m:
-                await message.channel.send("I'm sorry, I couldn't read that link. Please try again.")
+            # Fetch the message the link points to; repeat lookups are served from the shared cache
+            try:
+                with metrics.timed('link_resolve'):
+                    self.flagged_message = await self.client.message_resolver.resolve(message.content)
+            except InvalidLink:
+                await self.send(message.channel, "I'm sorry, I couldn't read that link. Please try again.")
                 return
-            guild = self.client.get_guild(int(m.group(1)))
-            if not guild:
-                await message.channel.send("I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again.")
+            except UnknownGuild:
+                await self.send(message.channel, "I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again.")
                 return
-            channel = guild.get_channel(int(m.group(2)))
-            if not channel:
-                await message.channel.send("It seems this channel was deleted or never existed. Please try again.")
+            except UnknownChannel:
+                await self.send(message.channel, "It seems this channel was deleted or never existed. Please try again.")
                 return
-            try:
-                self.flagged_message = await channel.fetch_message(int(m.group(3)))
             except discord.errors.NotFound:
-                await message.channel.send("It seems this message was deleted or never existed. Please try again.")
+                await self.send(message.channel, "It seems this message was deleted or never existed. Please try again.")
                 return
 
             self.state = ModState.MESSAGE_IDENTIFIED
+            self.trace_id = trace_id_for(self.flagged_message.id)
+            TRACER.event(self.trace_id, 'review_started', flow='review team', moderator_id=message.author.id)
 
-            await message.channel.send(
+            await self.send(message.channel, 
                 f"I found this message and will now start the moderation process privately."
             )
 
             self.dm_channel = await message.author.create_dm()
 
-            sent_message = await self.dm_channel.send(
+            sent_message = await self.send(self.dm_channel, 
                 f"I found this message:\n"
                 f"```{self.flagged_message.author.name}: {self.flagged_message.content}```\n"
                 "Please approve this report. If approved, react with the corresponding number to take the appropriate action with the flagged message. Otherwise, send report to Trust and Safety Committee:\n"
@@ -77,78 +86,76 @@ class ThreePersonReport:
                 "7️⃣ - Cancel")
             self.abuse_category_message_id = sent_message.id
             self.follow_up_message_id = sent_message.id
-            for reaction in ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣']:
-                await sent_message.add_reaction(reaction)
+            self.client.outbound.add_reactions(sent_message, ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣'], self.outbound_priority())
             return
     
     async def handle_reaction(self, payload, message):
         if payload.message_id != self.follow_up_message_id:
             # If the reaction is not on the follow-up message, ignore it
-            await self.dm_channel.send("Please react to the message that contains emoji options to choose from.")
+            await self.send(self.dm_channel, "Please react to the message that contains emoji options to choose from.")
             return
             
         reaction = str(payload.emoji)
         if self.state == ModState.MESSAGE_IDENTIFIED:
             if reaction == '1️⃣':
                 # remove post
-                await self.dm_channel.send("Removing post.")
-                await self.flagged_message.delete()
-                await self.dm_channel.send("Post has been removed. This moderation process is complete.")
+                await self.send(self.dm_channel, "Removing post.")
+                await self.remove_post('remove')
+                await self.send(self.dm_channel, "Post has been removed. This moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '2️⃣':
                 user = self.flagged_message.author.name
                 # suspend user
-                await self.flagged_message.channel.send(f"User {user} has been suspended for 3 days.")
+                await self.send(self.flagged_message.channel, f"User {user} has been suspended for 3 days.")
                 # remove post
-                await self.dm_channel.send("Removing post...")
-                await self.flagged_message.delete()
+                await self.send(self.dm_channel, "Removing post...")
+                await self.remove_post('suspend')
 
-                await self.dm_channel.send(f"Suspended user {user} for 3 days and removed post. This moderation process is complete.")
+                await self.send(self.dm_channel, f"Suspended user {user} for 3 days and removed post. This moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '3️⃣':
                 user = self.flagged_message.author.name
                 # ban user
-                await self.flagged_message.channel.send(f"User {user} has been banned.")
+                await self.send(self.flagged_message.channel, f"User {user} has been banned.")
                 # remove post
-                await self.dm_channel.send("Removing post...")
-                await self.flagged_message.delete()
+                await self.send(self.dm_channel, "Removing post...")
+                await self.remove_post('ban')
 
-                await self.dm_channel.send(f"Banned user {user} and removed post. This moderation process is complete.")
+                await self.send(self.dm_channel, f"Banned user {user} and removed post. This moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '4️⃣':
                 user = self.flagged_message.author.name
                 # ban user
-                await self.flagged_message.channel.send(f"User {user} has been banned.")
+                await self.send(self.flagged_message.channel, f"User {user} has been banned.")
                 # remove post
-                await self.dm_channel.send("Removing post...")
-                await self.flagged_message.delete()
+                await self.send(self.dm_channel, "Removing post...")
+                await self.remove_post('ban_and_report')
 
                 # contact authorities
                 # do nothing for now
 
-                await self.dm_channel.send(f"Sent automatic report to law enforcement, banned user {user}, and removed post. This moderation process is complete.")
+                await self.send(self.dm_channel, f"Sent automatic report to law enforcement, banned user {user}, and removed post. This moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '5️⃣':
                 user = self.flagged_message.author.name
                 
                 # remove post
-                await self.dm_channel.send("Removing post...")
-                await self.flagged_message.delete()
+                await self.send(self.dm_channel, "Removing post...")
+                await self.remove_post('remove_and_report_aps')
 
                 # contact APS
                 # do nothing for now
 
-                await self.dm_channel.send(f"Sent automatic report animal protection services and removed post. This moderation process is complete.")
+                await self.send(self.dm_channel, f"Sent automatic report animal protection services and removed post. This moderation process is complete.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '6️⃣':
                 # send report to Trust and Safety Committee
                 # do nothing for now
 
-                await self.dm_channel.send("Sent report to Trust and Safety Committee. This moderation process will be pending further approval.")
+                await self.send(self.dm_channel, "Sent report to Trust and Safety Committee. This moderation process will be pending further approval.")
                 self.state = ModState.REPORT_COMPLETE
             elif reaction == '7️⃣':
-                await self.dm_channel.send("Canceled manual moderation.")
-                self.state = ModState.REPORT_COMPLETE
+                await self.cancel()
             else:
                 # Invalid reaction, ignore it
                 return
@@ -158,11 +165,53 @@ class ThreePersonReport:
     
     async def send_follow_up_question(self, question):
         # Send a follow-up question and update the state
-        # sent_message = await self.flagged_message.channel.send(question)
-        sent_message = await self.dm_channel.send(question)
+        # sent_message = await self.send(self.flagged_message.channel, question)
+        sent_message = await self.send(self.dm_channel, question)
         self.follow_up_message_id = sent_message.id
         # self.state = ModState.FOLLOW_UP_QUESTION_AWAITING_ANSWER
 
+    def prompt_message_id(self):
+        return self.follow_up_message_id
+
+    async def remove_post(self, action):
+        with TRACER.span(self.trace_id, 'removal', flow='review team', category=action):
+            await self.client.outbound.delete(self.flagged_message, self.outbound_priority())
+
+    async def cancel(self):
+        await self.send(self.dm_channel, "Canceled manual moderation.")
+        self.cancelled = True
+        self.state = ModState.REPORT_COMPLETE
+
+    def outbound_priority(self):
+        return Priority.NORMAL
+
+    async def send(self, channel, content):
+        return await self.client.outbound.send(channel, content, priority=self.outbound_priority())
+
+    def to_state(self):
+        state = {field: getattr(self, field) for field in self.PERSISTED_FIELDS}
+        state['state'] = self.state.name
+        state['flagged_message'] = message_ref(self.flagged_message)
+        state['linked_message'] = message_ref(self.linked_message)
+        state['mod_channel'] = self.mod_channel.id if self.mod_channel else None
+        state['review_channel'] = self.three_person_team_channel.id if self.three_person_team_channel else None
+        return state
+
+    @classmethod
+    async def restore(cls, client, moderator_id, state, three_person_team_channel):
+        report = cls(client, three_person_team_channel)
+        for field in cls.PERSISTED_FIELDS:
+            setattr(report, field, state.get(field))
+        report.state = ModState[state['state']]
+        report.flagged_message = await fetch_message_ref(client, state['flagged_message'])
+        report.linked_message = await fetch_message_ref(client, state['linked_message'])
+        if state['mod_channel'] is not None:
+            report.mod_channel = client.get_channel(state['mod_channel'])
+        if report.flagged_message is not None:
+            moderator = await fetch_user(client, moderator_id)
+            report.dm_channel = await moderator.create_dm()
+        return report
+
     def report_complete(self):
         return self.state == ModState.REPORT_COMPLETE
 
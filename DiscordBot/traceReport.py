@@ -0,0 +1,126 @@
+# traceReport.py
+# Reads the spans the bot traced (config.TRACE_FILE, or traces-<index>.jsonl from each
+# shardLauncher.py process) and prints how long flagged messages took to act on: from the moment a
+# message was flagged (its classification, or the user report that led to the mod channel post) to
+# the first moderator review and to its removal. Latencies are grouped by the category of the flag
+# (the Perspective/OpenAI subcategory or the user report's category) or, with --by action, by what
+# the moderator or review team did.
+#
+#   python traceReport.py traces.jsonl
+#   python traceReport.py traces-*.jsonl --by action
+import argparse
+import json
+from collections import defaultdict
+
+# Spans that mark when a message was flagged, either automatically or by a user report
+FLAG_SPANS = ('classify', 'user_report_started', 'mod_channel_post')
+# Category of a mod channel post that went out before the LLM named its subcategory (bot.PENDING_SUBCATEGORY)
+PENDING_CATEGORY = "Classifying..."
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def load(paths):
+    # Map from trace ID to its spans; spans written by different processes share trace IDs
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    span = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line of a file still being written may be cut off
+                    continue
+                traces[span['trace_id']].append(span)
+    return traces
+
+
+def summarize(spans, by):
+    '''
+    Returns (category, seconds to first review, seconds to removal) for one trace, with None for
+    the parts that never happened, or None if the message was never flagged.
+    '''
+    flags = [span for span in spans if span['name'] in FLAG_SPANS]
+    if not flags:
+        return None
+    flagged_at = min(span['start'] for span in flags)
+    # A moderator can look at a message before anything flagged it; that isn't a reaction to the flag
+    reviews = [span['start'] for span in spans if span['name'] == 'review_started' and span['start'] >= flagged_at]
+    removals = sorted(
+        (span for span in spans if span['name'] == 'removal' and span['end'] >= flagged_at),
+        key=lambda span: span['end'],
+    )
+
+    if by == 'action':
+        category = removals[0]['attributes'].get('category') if removals else None
+    else:
+        category = flag_category(spans)
+    review = min(reviews) - flagged_at if reviews else None
+    removal = removals[0]['end'] - flagged_at if removals else None
+    return category or 'unknown', review, removal
+
+
+def flag_category(spans):
+    # The subcategory filled in after an automatic flag was posted wins over the placeholder it was posted with
+    categorized = sorted((span for span in spans if span['name'] == 'categorized'), key=lambda span: span['start'])
+    if categorized:
+        return categorized[0]['attributes'].get('category')
+    posts = sorted((span for span in spans if span['name'] == 'mod_channel_post'), key=lambda span: span['start'])
+    for post in posts:
+        category = post['attributes'].get('category')
+        if category != PENDING_CATEGORY:
+            return category
+    return PENDING_CATEGORY if posts else None
+
+
+def print_table(title, rows):
+    print(title)
+    if not rows:
+        print("  (nothing traced)")
+        return
+    print(f"  {'category':<32} {'count':>7} {'p50 s':>10} {'p90 s':>10} {'p99 s':>10} {'max s':>10}")
+    for category, values in sorted(rows.items()):
+        print(
+            f"  {category:<32} {len(values):>7} {percentile(values, 50):>10.2f} {percentile(values, 90):>10.2f} "
+            f"{percentile(values, 99):>10.2f} {max(values):>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize flag-to-action latency from traced spans.")
+    parser.add_argument('files', nargs='+', help="JSON Lines files written by the bot's tracer")
+    parser.add_argument('--by', choices=['flag', 'action'], default='flag', help="Group by the category of the flag or by the action taken")
+    args = parser.parse_args()
+
+    traces = load(args.files)
+    reviews = defaultdict(list)
+    removals = defaultdict(list)
+    flagged = 0
+    for spans in traces.values():
+        summary = summarize(spans, args.by)
+        if summary is None:
+            continue
+        flagged += 1
+        category, review, removal = summary
+        if review is not None:
+            reviews[category].append(review)
+        if removal is not None:
+            removals[category].append(removal)
+
+    removed = sum(len(values) for values in removals.values())
+    print(f"{len(traces)} traces, {flagged} flagged messages, {removed} removed")
+    print()
+    print_table("Flag to removal", removals)
+    print()
+    print_table("Flag to first moderator review", reviews)
+
+
+if __name__ == '__main__':
+    main()
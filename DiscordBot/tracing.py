@@ -0,0 +1,157 @@
+# tracing.py
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def trace_id_for(message_id):
+    '''
+    The trace of everything that happens to a flagged message. It is derived from the message's ID,
+    so every shard process, restored session and review flow that gets hold of the message agrees
+    on it without passing it around.
+    '''
+    return f'{message_id:032x}'
+
+
+class JsonlExporter:
+    '''
+    Appends finished spans to a JSON Lines file, one object per line. export() only queues the span;
+    a writer thread does the file I/O so the event loop never waits on disk.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.file = open(path, 'a', encoding='utf-8')
+        self.writer = threading.Thread(target=self.write, name='trace-writer', daemon=True)
+        self.writer.start()
+
+    def export(self, span):
+        self.queue.put(span)
+
+    def write(self):
+        while True:
+            spans = [self.queue.get()]
+            # Everything that piled up while the last batch was written goes out with one flush
+            while not self.queue.empty():
+                spans.append(self.queue.get())
+            try:
+                self.file.writelines(json.dumps(span) + '\n' for span in spans if span is not None)
+                self.file.flush()
+            except Exception:
+                logger.exception(f"Failed to write spans to {self.path}")
+            if None in spans:
+                return
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+        self.file.close()
+
+
+class Span:
+    '''
+    Context manager that exports one span from entering to leaving it. set() adds attributes, e.g.
+    an outcome that is only known at the end.
+    '''
+    __slots__ = ('tracer', 'trace_id', 'name', 'attributes', 'start')
+
+    def __init__(self, tracer, trace_id, name, attributes):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.tracer.record(self.trace_id, self.name, self.start, time.time(), **self.attributes)
+        return False
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+
+class Tracer:
+    '''
+    Emits spans for the hops a flagged message takes: ingest and classification, the mod-channel
+    embed, each moderator and review team step, and the action taken. Every span carries the trace
+    ID of the flagged message (see trace_id_for) and wall-clock start and end times, so spans written
+    by different processes line up.
+
+    Nothing is recorded until start() is given an exporter. Since most monitored messages are never
+    flagged, ingest only marks when a message arrived (at most max_marks are remembered) and the
+    classification span is emitted from that mark once a message is flagged.
+    '''
+
+    def __init__(self, max_marks=10000):
+        self.max_marks = max_marks
+        self.exporter = None
+        self.marks = OrderedDict() # Map from trace ID to when its message arrived
+        self.process = os.getpid()
+
+        # Metrics
+        self.spans = 0
+        self.dropped_marks = 0
+
+    def stats(self):
+        return {'enabled': self.exporter is not None, 'spans': self.spans, 'marks': len(self.marks), 'dropped_marks': self.dropped_marks}
+
+    def start(self, exporter, max_marks=None):
+        self.exporter = exporter
+        if max_marks is not None:
+            self.max_marks = max_marks
+        self.process = os.getpid()
+
+    def stop(self):
+        if self.exporter is not None:
+            self.exporter.close()
+            self.exporter = None
+
+    def mark(self, trace_id):
+        if self.exporter is None:
+            return
+        self.marks[trace_id] = time.time()
+        while len(self.marks) > self.max_marks:
+            self.marks.popitem(last=False)
+            self.dropped_marks += 1
+
+    def take_mark(self, trace_id):
+        return self.marks.pop(trace_id, None)
+
+    def span(self, trace_id, name, **attributes):
+        return Span(self, trace_id, name, attributes)
+
+    def event(self, trace_id, name, **attributes):
+        now = time.time()
+        self.record(trace_id, name, now, now, **attributes)
+
+    def record(self, trace_id, name, start, end, **attributes):
+        if self.exporter is None or trace_id is None:
+            return
+        self.spans += 1
+        self.exporter.export({
+            'trace_id': trace_id,
+            'span_id': secrets.token_hex(8),
+            'name': name,
+            'start': start,
+            'end': end,
+            'duration_ms': (end - start) * 1000,
+            'process': self.process,
+            'attributes': attributes,
+        })
+
+
+# The tracer of this process; modules record into it
+TRACER = Tracer()
@@ -0,0 +1,77 @@
+# trainLocalClassifier.py
+# Trains the local pre-classifier from labeled JSONL, one object per line:
+#   {"text": "good morning everyone", "label": 0}
+#   {"text": "...", "label": 1}
+# The benign threshold is chosen on a holdout split so that at least --target-recall of the
+# toxic holdout messages are still sent to Perspective.
+#
+#   python trainLocalClassifier.py labeled.jsonl --out local_classifier.npz
+import argparse
+import json
+import numpy as np
+from localClassifier import HashingVectorizer, LocalClassifier, train
+
+
+def load_examples(path):
+    texts, labels = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            example = json.loads(line)
+            texts.append(example['text'])
+            labels.append(1 if example['label'] in (1, True, '1', 'toxic') else 0)
+    return texts, np.array(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local benign-message pre-classifier.")
+    parser.add_argument('data', help="Labeled JSONL file")
+    parser.add_argument('--out', default='local_classifier.npz')
+    parser.add_argument('--target-recall', type=float, default=0.99, help="Share of toxic messages that must still reach Perspective")
+    parser.add_argument('--holdout', type=float, default=0.2)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--learning-rate', type=float, default=0.5)
+    parser.add_argument('--n-features', type=int, default=2 ** 18)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    texts, labels = load_examples(args.data)
+    order = np.random.default_rng(args.seed).permutation(len(texts))
+    split = int(len(order) * (1 - args.holdout))
+    train_idx, holdout_idx = order[:split], order[split:]
+
+    vectorizer = HashingVectorizer(args.n_features)
+    weights, bias = train(
+        [texts[i] for i in train_idx], labels[train_idx], vectorizer,
+        epochs=args.epochs, learning_rate=args.learning_rate, seed=args.seed,
+    )
+    model = LocalClassifier(weights, bias, vectorizer, benign_threshold=0.0)
+
+    holdout_labels = labels[holdout_idx]
+    probabilities = model.predict_proba([texts[i] for i in holdout_idx])
+    toxic = np.sort(probabilities[holdout_labels == 1])
+    if toxic.size:
+        # Everything at or below this probability is skipped; keep target_recall of toxic messages above it
+        allowed = int(toxic.size * (1 - args.target_recall))
+        if allowed < toxic.size:
+            # Just below the first toxic score that must be kept, so ties with it aren't skipped
+            model.benign_threshold = float(np.nextafter(toxic[allowed], -np.inf))
+        else:
+            model.benign_threshold = float(toxic[-1])
+    # The same test the cascade applies at runtime
+    skipped = model.is_benign(probabilities)
+    model.holdout_recall_loss = float(skipped[holdout_labels == 1].mean()) if toxic.size else 0.0
+    model.save(args.out)
+
+    benign_total = int((holdout_labels == 0).sum())
+    print(f"trained on {len(train_idx)} messages, evaluated on {len(holdout_idx)}")
+    print(f"benign threshold:        {model.benign_threshold:.4f}")
+    print(f"API calls saved:         {skipped.mean() if skipped.size else 0.0:.1%} of holdout messages")
+    print(f"benign messages skipped: {skipped[holdout_labels == 0].sum()}/{benign_total}")
+    print(f"recall cost:             {model.holdout_recall_loss:.2%} of toxic messages skipped")
+    print(f"saved model to {args.out}")
+
+
+if __name__ == '__main__':
+    main()